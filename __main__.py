@@ -1,33 +1,95 @@
 import argparse
-from api.crypto.exchange import Exchange
-from api.crypto.bitflyer.bitflyer import Bitflyer
+import asyncio
+from api.crypto.registry import ExchangeRegistry
 from config.config import Config
 from bot.simulator import Simulator
 from datetime import datetime, timedelta
-from tools.common import get_unique_name
+from pathlib import Path
+from typing import Callable, Dict, List
+from tools.constants import MarketInfo
+from tradeengine.tools.log import log
+from tradeengine.live.engine import Decision, LiveEngine
+from tradeengine.models.trade import Trade
+from tradeengine.simulator.sweep import make_grid
+from tradeengine.tools.common import create_folder_if_not_exists
 
 def main() -> None:
     # init
-    c = Config()
-    e = Bitflyer(c.bitflyer.symbols, c.bitflyer.dry_run_symbols)
-    symbol_trades_dict = e.fetch_trades()
+    registry = ExchangeRegistry.from_config()
+
+    _log = log('live.log', 'live')
+    # one engine per exchange (candlestick intervals may differ), all fed from one event loop
+    engines:Dict[str, LiveEngine] = {}
+    # newest warmed-up trades, the feed starts after them
+    lastest:Dict[str, Dict[str, List[Trade]]] = {}
+    for e in registry:
+        engine = LiveEngine(e.symbols, timedelta(minutes=e.candlestick_interval), MarketInfo.CANDLESTICK_NUMS, on_decision=_log_decision(e.exchange_name, _log))
+        # history first, then realtime trades update the same candlesticks and indicators
+        lastest[e.exchange_name] = {}
+        for symbol, trades in e.fetch_trades(datetime.now() - timedelta(days=1)).items():
+            engine.warm_up(symbol, trades)
+            lastest[e.exchange_name][symbol] = [trade for trade in trades if trade.execution_time == trades[0].execution_time]
+        engines[e.exchange_name] = engine
+    try:
+        asyncio.run(_trade(registry, engines, lastest))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for exchange_name, engine in engines.items():
+            print(f'{exchange_name}: {engine.report()}')
+
+def _log_decision(exchange_name:str, _log:log) -> Callable[[Decision], None]:
+    """on_decision of LiveEngine, decisions are only logged (same as simulator fills), no order is placed"""
+    def on_decision(decision:Decision) -> None:
+        _log.info(f'{decision.time}, {exchange_name}, {decision.symbol}, {decision.candlestick.Opentime}, {decision.status.name}, {decision.latency / 1e6:.3f}ms')
+    return on_decision
+
+async def _trade(registry:ExchangeRegistry, engines:Dict[str, LiveEngine], lastest:Dict[str, Dict[str, List[Trade]]]) -> None:
+    timers = [asyncio.create_task(engine.close_by_clock()) for engine in engines.values()]
+    try:
+        async for exchange_name, event in registry.stream_trades(lastest):
+            engines[exchange_name].on_trades(event)
+    finally:
+        for timer in timers:
+            timer.cancel()
 
-def simulator() -> None:
+def simulator(offline:bool=False) -> None:
+    for e in ExchangeRegistry.from_config():
+        Simulator(e).run(last_days=10, offline=offline)
+
+def sweep(offline:bool=False) -> None:
     c = Config()
-    e = Bitflyer(c.bitflyer.symbols, c.bitflyer.dry_run_symbols)
-    Simulator(e).run(last_days=10)
+    for e in ExchangeRegistry.from_config(c):
+        invest = c.exchange(e.exchange_name).invest_money
+        configs = make_grid(
+            candlestick_intervals=[1, 5, 15],
+            fetch_intervals=[1, 5],
+            invests=[invest / 2, invest, invest * 2],
+            loss_cuts=[c.exchange(e.exchange_name).loss_cut],
+            strategies=['simple'],
+        )
+        result = Simulator(e).sweep(configs, last_days=10, offline=offline)
+        folder = Path('output', 'sweep')
+        create_folder_if_not_exists(folder)
+        result.to_csv(folder.joinpath(f'sweep_{e.exchange_name}_{datetime.now():%Y%m%d%H%M%S}.csv'), index=False)
+        print(result.head(20))
+
+def replay(speed:float, offline:bool=False) -> None:
+    for e in ExchangeRegistry.from_config():
+        decisions, _, _ = Simulator(e).replay(last_days=10, speed=speed if speed > 0 else None, offline=offline)
+        for decision in decisions:
+            if decision.status.name != 'HOLD':
+                print(f'{decision.time} {e.exchange_name} {decision.symbol} {decision.candlestick.Opentime} {decision.status.name}')
 
-def update_model() -> None:
+def update_model(offline:bool=False, n_envs:int=1) -> None:
     # TODO: sepreate
-    c = Config()
-    e = Bitflyer(c.bitflyer.symbols, c.bitflyer.dry_run_symbols)
-    Simulator(e).test_ml(training_test_ratio=0.8)
+    for e in ExchangeRegistry.from_config():
+        Simulator(e).test_ml(training_test_ratio=0.8, offline=offline, n_envs=n_envs)
 
-def find_best() -> None:
-    c = Config()
-    e = Bitflyer(c.bitflyer.symbols, c.bitflyer.dry_run_symbols)
+def find_best(offline:bool=False) -> None:
     since = datetime.now() - timedelta(days=90)
-    Simulator(e).find_best_trade(since)
+    for e in ExchangeRegistry.from_config():
+        Simulator(e).find_best_trade(since, offline=offline)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="tradebot")
@@ -36,7 +98,13 @@ if __name__ == '__main__':
     subparsers.add_parser("trade", help="trade mode, default mode")
     sub_simulate = subparsers.add_parser("simulate", help="simulate past data")
     sub_simulate.add_argument("--find_best_trade", action="store_true", help="Find the best trades")
-    subparsers.add_parser("update_model", help="update bot's model")
+    sub_simulate.add_argument("--sweep", action="store_true", help="backtest a grid of settings")
+    sub_simulate.add_argument("--replay", action="store_true", help="replay stored trades through the live engine")
+    sub_simulate.add_argument("--speed", type=float, default=0, help="replay speed, 1 is real time, 0 is as fast as possible")
+    sub_simulate.add_argument("--offline", action="store_true", help="use cached data only, without api and db")
+    sub_update_model = subparsers.add_parser("update_model", help="update bot's model")
+    sub_update_model.add_argument("--offline", action="store_true", help="use cached data only, without api and db")
+    sub_update_model.add_argument("--n_envs", type=int, default=4, help="environments stepped in parallel while training")
 
     args = parser.parse_args()
 
@@ -48,8 +116,12 @@ if __name__ == '__main__':
         main()
     elif args.mode == "simulate":
         if args.find_best_trade:
-            find_best()
+            find_best(args.offline)
+        elif args.sweep:
+            sweep(args.offline)
+        elif args.replay:
+            replay(args.speed, args.offline)
         else:
-            simulator()
+            simulator(args.offline)
     elif args.mode == "update_model":
-        update_model()
\ No newline at end of file
+        update_model(args.offline, args.n_envs)
\ No newline at end of file
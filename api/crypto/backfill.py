@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+import time
+from typing import Callable, Dict, List, Optional
+
+from api.db.common import IngestReport
+
+@dataclass
+class IdRange:
+    """
+    trades of one symbol with lower_id < id < upper_id, fetched from upper_id backward
+    upper_id: None, from the lastest trade
+    lower_id: None, stop by since (the oldest range, lower id is not known)
+    """
+    symbol: str
+    upper_id: Optional[int]
+    lower_id: Optional[int]
+    since: datetime
+
+def split_id_range(symbol:str, upper_id:int, lower_id:Optional[int], estimated_lower_id:int, since:datetime, parts:int) -> List[IdRange]:
+    """
+    split (lower_id, upper_id) into parts ranges of same id width, DESC
+    lower_id: None if unknown, estimated_lower_id is used to split and the oldest range stops by since
+    """
+    lower = lower_id if lower_id is not None else estimated_lower_id
+    parts = max(1, min(parts, upper_id - lower - 1))
+    if parts <= 1:
+        return [IdRange(symbol, upper_id, lower_id, since)]
+
+    width = (upper_id - lower) / parts
+    # lower_id of a range is exclusive, the next range starts from it (upper_id = bound + 1)
+    bounds = [int(upper_id - width * i) for i in range(1, parts)]
+    uppers = [upper_id] + [bound + 1 for bound in bounds]
+    lowers = bounds + [lower_id]
+    return [IdRange(symbol, upper, lower_bound, since) for upper, lower_bound in zip(uppers, lowers)]
+
+def run_backfill(ranges:List[IdRange], sync_range:Callable[[IdRange], IngestReport], max_workers:int) -> Dict[str, IngestReport]:
+    """
+    run sync_range of all ranges (all symbols) in threads, api rate limit must be shared by sync_range
+    return: report of each symbol, seconds is the wall time of the whole backfill
+    """
+    reports:Dict[str, IngestReport] = {}
+    if not ranges:
+        return reports
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges))), thread_name_prefix='backfill') as executor:
+        for _range, report in zip(ranges, executor.map(sync_range, ranges)):
+            reports[_range.symbol] = reports.get(_range.symbol, IngestReport(0, 0, 0.0)) + report
+    seconds = time.perf_counter() - start
+    return {symbol: IngestReport(report.rows, report.inserted, seconds) for symbol, report in reports.items()}
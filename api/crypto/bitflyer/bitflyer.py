@@ -1,23 +1,27 @@
 from datetime import datetime, timedelta, timezone
-from typing import Dict, List, Optional
-from threading import Lock, Condition
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from concurrent.futures import Future
 import ccxt
-import asyncio
 
+from api.crypto.bitflyer.stream import BITFLYER_WS_URL, stream_executions
+from api.crypto.backfill import IdRange, run_backfill, split_id_range
 from api.crypto.exchange import Exchange
-from api.db.trade import bulk_insert_trade, get_trades, get_lastest_trade_time, get_oldest_trade_time
+from api.db.common import IngestReport, format_pool_metrics
+from api.db.candlestick import materialize_candlesticks
+from api.db.file_cache import invalidate_cache, load_candlesticks, load_trades
+from api.db.trade import TradeGap, bulk_insert_trade, find_trade_gaps, get_lastest_trade_id, get_lastest_trade_time, get_oldest_trade_id, get_oldest_trade_time, init_trade_tables, mark_trade_gaps_checked
+from tradeengine.live.engine import TradeEvent
 from tradeengine.models.trade import Trade, Side
 from tradeengine.models.candlestick import CandleStick
-from tradeengine.tools.convertor import ConvertTradeToCandleStick
-from tools.common import get_now, local_2_utc
+from tradeengine.tools.convertor import smallest_interval
+from tools.common import get_now, local_2_utc, run_async, submit_async
 from tools.constants import MarketInfo
 
-# public api limit: 500/5min
-_public_cnt:int = 0
-_public_datetime:Optional[datetime] = None
-_public_api_lock = Lock() 
-_public_api_condition = Condition(_public_api_lock)
+# public api limit: 500/5min, keep 5 for other processes
+_PUBLIC_API_LIMIT = (495, 300)
 # TODO: private api limit 500/5min (not trade so many times)?
+# requests sent at once before pacing starts
+_API_BURST = 10
 
 class Bitflyer(Exchange):
     def __init__(self, symbols: List[str], dry_run: List[str]):
@@ -30,106 +34,219 @@ class Bitflyer(Exchange):
         self.fetch_data_interval_minute:int = 1
         # tech analysis
         self.candlestick_interval:int = 5
+        self.public_api_limit = (*_PUBLIC_API_LIMIT, _API_BURST)
+        # backfill: threads shared by all symbols, id ranges per symbol
+        self.backfill_workers:int = 8
+        self.backfill_parts:int = 4
+        # no trades longer than this in db is a gap, fetched again from api
+        self.trade_gap:timedelta = timedelta(minutes=10)
 
         # cache
         self.cache_trades:List[Trade]
         self.cache_candlesticks:List[Trade]
 
     def _public_api_limit(self) -> None:
-        """call this method before call api"""
-        global _public_cnt, _public_datetime
-        
+        """call this method before call public api, token bucket shared by all threads of this process"""
+        self.public_rate_limiter().acquire()
+
+    def fetch_trades(self, since:Optional[datetime]=None, offline:bool=False) -> Dict[str, List[Trade]]:
         now = get_now()
+        if not since:
+            since = now - timedelta(days=30) # max histroy of bitflyer is past 31 days
+        since = local_2_utc(since)
 
-        with _public_api_lock:
-            if _public_datetime is None or (now - _public_datetime > timedelta(minutes=5)):
-                _public_datetime = now
-                _public_cnt = 0
+        if not offline:
+            # all symbols are fetched concurrently
+            self.sync_trades(since)
+        # read through file cache, only changed days are read from db
+        return {symbol: run_async(load_trades(self.exchange_name, symbol, since, offline=offline)).to_trades() for symbol in self.symbols}
 
-            # over limit
-            if _public_cnt >= (500 - 5):
-                wait_time = 300 - (now - _public_datetime).total_seconds()
-                print(f"Public API limit reached. Waiting for {wait_time:.2f} seconds.")
-                if wait_time > 0:
-                    _public_api_condition.wait(timeout=wait_time)
+    def fetch_recent_trades(self, symbol:str) -> List[Trade]:
+        _trades = self.exchange.fetch_trades(symbol, limit=500) # max limit for bitflyer is 500
+        return [self._api_2_db_trade(_t) for _t in reversed(_trades)]
 
-                _public_datetime = get_now()
-                _public_cnt = 0
+    def fetch_trades_after(self, symbol:str, since:datetime, after_id:Optional[str]=None, max_pages:int=20) -> Tuple[List[Trade], bool]:
+        """page backward from the lastest trade, ids of bitflyer are increasing"""
+        since = local_2_utc(since)
+        trades:List[Trade] = []
+        before_id = None
+        for _ in range(max_pages):
+            self._public_api_limit()
+            if before_id is None:
+                _trades = self.exchange.fetch_trades(symbol, limit=500) # max limit for bitflyer is 500
+            else:
+                _trades = self.exchange.fetch_trades(symbol, limit=500, params={'before': before_id}) # max limit for bitflyer is 500
+            if not _trades:
+                return trades, True
+            # DESC
+            _trades_ = [self._api_2_db_trade(_t) for _t in reversed(_trades)]
+            trades.extend(
+                _t for _t in _trades_
+                if (int(_t.id) > int(after_id) if after_id is not None else _t.execution_time > since)
+            )
+            oldest = _trades_[-1]
+            if oldest.execution_time <= since or (after_id is not None and int(oldest.id) <= int(after_id)):
+                return trades, True
+            before_id = oldest.id
+        return trades, False
 
-            _public_cnt += 1
-            _public_api_condition.notify_all()
+    def stream_trades(self, url:Optional[str]=None, lastest:Optional[Dict[str, Trade]]=None) -> AsyncIterator[TradeEvent]:
+        # realtime api has no rate limit, reconnects when the connection is lost and fills the missed trades from api
+        return stream_executions(self.symbols, url or BITFLYER_WS_URL, backfill=self.fetch_trades_after, lastest=lastest)
 
-    def fetch_trades(self, since:Optional[datetime]=None) -> Dict[str, List[Trade]]:
-        # TODO cache
-        now = get_now()
+    def sync_trades(self, since:Optional[datetime]=None) -> None:
         if not since:
-            since = now - timedelta(days=30) # max histroy of bitflyer is past 31 days
+            since = get_now() - timedelta(days=30) # max histroy of bitflyer is past 31 days
         since = local_2_utc(since)
 
-        res = {}
-        # TODO: multi process?
-        # histroy data are too many, no multi process is better
-        for symbol in self.symbols:
-            res[symbol] = self._fetch_trades(since, symbol)
-        return res
+        run_async(init_trade_tables(self.exchange_name, self.symbols))
+        self._sync_trades(since, self.symbols)
 
-    def _fetch_trades(self, since:datetime, symbol:str) -> List[Trade]:
-        # TODO: consider missing data in db
-        # get db lastest data ~ now
-        now = get_now()
-        last_days = (local_2_utc(now) - since).days
+    def _sync_trades(self, since:datetime, symbols:List[str]) -> Dict[str, Optional[datetime]]:
+        """
+        save trades from api to db: new trades, trades older than the oldest stored one, and gaps in stored trades
+        symbols and id ranges of each symbol are fetched concurrently
+        return: {symbol: oldest time of filled trades older than the lastest stored one, None if nothing},
+                candlesticks and file cache since it are rebuilt
+        """
+        ranges:List[IdRange] = []
+        gaps:Dict[str, List[TradeGap]] = {}
+        filled_since:Dict[str, Optional[datetime]] = {}
+        for symbol in symbols:
+            gaps[symbol] = run_async(find_trade_gaps(self.exchange_name, symbol, since, self.trade_gap))
+            gap_ranges = self._plan_gaps(since, symbol, gaps[symbol])
+            filled_since[symbol] = min((_range.since for _range in gap_ranges), default=None)
+            ranges.extend(gap_ranges)
+            ranges.extend(self._plan_backfill(since, symbol))
+
+        reports = run_backfill(ranges, self._sync_id_range, self.backfill_workers)
+        for symbol in symbols:
+            # gaps still there have no trades, skip them next time
+            run_async(mark_trade_gaps_checked(self.exchange_name, symbol, gaps[symbol]))
+            if filled_since[symbol] is not None:
+                invalidate_cache(self.exchange_name, symbol, filled_since[symbol])
+        for symbol, report in reports.items():
+            print(f'{self.exchange_name} {symbol} trades saved: {report}, gaps: {len(gaps[symbol])}')
+        print(f'{self.exchange_name} public api: {self.public_rate_limiter().metrics}')
+        print(f'db pool: {format_pool_metrics()}')
+        return filled_since
+
+    def _plan_gaps(self, since:datetime, symbol:str, gaps:List[TradeGap]) -> List[IdRange]:
+        """id ranges of missing trades: before the oldest stored trade (until since) and between stored trades"""
+        ranges:List[IdRange] = []
+        _oldest_time = run_async(get_oldest_trade_time(self.exchange_name, symbol))
+        if _oldest_time is not None and _oldest_time - since > self.trade_gap:
+            _oldest_id = run_async(get_oldest_trade_id(self.exchange_name, symbol))
+            ranges.append(IdRange(symbol, int(_oldest_id), None, since))
+        ranges.extend(IdRange(symbol, int(gap.upper_id), int(gap.lower_id), gap.lower_time) for gap in gaps)
+        return ranges
 
-        _lastest_time = asyncio.run(get_lastest_trade_time(self.exchange_name, symbol))
+    def _plan_backfill(self, since:datetime, symbol:str) -> List[IdRange]:
+        """split trades between db lastest trade (or since) and now into id ranges, ids of bitflyer are increasing"""
+        # get db lastest data ~ now
+        lower_id:Optional[int] = None
+        _lastest_time = run_async(get_lastest_trade_time(self.exchange_name, symbol))
         if _lastest_time is not None:
             since = _lastest_time
+            lower_id = int(run_async(get_lastest_trade_id(self.exchange_name, symbol)))
+
+        # lastest page, upper bound of ids and id rate to estimate the id at since
+        self._public_api_limit()
+        _trades = self.exchange.fetch_trades(symbol, limit=500) # max limit for bitflyer is 500
+        if not _trades:
+            return []
+        trades = [self._api_2_db_trade(_t) for _t in _trades]
+        run_async(bulk_insert_trade(self.exchange_name, symbol, trades))
 
+        oldest, lastest = trades[0], trades[-1]
+        if oldest.execution_time <= since or (lower_id is not None and int(oldest.id) <= lower_id):
+            return []
+        seconds = (lastest.execution_time - oldest.execution_time).total_seconds()
+        ids_per_second = (int(lastest.id) - int(oldest.id)) / seconds if seconds > 0 else 0.0
+        estimated_lower_id = int(int(oldest.id) - ids_per_second * (oldest.execution_time - since).total_seconds())
+        return split_id_range(symbol, int(oldest.id), lower_id, max(estimated_lower_id, 0), since, self.backfill_parts)
+
+    def _sync_id_range(self, _range:IdRange) -> IngestReport:
+        """page backward from _range.upper_id until _range.lower_id or _range.since"""
+        symbol = _range.symbol
         trades:List[Trade] = []
-        before_id = None
-        while True:
-            self._public_api_limit()
-            _trades:List
-            if not before_id:
-                _trades = self.exchange.fetch_trades(symbol, limit=500) # max limit for bitflyer is 500
-            else:
-                _trades = self.exchange.fetch_trades(symbol, limit=500, params={'before': before_id}) # max limit for bitflyer is 500
+        before_id = _range.upper_id
+        # db write runs on the event loop while next pages are fetched, at most one write in flight
+        pending:Optional[Future] = None
+        report = IngestReport(0, 0, 0.0)
+        try:
+            while True:
+                self._public_api_limit()
+                _trades:List
+                if not before_id:
+                    _trades = self.exchange.fetch_trades(symbol, limit=500) # max limit for bitflyer is 500
+                else:
+                    _trades = self.exchange.fetch_trades(symbol, limit=500, params={'before': before_id}) # max limit for bitflyer is 500
+                if not _trades:
+                    report, pending = self._insert_trades(report, pending, symbol, trades)
+                    break
 
-            _trades_ = [self._api_2_db_trade(_t) for _t in _trades]
-            trades.extend(_trades_)
+                _trades_ = [self._api_2_db_trade(_t) for _t in _trades]
+                if _range.lower_id is not None:
+                    _trades_ = [_t for _t in _trades_ if int(_t.id) > _range.lower_id]
+                trades.extend(_trades_)
 
-            before_id = _trades[0]['id']
-            lastest_datetime = _trades_[0].execution_time
+                before_id = _trades[0]['id']
+                oldest_datetime = self._str_2_datetime(_trades[0]['datetime'])
 
-            if len(trades) >= 10000:
-                asyncio.run(bulk_insert_trade(self.exchange_name, symbol, trades))
-                trades = []
-            if lastest_datetime <= since:
-                asyncio.run(bulk_insert_trade(self.exchange_name, symbol, trades))
-                break
-        data = asyncio.run(get_trades(self.exchange_name, symbol, last_days))
-        return data
+                if len(trades) >= 10000:
+                    report, pending = self._insert_trades(report, pending, symbol, trades)
+                    trades = []
+                if oldest_datetime <= _range.since or (_range.lower_id is not None and int(before_id) <= _range.lower_id):
+                    report, pending = self._insert_trades(report, pending, symbol, trades)
+                    break
+        finally:
+            if pending is not None:
+                report += pending.result()
+        return report
 
-    def fetch_candlesticks(self, since, use_yahoo_finance:bool=True) -> Dict[str, Dict[str, List[CandleStick]]]:
+    def _insert_trades(self, report:IngestReport, pending:Optional[Future], symbol:str, trades:List[Trade]) -> Tuple[IngestReport, Future]:
+        """wait for the previous write, then start writing trades without waiting"""
+        if pending is not None:
+            report += pending.result()
+        return report, submit_async(bulk_insert_trade(self.exchange_name, symbol, trades))
+
+    def fetch_candlesticks(self, since, use_yahoo_finance:bool=True, intervals:Optional[List[str]]=None, offline:bool=False) -> Dict[str, Dict[str, List[CandleStick]]]:
         if since is None:
             last_minutes = (MarketInfo.CANDLESTICK_NUMS + 2) * self.fetch_data_interval_minute
             since = get_now() - timedelta(minutes=last_minutes)
         since = local_2_utc(since)
 
-        # TODO: multi candlestick
+        if not intervals:
+            intervals = [f'{self.candlestick_interval}m']
+        base_interval = smallest_interval(intervals)
+
         res = {}
         is_data_enough:bool = False
         for symbol in self.symbols:
-            _oldest_time = asyncio.run(get_oldest_trade_time(self.exchange_name, symbol))
-            is_data_enough = _oldest_time is None or _oldest_time < since
+            if offline:
+                res[symbol] = self._rollup_candlesticks(
+                    run_async(load_candlesticks(self.exchange_name, symbol, base_interval, since, offline=True)), intervals, base_interval)
+                continue
+
+            # fill missing trades first, yfinance is only used when the exchange has no enough history
+            filled_since = self._sync_trades(since, [symbol])[symbol]
+            _oldest_time = run_async(get_oldest_trade_time(self.exchange_name, symbol))
+            is_data_enough = _oldest_time is not None and _oldest_time - since <= self.trade_gap
 
-            interval = f'{self.candlestick_interval}m'
-            candlesticks:List[CandleStick]
+            candlesticks:Dict[str, List[CandleStick]] = {}
             if not is_data_enough and use_yahoo_finance:
-                candlesticks = super()._fetch_candlesticks_by_yfinance(self._to_yahoofince_symbol(symbol), since, interval)
+                print(f'{self.exchange_name} {symbol}: no trades since {since} (oldest: {_oldest_time}), use yahoo finance')
+                for interval in intervals:
+                    candlesticks[interval] = super()._fetch_candlesticks_by_yfinance(self._to_yahoofince_symbol(symbol), since, interval)
             else:
-                trades = self._fetch_trades(since, symbol)
-                _, candlesticks = ConvertTradeToCandleStick(trades).by_minutes(self.candlestick_interval)
+                # only new trades (and filled gaps) are aggregated, stored candlesticks are read by one range query
+                run_async(materialize_candlesticks(self.exchange_name, symbol, base_interval, since=filled_since))
+                # read through file cache, only changed days are read from db
+                base = run_async(load_candlesticks(self.exchange_name, symbol, base_interval, since))
+                candlesticks = self._rollup_candlesticks(base, intervals, base_interval)
 
-            res[symbol] = {interval:candlesticks}
+            res[symbol] = candlesticks
 
         return res
 
@@ -0,0 +1,192 @@
+"""
+bitflyer realtime executions (JSON-RPC 2.0 over websocket) and a local replay server with the same protocol
+    {"method": "subscribe", "params": {"channel": "lightning_executions_BTC_JPY"}, "id": 1}
+    {"jsonrpc": "2.0", "method": "channelMessage", "params": {"channel": "...", "message": [{"id", "side", "price", "size", "exec_date", ...}]}}
+"""
+import asyncio
+from datetime import datetime
+import json
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import Server, ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from tradeengine.live.engine import TradeEvent
+from tradeengine.models.trade import Side, Trade
+
+BITFLYER_WS_URL = 'wss://ws.lightstream.bitflyer.com/json-rpc'
+_CHANNEL_PREFIX = 'lightning_executions_'
+
+# (symbol, since, after_id) -> (trades newer than after_id, DESC, complete), e.g. Exchange.fetch_trades_after
+Backfill = Callable[[str, datetime, Optional[str]], Tuple[List[Trade], bool]]
+
+def _channel(symbol:str) -> str:
+    return f'{_CHANNEL_PREFIX}{symbol}'
+
+def _ws_2_trade(data:Dict) -> Trade:
+    match data['side'].lower():
+        case Side.BUY.value:
+            _side = Side.BUY
+        case Side.SELL.value:
+            _side = Side.SELL
+        case _:
+            _side = Side.NONE
+    return Trade(
+        id=str(data['id']),
+        side=_side,
+        size=data['size'],
+        # 7 fractional digits, fromisoformat truncates to microseconds
+        execution_time=datetime.fromisoformat(data['exec_date']),
+        price=data['price'],
+    )
+
+def _trade_2_ws(trade:Trade) -> Dict:
+    return {
+        'id': int(trade.id) if trade.id.isdigit() else trade.id,
+        'side': trade.side.value.upper(),
+        'price': trade.price,
+        'size': trade.size,
+        'exec_date': trade.execution_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+    }
+
+def parse_message(raw:str, received:int) -> Optional[TradeEvent]:
+    """None if not an executions message (e.g. subscribe result)"""
+    message = json.loads(raw)
+    if message.get('method') != 'channelMessage':
+        return None
+    channel:str = message['params']['channel']
+    if not channel.startswith(_CHANNEL_PREFIX):
+        return None
+    # executions of a message are in time order
+    return TradeEvent(channel[len(_CHANNEL_PREFIX):], [_ws_2_trade(data) for data in message['params']['message']], received)
+
+async def _backfill(symbol:str, lastest:Trade, backfill:Optional[Backfill]) -> TradeEvent:
+    """executions after lastest from api, or a gap marker if they cannot be fetched"""
+    if backfill is None:
+        return TradeEvent(symbol, [], time.perf_counter_ns(), gap=True)
+    try:
+        # blocking api client in a thread
+        trades, complete = await asyncio.to_thread(backfill, symbol, lastest.execution_time, lastest.id)
+    except Exception as e:
+        print(f'bitflyer {symbol} backfill failed: {e!r}')
+        return TradeEvent(symbol, [], time.perf_counter_ns(), gap=True)
+    if not complete:
+        print(f'bitflyer {symbol} backfill did not reach {lastest.execution_time}, {len(trades)} trades')
+    # empty if nothing was missed, the engine closes candlesticks by clock again
+    return TradeEvent(symbol, trades[::-1], time.perf_counter_ns(), gap=not complete)
+
+async def stream_executions(symbols:List[str], url:str=BITFLYER_WS_URL, reconnect:bool=True, reconnect_delay:float=1.0,
+                            backfill:Optional[Backfill]=None, lastest:Optional[Dict[str, Trade]]=None) -> AsyncIterator[TradeEvent]:
+    """
+    executions of symbols as they arrive
+    reconnect: connect again when the connection is closed or lost, else stop (e.g. end of ReplayServer).
+               an empty TradeEvent with disconnected is yielded for each symbol when the connection is lost
+    backfill: executions missed while reconnecting are fetched by it after subscribing again, executions sent
+              again by the stream are skipped by id. if None (or it fails), an empty TradeEvent with gap is yielded
+    lastest: {symbol: newest execution already seen}, e.g. history fetched before streaming,
+             executions after it are backfilled at the first connection too
+    """
+    # newest execution of each symbol
+    lastest = dict(lastest or {})
+    while True:
+        try:
+            async with connect(url) as websocket:
+                for i, symbol in enumerate(symbols):
+                    await websocket.send(json.dumps({'method': 'subscribe', 'params': {'channel': _channel(symbol)}, 'id': i}))
+                # symbol -> id of the newest execution yielded, older ones are skipped, only after reconnect
+                skip_until:Dict[str, int] = {}
+                for symbol, trade in list(lastest.items()):
+                    event = await _backfill(symbol, trade, backfill)
+                    if event.trades:
+                        lastest[symbol] = event.trades[-1]
+                    yield event
+                    skip_until[symbol] = int(lastest[symbol].id)
+                async for raw in websocket:
+                    received = time.perf_counter_ns()
+                    event = parse_message(raw, received)
+                    if event is None:
+                        continue
+                    if skip_until:
+                        _id = skip_until.get(event.symbol)
+                        if _id is not None:
+                            event.trades = [trade for trade in event.trades if int(trade.id) > _id]
+                            if not event.trades:
+                                continue
+                            del skip_until[event.symbol]
+                    if event.trades:
+                        lastest[event.symbol] = event.trades[-1]
+                    yield event
+        except (ConnectionClosed, OSError) as e:
+            if not reconnect:
+                raise
+            print(f'bitflyer stream disconnected: {e!r}, reconnect in {reconnect_delay}s')
+        else:
+            if not reconnect:
+                return
+            print(f'bitflyer stream closed, reconnect in {reconnect_delay}s')
+        for symbol in symbols:
+            yield TradeEvent(symbol, [], time.perf_counter_ns(), disconnected=True)
+        await asyncio.sleep(reconnect_delay)
+
+class ReplayServer:
+    """
+    local stand-in of the bitflyer realtime api, replays trades to each subscriber
+     - trades: {symbol: trades}, DESC (same as List[Trade] in other places), sent in time order
+     - batch_size: executions per message
+     - interval: seconds between messages
+    the connection is closed after all trades of subscribed symbols are sent
+    usage:
+        async with ReplayServer(trades) as server:
+            async for event in stream_executions(symbols, server.url, reconnect=False): ...
+    """
+    def __init__(self, trades:Dict[str, List[Trade]], host:str='127.0.0.1', port:int=0, batch_size:int=1, interval:float=0.0):
+        self.trades = {symbol: trades[::-1] for symbol, trades in trades.items()}
+        self.host = host
+        self.port = port
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._server:Optional[Server] = None
+
+    @property
+    def url(self) -> str:
+        return f'ws://{self.host}:{self.port}'
+
+    async def __aenter__(self) -> 'ReplayServer':
+        self._server = await serve(self._handle, self.host, self.port)
+        # port 0: any free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, websocket:ServerConnection) -> None:
+        symbols:List[str] = []
+        # subscribe requests are sent at once before any message
+        while len(symbols) < len(self.trades):
+            try:
+                request = json.loads(await asyncio.wait_for(websocket.recv(), timeout=0.1))
+            except asyncio.TimeoutError:
+                break
+            channel = request['params']['channel']
+            symbols.append(channel[len(_CHANNEL_PREFIX):])
+            await websocket.send(json.dumps({'jsonrpc': '2.0', 'id': request.get('id'), 'result': True}))
+
+        # all symbols in time order
+        merged = sorted(
+            ((trade.execution_time, symbol, trade) for symbol in symbols for trade in self.trades.get(symbol, [])),
+            key=lambda item: item[0],
+        )
+        for start in range(0, len(merged), self.batch_size):
+            batch = merged[start:start + self.batch_size]
+            for symbol in dict.fromkeys(symbol for _, symbol, _ in batch):
+                await websocket.send(json.dumps({
+                    'jsonrpc': '2.0',
+                    'method': 'channelMessage',
+                    'params': {'channel': _channel(symbol), 'message': [_trade_2_ws(trade) for _, _symbol, trade in batch if _symbol == symbol]},
+                }))
+            if self.interval > 0:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import ccxt
+
+from api.crypto.exchange import Exchange
+from api.db.candlestick import materialize_candlesticks
+from api.db.common import IngestReport
+from api.db.file_cache import invalidate_cache, load_candlesticks, load_trades
+from api.db.trade import bulk_insert_trade, get_lastest_trade_time, init_trade_tables
+from tradeengine.models.trade import Side, Trade
+from tradeengine.models.candlestick import CandleStick
+from tradeengine.tools.convertor import smallest_interval
+from tools.common import get_now, local_2_utc, run_async
+from tools.constants import MarketInfo
+
+# requests sent at once before pacing starts
+_API_BURST = 5
+
+def _to_symbol(market:str) -> str:
+    """ccxt symbol -> name usable in table names and paths, e.g. BTC/USDT:USDT -> BTC_USDT_USDT"""
+    return market.replace('/', '_').replace(':', '_')
+
+class CcxtExchange(Exchange):
+    """
+    any exchange of ccxt by its unified api
+    trades are paged forward by time, saved to db and read through file cache like Bitflyer
+    symbols: ccxt ones (e.g. "BTC/USDT") in config, self.symbols are names for db tables and cache folders (e.g. "BTC_USDT")
+    """
+    def __init__(self, exchange_name:str, symbols:List[str], dry_run:List[str], api_key:str='', api_secret:str='', options:Optional[Dict]=None):
+        # symbol -> ccxt symbol
+        self._markets = {_to_symbol(market): market for market in symbols}
+        super().__init__(exchange_name, [_to_symbol(market) for market in symbols], [_to_symbol(market) for market in dry_run])
+        if exchange_name not in ccxt.exchanges:
+            raise ValueError(f'{exchange_name} is not a ccxt exchange')
+        config = dict(options or {})
+        if api_key:
+            config['apiKey'] = api_key
+            config['secret'] = api_secret
+        self.exchange:ccxt.Exchange = getattr(ccxt, exchange_name)(config)
+        # rate limit is acquired by public_rate_limiter, shared with registry polling
+        self.exchange.enableRateLimit = False
+        # ccxt rateLimit: milliseconds between requests
+        self.public_api_limit = (1, max(self.exchange.rateLimit, 1) / 1000, _API_BURST)
+        # max histroy to sync if since is None
+        self.max_history:timedelta = timedelta(days=30)
+        # trades per request, default limits of ccxt exchanges are often smaller
+        self.page_size:int = 1000
+
+    def fetch_recent_trades(self, symbol:str) -> List[Trade]:
+        return [self._api_2_db_trade(_t) for _t in reversed(self.exchange.fetch_trades(self._markets[symbol]))]
+
+    def fetch_trades(self, since:Optional[datetime]=None, offline:bool=False) -> Dict[str, List[Trade]]:
+        if not since:
+            since = get_now() - self.max_history
+        since = local_2_utc(since)
+
+        if not offline:
+            self.sync_trades(since)
+        return {symbol: run_async(load_trades(self.exchange_name, symbol, since, offline=offline)).to_trades() for symbol in self.symbols}
+
+    def sync_trades(self, since:Optional[datetime]=None) -> None:
+        if not since:
+            since = get_now() - self.max_history
+        since = local_2_utc(since)
+        run_async(init_trade_tables(self.exchange_name, self.symbols))
+        for symbol in self.symbols:
+            report = self._sync_symbol(symbol, since)
+            print(f'{self.exchange_name} {symbol} trades saved: {report}')
+        print(f'{self.exchange_name} public api: {self.public_rate_limiter().metrics}')
+
+    def fetch_trades_after(self, symbol:str, since:datetime, after_id:Optional[str]=None, max_pages:int=20) -> Tuple[List[Trade], bool]:
+        """page forward from since, ids of ccxt are not ordered (after_id is ignored), trades at since are included"""
+        trades:List[Trade] = []
+        for i, page in enumerate(self._pages(symbol, local_2_utc(since))):
+            trades.extend(page)
+            if i + 1 >= max_pages:
+                # a full page may be followed by more
+                return trades[::-1], len(page) < self.page_size
+        return trades[::-1], True
+
+    def _pages(self, symbol:str, since:datetime) -> Iterator[List[Trade]]:
+        """
+        pages of trades from since until now, ASC, trades with the same time may be in two pages
+        a full page in one millisecond cannot be paged by time: the rest of that millisecond is skipped and logged
+        """
+        since_ms = int(since.timestamp() * 1000)
+        while True:
+            self.public_rate_limiter().acquire()
+            _trades = self.exchange.fetch_trades(self._markets[symbol], since=since_ms, limit=self.page_size)
+            if not _trades:
+                return
+            yield [self._api_2_db_trade(_t) for _t in _trades]
+            _lastest_ms = int(_trades[-1]['timestamp'])
+            if _lastest_ms > since_ms:
+                since_ms = _lastest_ms
+                continue
+            # no trade after since_ms in this page
+            if len(_trades) >= self.page_size:
+                print(f'{self.exchange_name} {symbol}: {len(_trades)} trades at {since_ms}ms fill a page, later trades of the millisecond may be missing')
+            since_ms += 1
+
+    def _sync_symbol(self, symbol:str, since:datetime) -> IngestReport:
+        """page forward from db lastest trade (or since) until now, trades fetched twice are skipped by db"""
+        _lastest_time = run_async(get_lastest_trade_time(self.exchange_name, symbol))
+        if _lastest_time is not None and _lastest_time > since:
+            since = _lastest_time
+        else:
+            # older trades are not in db, days since then are cached without them
+            invalidate_cache(self.exchange_name, symbol, since)
+
+        report = IngestReport(0, 0, 0.0)
+        for page in self._pages(symbol, since):
+            report += run_async(bulk_insert_trade(self.exchange_name, symbol, page))
+        return report
+
+    def fetch_candlesticks(self, since, use_yahoo_finance:bool=True, intervals:Optional[List[str]]=None, offline:bool=False) -> Dict[str, Dict[str, List[CandleStick]]]:
+        """built from saved trades, use_yahoo_finance is not supported (symbols of ccxt are not mapped)"""
+        if since is None:
+            last_minutes = (MarketInfo.CANDLESTICK_NUMS + 2) * self.fetch_data_interval_minute
+            since = get_now() - timedelta(minutes=last_minutes)
+        since = local_2_utc(since)
+
+        if not intervals:
+            intervals = [f'{self.candlestick_interval}m']
+        base_interval = smallest_interval(intervals)
+
+        if not offline:
+            self.sync_trades(since)
+        res = {}
+        for symbol in self.symbols:
+            if not offline:
+                run_async(materialize_candlesticks(self.exchange_name, symbol, base_interval, since=since))
+            base = run_async(load_candlesticks(self.exchange_name, symbol, base_interval, since, offline=offline))
+            res[symbol] = self._rollup_candlesticks(base, intervals, base_interval)
+        return res
+
+    def _api_2_db_trade(self, data) -> Trade:
+        """ccxt unified trade"""
+        match data.get('side'):
+            case Side.BUY.value:
+                _side = Side.BUY
+            case Side.SELL.value:
+                _side = Side.SELL
+            case _:
+                _side = Side.NONE
+        return Trade(
+            id=str(data['id']),
+            size=data['amount'],
+            side=_side,
+            execution_time=datetime.fromtimestamp(data['timestamp'] / 1000, tz=timezone.utc),
+            price=data['price'],
+        )
@@ -1,10 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
-from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 import yfinance as yf
 
+from api.crypto.rate_limiter import RateLimiter, get_rate_limiter
+from tradeengine.live.engine import TradeEvent
 from tradeengine.models.trade import Trade
-from tradeengine.models.candlestick import CandleStick
+from tradeengine.models.candlestick import CandleBatch, CandleStick
+from tradeengine.tools.convertor import parse_interval, rollup_candlesticks
 
 class Exchange(ABC):
     def __init__(self, exchange_name:str, symbols:List[str], dry_run:List[str]):
@@ -18,26 +21,86 @@ class Exchange(ABC):
         self.fetch_data_interval_minute:int = 1
         # tech analysis
         self.candlestick_interval:int = 5
+        # public api limit: (requests, per_seconds, burst), shared by all threads and coroutines of this process
+        self.public_api_limit:Tuple[int, float, int] = (1, 1.0, 1)
 
     def is_dry_run(self, symbol:str) -> bool:
         return symbol in self.dry_run
 
+    def public_rate_limiter(self) -> RateLimiter:
+        """acquire before calling public api, e.g. api.crypto.registry polls with acquire_async"""
+        return get_rate_limiter(self.exchange_name, 'public', *self.public_api_limit)
+
+    @abstractmethod
+    def fetch_recent_trades(self, symbol:str) -> List[Trade]:
+        """
+        lastest page of trades from api, DESC, not saved to db
+        rate limit is not acquired, the caller does (see public_rate_limiter)
+        """
+        pass
+
+    def fetch_trades_after(self, symbol:str, since:datetime, after_id:Optional[str]=None, max_pages:int=20) -> Tuple[List[Trade], bool]:
+        """
+        trades from api newer than since (or than after_id, where ids are ordered), DESC, not saved to db
+        e.g. trades missed by a realtime stream while reconnecting, or between two polls
+        rate limit is acquired for each page
+        return: (trades, complete), complete is False if max_pages did not reach since
+        """
+        raise NotImplementedError(f'{self.exchange_name} cannot fetch trades after a time')
+
+    @abstractmethod
+    def fetch_trades(self, since:Optional[datetime], offline:bool=False) -> Dict[str, List[Trade]]:
+        """
+        param:
+         - since: max history data, if is None
+         - offline: read cached trades only (api.db.file_cache), neither api nor db is accessed
+        """
+        pass
+
     @abstractmethod
-    def fetch_trades(self, since:Optional[datetime]) -> Dict[str, List[Trade]]:
+    def sync_trades(self, since:Optional[datetime]) -> None:
         """
+        save trades from api to db without loading them, read them by api.db.trade.iter_trades
         param:
          - since: max history data, if is None
         """
         pass
 
+    def stream_trades(self, url:Optional[str]=None, lastest:Optional[Dict[str, Trade]]=None) -> AsyncIterator[TradeEvent]:
+        """
+        realtime trades of self.symbols, for tradeengine.live.engine.LiveEngine.run
+        url: endpoint of the realtime api, e.g. a local replay server, exchange's one if None
+        lastest: {symbol: newest trade already seen} (e.g. by LiveEngine.warm_up), newer ones are fetched from api first
+        """
+        raise NotImplementedError(f'{self.exchange_name} does not support realtime trades')
+
     @abstractmethod
-    def fetch_candlesticks(self, since:Optional[datetime], use_yahoo_finance:bool=True) -> Dict[str, Dict[str, List[CandleStick]]]:
+    def fetch_candlesticks(self, since:Optional[datetime], use_yahoo_finance:bool=True, intervals:Optional[List[str]]=None, offline:bool=False) -> Dict[str, Dict[str, List[CandleStick]]]:
         """
         since: if none, CANDLESTICK_NUMS(defined at tools/constants.py) * self.fetch_data_interval_minute
         use_yahoo_finance: fetch data from yahoo_finance if cannot get enough data from exchange
+        intervals: like ["1m", "5m", "1h"], if none, self.candlestick_interval.
+                   the smallest one is built from trades, others are rolled up from it
+        offline: read cached candlesticks only (api.db.file_cache), neither api nor db is accessed
+        return: {symbol: {interval: candlesticks}}
         """ 
         pass
 
+    def _rollup_candlesticks(self, base:CandleBatch, intervals:List[str], base_interval:str) -> Dict[str, List[CandleStick]]:
+        """bigger intervals are rolled up from the smallest one, they must be its multiples (see smallest_interval)"""
+        base_delta = parse_interval(base_interval)
+        for interval in intervals:
+            if parse_interval(interval) % base_delta != timedelta(0):
+                raise ValueError(f'{interval} is not a multiple of {base_interval}')
+        candlesticks:Dict[str, List[CandleStick]] = {}
+        for interval in intervals:
+            if interval == base_interval:
+                candlesticks[interval] = base.to_candlesticks()
+            else:
+                # the oldest one is not complete
+                candlesticks[interval] = rollup_candlesticks(base, parse_interval(interval))[:-1].to_candlesticks()
+        return candlesticks
+
     def _fetch_candlesticks_by_yfinance(self, symbol:str, since:datetime, interval:str) -> List[CandleStick]:
         y = yf.Ticker(symbol)
         data = y.history(start=since, interval=interval)
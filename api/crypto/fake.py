@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from api.crypto.exchange import Exchange
+from tradeengine.models.trade import Trade, TradeBatch
+from tradeengine.models.candlestick import CandleStick
+from tradeengine.tools.convertor import CandleStickBuilder, parse_interval, smallest_interval
+from tools.common import get_now, local_2_utc
+from tools.constants import MarketInfo
+
+class FakeExchange(Exchange):
+    """
+    in memory exchange for tests, no api or db access
+    trades are added by add_trades (e.g. recorded ones, or a generator in another thread), fetch_recent_trades
+    returns the lastest page of them and fetch_trades_after pages forward like an api
+    """
+    def __init__(self, symbols:List[str], dry_run:List[str], exchange_name:str='fake', page_size:int=500,
+                 public_api_limit:Optional[Tuple[int, float, int]]=None):
+        super().__init__(exchange_name, symbols, dry_run)
+        self.page_size = page_size
+        if public_api_limit is not None:
+            self.public_api_limit = public_api_limit
+        # DESC
+        self._trades:Dict[str, List[Trade]] = {symbol: [] for symbol in symbols}
+        self._lock = Lock()
+        self.calls = 0 # api calls (pages)
+
+    def add_trades(self, symbol:str, trades:List[Trade]) -> None:
+        """trades: DESC, newer than added ones"""
+        with self._lock:
+            self._trades[symbol] = trades + self._trades[symbol]
+
+    def fetch_recent_trades(self, symbol:str) -> List[Trade]:
+        with self._lock:
+            self.calls += 1
+            return self._trades[symbol][:self.page_size]
+
+    def fetch_trades_after(self, symbol:str, since:datetime, after_id:Optional[str]=None, max_pages:int=20) -> Tuple[List[Trade], bool]:
+        """same as CcxtExchange: pages forward from since, trades at since are included, after_id is ignored"""
+        since = local_2_utc(since)
+        with self._lock:
+            # ASC
+            trades = [trade for trade in reversed(self._trades[symbol]) if trade.execution_time >= since]
+        pages = max(1, -(-len(trades) // self.page_size))
+        for _ in range(min(pages, max_pages)):
+            self.public_rate_limiter().acquire()
+            with self._lock:
+                self.calls += 1
+        fetched = trades[:max_pages * self.page_size]
+        return fetched[::-1], len(fetched) == len(trades)
+
+    def fetch_trades(self, since:Optional[datetime]=None, offline:bool=False) -> Dict[str, List[Trade]]:
+        since = local_2_utc(since) if since else None
+        with self._lock:
+            return {
+                symbol: [trade for trade in trades if since is None or trade.execution_time >= since]
+                for symbol, trades in self._trades.items()
+            }
+
+    def sync_trades(self, since:Optional[datetime]=None) -> None:
+        pass
+
+    def fetch_candlesticks(self, since, use_yahoo_finance:bool=True, intervals:Optional[List[str]]=None, offline:bool=False) -> Dict[str, Dict[str, List[CandleStick]]]:
+        if since is None:
+            last_minutes = (MarketInfo.CANDLESTICK_NUMS + 2) * self.fetch_data_interval_minute
+            since = get_now() - timedelta(minutes=last_minutes)
+        if not intervals:
+            intervals = [f'{self.candlestick_interval}m']
+        base_interval = smallest_interval(intervals)
+
+        res = {}
+        for symbol, trades in self.fetch_trades(since).items():
+            builder = CandleStickBuilder(parse_interval(base_interval), len(trades) + 1)
+            if trades:
+                builder.push_batch(TradeBatch.from_trades(trades))
+            res[symbol] = self._rollup_candlesticks(builder.to_batch(), intervals, base_interval)
+        return res
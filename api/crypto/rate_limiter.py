@@ -0,0 +1,86 @@
+import asyncio
+from dataclasses import dataclass
+from threading import Lock
+import time
+from typing import Dict, Tuple
+
+@dataclass
+class RateLimiterMetrics:
+    calls: int = 0
+    waited_calls: int = 0 # calls that had to wait
+    total_wait: float = 0.0 # seconds
+    max_wait: float = 0.0 # seconds
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.calls if self.calls > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.calls} calls ({self.waited_calls} waited), wait {self.total_wait:.2f}s, '
+                f'average {self.average_wait * 1000:.1f}ms, max {self.max_wait * 1000:.1f}ms')
+
+class RateLimiter:
+    """
+    token bucket, `requests` per `per_seconds` refilled continuously, at most `burst` requests at once
+    tokens are reserved in call order (the bucket may go negative), so waiting is FIFO and never longer than
+    (waiting callers + 1) / rate, instead of waiting for the whole window to reset.
+    thread-safe, acquire() blocks the thread, acquire_async() awaits, both share the same bucket
+    """
+    def __init__(self, requests:int, per_seconds:float, burst:int=1):
+        if requests <= 0 or per_seconds <= 0:
+            raise ValueError(f'requests and per_seconds must be positive, requests: {requests}, per_seconds: {per_seconds}')
+        self.rate = requests / per_seconds
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = Lock()
+        self.metrics = RateLimiterMetrics()
+
+    def _reserve(self, tokens:float) -> float:
+        """return: seconds to wait before the reserved tokens are available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+            self.metrics.calls += 1
+            if wait > 0:
+                self.metrics.waited_calls += 1
+                self.metrics.total_wait += wait
+                self.metrics.max_wait = max(self.metrics.max_wait, wait)
+            return wait
+
+    def acquire(self, tokens:float=1) -> float:
+        """block until tokens are available, return: waited seconds"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens:float=1) -> float:
+        """same as acquire, without blocking the event loop"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+# (exchange_name, api_class) -> limiter, shared by all threads and coroutines of this process
+_rate_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_rate_limiters_lock = Lock()
+
+def get_rate_limiter(exchange_name:str, api_class:str, requests:int, per_seconds:float, burst:int=1) -> RateLimiter:
+    """
+    api_class: e.g. "public", "private"
+    the limiter is created at the first call, later calls return the same one (limits are ignored)
+    """
+    with _rate_limiters_lock:
+        key = (exchange_name, api_class)
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(requests, per_seconds, burst)
+        return _rate_limiters[key]
+
+def get_rate_limiter_metrics() -> Dict[Tuple[str, str], RateLimiterMetrics]:
+    with _rate_limiters_lock:
+        return {key: limiter.metrics for key, limiter in _rate_limiters.items()}
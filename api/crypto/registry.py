@@ -0,0 +1,179 @@
+"""
+all configured exchanges in one process
+ - create_exchange: bitflyer, "fake" (in memory, for tests), or any other ccxt exchange
+ - ExchangeRegistry.stream_trades: new trades of all exchanges from one event loop, exchanges with a realtime api
+   (Exchange.stream_trades) are streamed, others are polled concurrently, each request waits for the exchange's
+   public rate limiter without blocking the others
+   trades older than the polled page (more than one page between two polls) are fetched by Exchange.fetch_trades_after,
+   if they cannot be, the event is marked as a gap (TradeEvent.gap) and counted in ExchangeRegistry.gaps
+   given the newest trades already seen (e.g. warmed-up history), polls skip them and streams backfill after them
+"""
+import asyncio
+import concurrent.futures
+from datetime import datetime
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import ccxt
+
+from api.crypto.bitflyer.bitflyer import Bitflyer
+from api.crypto.ccxt_exchange import CcxtExchange
+from api.crypto.exchange import Exchange
+from api.crypto.fake import FakeExchange
+from config.config import Config, ExchangeConfig
+from tradeengine.live.engine import TradeEvent
+from tradeengine.models.trade import Trade, TradeBatch
+
+# exchange name -> factory, exchanges not here are created by CcxtExchange
+_EXCHANGES:Dict[str, Callable[[ExchangeConfig], Exchange]] = {
+    'bitflyer': lambda config: Bitflyer(config.symbols, config.dry_run_symbols),
+    'fake': lambda config: FakeExchange(config.symbols, config.dry_run_symbols, config.exchange_name),
+}
+
+def register_exchange(exchange_name:str, factory:Callable[[ExchangeConfig], Exchange]) -> None:
+    """use factory for exchange_name instead of the default one (e.g. a dedicated Exchange class)"""
+    _EXCHANGES[exchange_name] = factory
+
+def create_exchange(config:ExchangeConfig) -> Exchange:
+    if config.exchange_name in _EXCHANGES:
+        return _EXCHANGES[config.exchange_name](config)
+    if config.exchange_name in ccxt.exchanges:
+        return CcxtExchange(config.exchange_name, config.symbols, config.dry_run_symbols, config.api_key, config.api_secret, config.options)
+    raise NotImplementedError(f'{config.exchange_name} is neither registered nor a ccxt exchange')
+
+class ExchangeRegistry:
+    def __init__(self, exchanges:List[Exchange]):
+        self._exchanges:Dict[str, Exchange] = {}
+        for exchange in exchanges:
+            if exchange.exchange_name in self._exchanges:
+                raise ValueError(f'{exchange.exchange_name} is registered twice')
+            self._exchanges[exchange.exchange_name] = exchange
+        # (exchange_name, symbol) -> polls whose missed trades could not be fetched
+        self.gaps:Dict[Tuple[str, str], int] = {}
+        # pages fetched by fetch_trades_after at most, for one poll
+        self.max_gap_pages = 20
+
+    @classmethod
+    def from_config(cls, config:Optional[Config]=None) -> 'ExchangeRegistry':
+        """all exchanges in config.yaml"""
+        config = config or Config()
+        return cls([create_exchange(exchange_config) for exchange_config in config.exchanges.values()])
+
+    def __getitem__(self, exchange_name:str) -> Exchange:
+        return self._exchanges[exchange_name]
+
+    def __iter__(self) -> Iterator[Exchange]:
+        return iter(self._exchanges.values())
+
+    def __len__(self) -> int:
+        return len(self._exchanges)
+
+    def sync_trades(self, since:Optional[datetime]=None) -> None:
+        """all exchanges at once, one thread per exchange (each exchange paces its own requests)"""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self))) as executor:
+            for future in [executor.submit(exchange.sync_trades, since) for exchange in self]:
+                future.result()
+
+    async def stream_trades(self, lastest:Optional[Dict[str, Dict[str, List[Trade]]]]=None, poll_interval:float=1.0, polls:Optional[int]=None) -> AsyncIterator[Tuple[str, TradeEvent]]:
+        """
+        yield: (exchange_name, event) of all exchanges as they arrive, until all streams end
+        lastest: {exchange_name: {symbol: newest trades already seen}} (e.g. by LiveEngine.warm_up), the ones at the
+                 newest time, DESC, polled trades before them and of their ids are skipped, streams backfill after them
+        poll_interval: seconds between polls of one symbol, requests are also paced by the exchange's rate limit
+        polls: polls per symbol, None for forever (tests)
+        """
+        lastest = lastest or {}
+        queue:asyncio.Queue = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(self._forward(exchange, lastest.get(exchange.exchange_name, {}), poll_interval, polls, queue))
+            for exchange in self
+        ]
+        running = len(tasks)
+        try:
+            while running > 0:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _forward(self, exchange:Exchange, lastest:Dict[str, List[Trade]], poll_interval:float, polls:Optional[int], queue:asyncio.Queue) -> None:
+        try:
+            try:
+                events = exchange.stream_trades(lastest={symbol: trades[0] for symbol, trades in lastest.items() if trades})
+            except NotImplementedError:
+                events = None
+            if events is not None:
+                async for event in events:
+                    await queue.put((exchange.exchange_name, event))
+            else:
+                await asyncio.gather(*(
+                    self._poll(exchange, symbol, lastest.get(symbol, []), poll_interval, polls, queue) for symbol in exchange.symbols))
+        except Exception as e:
+            # raised by stream_trades, other exchanges are cancelled
+            await queue.put(e)
+        finally:
+            await queue.put(None)
+
+    async def _poll(self, exchange:Exchange, symbol:str, seen:List[Trade], poll_interval:float, polls:Optional[int], queue:asyncio.Queue) -> None:
+        """lastest page of trades every poll_interval, only trades newer than seen ones are forwarded"""
+        limiter = exchange.public_rate_limiter()
+        lastest:Optional[datetime] = seen[0].execution_time if seen else None
+        # trades at lastest time which were forwarded, pages may end in the middle of them
+        lastest_ids:Set[str] = {trade.id for trade in seen if trade.execution_time == lastest}
+        count = 0
+        while polls is None or count < polls:
+            started = time.monotonic()
+            await limiter.acquire_async()
+            gap = False
+            try:
+                # blocking api client in a thread, the event loop keeps serving other exchanges
+                trades:List[Trade] = await asyncio.to_thread(exchange.fetch_recent_trades, symbol)
+                if lastest is not None and trades and trades[-1].execution_time > lastest:
+                    # the page does not reach the last forwarded trade
+                    trades, gap = await self._fill(exchange, symbol, lastest, trades)
+            except (ccxt.NetworkError, ccxt.ExchangeError) as e:
+                print(f'{exchange.exchange_name} {symbol} poll failed: {e!r}')
+                trades = []
+            count += 1
+
+            new_trades = [
+                trade for trade in trades
+                if lastest is None or trade.execution_time > lastest or (trade.execution_time == lastest and trade.id not in lastest_ids)
+            ]
+            if new_trades:
+                newest = new_trades[0].execution_time
+                if lastest is None or newest > lastest:
+                    lastest_ids = set()
+                lastest = newest
+                lastest_ids.update(trade.id for trade in new_trades if trade.execution_time == newest)
+                # ASC, same as realtime api
+                await queue.put((exchange.exchange_name, TradeEvent(symbol, new_trades[::-1], time.perf_counter_ns(), gap)))
+            await asyncio.sleep(max(0.0, poll_interval - (time.monotonic() - started)))
+
+    async def _fill(self, exchange:Exchange, symbol:str, lastest:datetime, page:List[Trade]) -> Tuple[List[Trade], bool]:
+        """
+        trades since lastest, page with trades missed between two polls
+        return: (trades, gap), DESC, gap is True if some of the missed trades could not be fetched
+        """
+        try:
+            # pages wait for the rate limiter in the thread
+            trades, complete = await asyncio.to_thread(exchange.fetch_trades_after, symbol, lastest, None, self.max_gap_pages)
+        except NotImplementedError:
+            trades, complete = [], False
+        if not complete:
+            key = (exchange.exchange_name, symbol)
+            self.gaps[key] = self.gaps.get(key, 0) + 1
+            print(f'{exchange.exchange_name} {symbol} missed trades since {lastest} ({self.gaps[key]} gaps)')
+        # newer ones of the page are fetched again or not fetched yet, trades of the same id are the same
+        page_ids = {trade.id for trade in page}
+        trades = [trade for trade in trades if trade.id not in page_ids]
+        if not trades:
+            return page, not complete
+        # both DESC, k-way merge instead of sorting Trade objects
+        return TradeBatch.merge([TradeBatch.from_trades(trades), TradeBatch.from_trades(page)]).to_trades(), not complete
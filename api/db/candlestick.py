@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+import sqlalchemy
+from sqlalchemy import select, func
+
+from api.db.common import get_engine, create_tables, session_scope, upsert, to_db_datetime, Base
+from api.db.trade import iter_trades, get_oldest_trade_time
+from tools.common import get_unique_name
+from tradeengine.models.candlestick import CandleBatch, CandleStick
+from tradeengine.tools.common import datetime_to_ns, ns_to_datetime, timedelta_to_ns
+from tradeengine.tools.convertor import CandleStickBuilder, parse_interval
+
+def _get_dbcandlestick_table_name(exchange_name:str, symbol:str, interval:str) -> str:
+    return f'{get_unique_name(exchange_name, symbol)}_{interval}_candlestick'.lower()
+
+def _get_dbcandlestick_table(exchange_name:str, symbol:str, interval:str) -> sqlalchemy.Table:
+    table_name = _get_dbcandlestick_table_name(exchange_name, symbol, interval)
+    if table_name not in Base.metadata.tables:
+        return sqlalchemy.Table(
+            table_name,
+            Base.metadata,
+            sqlalchemy.Column('opentime', sqlalchemy.dialects.mysql.DATETIME(fsp=6), primary_key=True),
+            sqlalchemy.Column('open', sqlalchemy.Double),
+            sqlalchemy.Column('high', sqlalchemy.Double),
+            sqlalchemy.Column('low', sqlalchemy.Double),
+            sqlalchemy.Column('close', sqlalchemy.Double),
+            sqlalchemy.Column('volume', sqlalchemy.Double),
+            extend_existing=False,
+        )
+    return Base.metadata.tables[table_name]
+
+async def _init_dbcandlestick_table(exchange_name:str, symbol:str, interval:str) -> sqlalchemy.Table:
+    """table is created at the first call of this process"""
+    table = _get_dbcandlestick_table(exchange_name, symbol, interval)
+    await create_tables([table])
+    return table
+
+async def bulk_upsert_candlestick(exchange_name:str, symbol:str, interval:str, candlesticks:CandleBatch) -> None:
+    """insert or replace, the open candlestick stored before will be overwritten"""
+    if len(candlesticks) <= 0:
+        return
+
+    table = await _init_dbcandlestick_table(exchange_name, symbol, interval)
+    async with session_scope() as _session:
+        candlestick_data = [{
+            "opentime": ns_to_datetime(opentime, tz=None),
+            "open": open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume}
+            for opentime, open, high, low, close, volume in zip(
+                candlesticks.opentimes.tolist(), candlesticks.opens.tolist(), candlesticks.highs.tolist(),
+                candlesticks.lows.tolist(), candlesticks.closes.tolist(), candlesticks.volumes.tolist())]
+
+        await _session.execute(upsert(table, get_engine().dialect.name), candlestick_data)
+
+async def get_candlesticks(exchange_name:str, symbol:str, interval:str, since:datetime, until:Optional[datetime]=None) -> List[CandleStick]:
+    """
+    return: DESC, one range query on primary key
+    since: include, until: exclude
+    """
+    table = await _init_dbcandlestick_table(exchange_name, symbol, interval)
+    async with session_scope() as _session:
+        query = select(table).where(table.c.opentime >= to_db_datetime(since))
+        if until is not None:
+            query = query.where(table.c.opentime < to_db_datetime(until))
+        results = (await _session.execute(query.order_by(table.c.opentime.desc()))).fetchall()
+
+    return [
+        CandleStick(
+            Open=row.open,
+            Close=row.close,
+            High=row.high,
+            Low=row.low,
+            Volume=row.volume,
+            Opentime=row.opentime.replace(tzinfo=timezone.utc),
+        )
+        for row in results
+    ]
+
+async def get_candlestick_time_range(exchange_name:str, symbol:str, interval:str) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """return: oldest, lastest opentime, None if no data"""
+    table = await _init_dbcandlestick_table(exchange_name, symbol, interval)
+    async with session_scope() as _session:
+        oldest, lastest = (await _session.execute(
+            select(func.min(table.c.opentime), func.max(table.c.opentime))
+        )).one()
+    if oldest is None or lastest is None:
+        return None, None
+    return oldest.replace(tzinfo=timezone.utc), lastest.replace(tzinfo=timezone.utc)
+
+async def materialize_candlesticks(exchange_name:str, symbol:str, interval:str, since:Optional[datetime]=None) -> int:
+    """
+    aggregate stored trades into the candlestick table, only
+     - trades since the lastest stored candlestick (it may be stored while open, so rebuild it)
+     - trades older than the oldest stored candlestick (backfill, the oldest one is rebuilt too)
+     - since: rebuild from this time, e.g. after missing trades are filled
+    return: number of candlesticks written
+    """
+    delta = parse_interval(interval)
+    interval_ns = timedelta_to_ns(delta)
+
+    oldest, lastest = await get_candlestick_time_range(exchange_name, symbol, interval)
+    ranges:List[Tuple[Optional[datetime], Optional[datetime]]] = []
+    if lastest is None:
+        ranges.append((datetime(1970, 1, 1, tzinfo=timezone.utc), None))
+    else:
+        ranges.append((lastest, None))
+        oldest_trade_time = await get_oldest_trade_time(exchange_name, symbol)
+        if oldest_trade_time is not None and oldest_trade_time < oldest:
+            ranges.append((oldest_trade_time, oldest + delta))
+        if since is not None and since < lastest:
+            # align to candlestick open time
+            since_ns = datetime_to_ns(since.astimezone(timezone.utc))
+            ranges.append((ns_to_datetime(since_ns - since_ns % interval_ns), lastest))
+
+    count = 0
+    for start, end in ranges:
+        # stream trades, only the open candlestick is kept between batches
+        builder = CandleStickBuilder(delta, 1)
+        async for trades in iter_trades(exchange_name, symbol, since=start, until=end, columns=['price', 'size']):
+            candlesticks = builder.push_batch(trades)
+            await bulk_upsert_candlestick(exchange_name, symbol, interval, candlesticks)
+            count += len(candlesticks)
+        candlesticks = builder.to_batch()
+        await bulk_upsert_candlestick(exchange_name, symbol, interval, candlesticks)
+        count += len(candlesticks)
+    return count
\ No newline at end of file
@@ -1,33 +1,175 @@
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Set, Tuple
 
 import sqlalchemy
-from sqlalchemy import Engine
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import Insert
 
 from config.config import Config
 
 Base = declarative_base()
 
-_engine: Engine = None
-_Session: sessionmaker = None
+_engine: AsyncEngine = None
+_Session: async_sessionmaker = None
+# tables created (or checked) by this process, create_all is not called again for them
+_created_tables: Set[str] = set()
+# pool events, see get_pool_metrics
+_pool_events: Dict[str, int] = {'connect': 0, 'checkout': 0, 'checkin': 0, 'invalidate': 0}
 
-def get_engine() -> Engine:
+# sync driver in connection string -> async driver
+_ASYNC_DRIVERS = {
+    'mariadb': 'mariadb+asyncmy',
+    'mariadb+mariadbconnector': 'mariadb+asyncmy',
+    'mysql': 'mysql+asyncmy',
+    'mysql+mysqldb': 'mysql+asyncmy',
+    'mysql+pymysql': 'mysql+asyncmy',
+    'mysql+mariadbconnector': 'mysql+asyncmy',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+def to_async_connection_string(connection_string:str) -> sqlalchemy.URL:
+    """keep config.yaml unchanged, e.g. mariadb+mariadbconnector -> mariadb+asyncmy, sqlite -> sqlite+aiosqlite"""
+    url = sqlalchemy.make_url(connection_string)
+    return url.set(drivername=_ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+def get_engine() -> AsyncEngine:
+    """
+    async engine, connections are bound to the event loop using them,
+    call db functions from sync code by tools.common.run_async (one long-lived loop)
+    """
     global _engine
     if _engine is None:
-        connection_string = Config().connection_string
-        _engine = sqlalchemy.create_engine(
-            connection_string,
-            pool_size=5,
-            max_overflow=10,
-            pool_timeout=30,
-            pool_recycle=1800,
-            # echo=True
-        )
+        url = to_async_connection_string(Config().connection_string)
+        if url.get_backend_name() == 'sqlite':
+            # stand-in for tests, no server side pool
+            _engine = create_async_engine(url)
+        else:
+            _engine = create_async_engine(
+                url,
+                pool_size=5,
+                max_overflow=10,
+                pool_timeout=30,
+                pool_recycle=1800,
+                # LOAD DATA LOCAL INFILE, see api.db.trade.bulk_insert_trade
+                connect_args={'local_infile': True},
+                # echo=True
+            )
+        for event_name in _pool_events:
+            sqlalchemy.event.listen(_engine.sync_engine, event_name, _count_pool_event(event_name))
     return _engine
 
+def _count_pool_event(event_name:str):
+    def _count(*args) -> None:
+        _pool_events[event_name] += 1
+    return _count
+
+def get_pool_metrics() -> Dict[str, int]:
+    """
+    connect/checkout/checkin/invalidate: event counts of this process
+    checked_out: connections in use now, keeps growing if sessions leak
+    size/checked_in/overflow: pool status, -1 if the pool does not support it (e.g. sqlite)
+    """
+    metrics = dict(_pool_events)
+    metrics['checked_out'] = _pool_events['checkout'] - _pool_events['checkin']
+    pool = get_engine().pool
+    for name, method in (('size', 'size'), ('checked_in', 'checkedin'), ('overflow', 'overflow')):
+        metrics[name] = getattr(pool, method)() if hasattr(pool, method) else -1
+    return metrics
+
+def format_pool_metrics() -> str:
+    """one line of get_pool_metrics, printed next to ingest reports"""
+    return ', '.join(f'{name}: {value}' for name, value in get_pool_metrics().items())
 
-def create_sessison(engine: Engine) -> Session:
+def reset_engine() -> None:
+    """drop the engine inherited from parent process (connections cannot be shared), e.g. ProcessPoolExecutor initializer"""
+    global _engine, _Session
+    if _engine is not None:
+        _engine.sync_engine.dispose(close=False)
+    _engine = None
+    _Session = None
+    for event_name in _pool_events:
+        _pool_events[event_name] = 0
+
+@asynccontextmanager
+async def session_scope() -> AsyncIterator[AsyncSession]:
+    """session for one unit of work, commit on success, rollback on error, always closed"""
     global _Session
     if _Session is None:
-        _Session = sessionmaker(bind=engine)
-    return _Session()
\ No newline at end of file
+        _Session = async_sessionmaker(bind=get_engine(), expire_on_commit=False)
+    async with _Session() as session:
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+
+async def create_tables(tables:List[sqlalchemy.Table]) -> None:
+    """create tables once per process, later calls for the same tables do not touch db"""
+    new_tables = [table for table in tables if table.name not in _created_tables]
+    if not new_tables:
+        return
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.create_all, tables=new_tables)
+    _created_tables.update(table.name for table in new_tables)
+
+def is_mysql() -> bool:
+    """mysql or mariadb, else sqlite stand-in"""
+    return get_engine().dialect.name in ('mysql', 'mariadb')
+
+@lru_cache(maxsize=32)
+def insert_ignore_sql(table_name:str, columns:Tuple[str, ...], row_num:int, paramstyle:str, is_mysql:bool) -> str:
+    """
+    INSERT IGNORE INTO table (...) VALUES (...), (...), ... with positional placeholders, for exec_driver_sql
+    skip rows whose primary key exists, INSERT IGNORE (mysql, mariadb) or INSERT OR IGNORE (sqlite)
+    """
+    placeholder = '?' if paramstyle == 'qmark' else '%s'
+    values = '(' + ', '.join([placeholder] * len(columns)) + ')'
+    insert = 'INSERT IGNORE' if is_mysql else 'INSERT OR IGNORE'
+    return f'{insert} INTO {table_name} ({", ".join(columns)}) VALUES ' + ', '.join([values] * row_num)
+
+def seconds_between(start, end):
+    """sql expression of (end - start) in seconds, both are datetime columns"""
+    if is_mysql():
+        return sqlalchemy.func.timestampdiff(sqlalchemy.literal_column('MICROSECOND'), start, end) / 1e6
+    return (sqlalchemy.func.julianday(end) - sqlalchemy.func.julianday(start)) * 86400.0
+
+@dataclass
+class IngestReport:
+    rows: int # rows sent
+    inserted: int # rows written, duplicated ones are skipped
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __add__(self, other:'IngestReport') -> 'IngestReport':
+        return IngestReport(self.rows + other.rows, self.inserted + other.inserted, self.seconds + other.seconds)
+
+    def __str__(self) -> str:
+        return f'{self.rows} rows ({self.inserted} inserted) in {self.seconds:.2f}s, {self.rows_per_second:.0f} rows/s'
+
+def upsert(table:sqlalchemy.Table, dialect_name:str) -> Insert:
+    """insert or update non primary key columns, ON DUPLICATE KEY UPDATE (mysql, mariadb) or ON CONFLICT DO UPDATE (sqlite)"""
+    columns:List[str] = [column.name for column in table.columns if not column.primary_key]
+    if dialect_name == 'sqlite':
+        sql = sqlite.insert(table)
+        return sql.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_={column: sql.excluded[column] for column in columns},
+        )
+    sql = mysql.insert(table)
+    return sql.on_duplicate_key_update({column: sql.inserted[column] for column in columns})
+
+def to_db_datetime(date:datetime) -> datetime:
+    """db stores naive UTC datetime"""
+    if date.tzinfo is None:
+        return date
+    return date.astimezone(timezone.utc).replace(tzinfo=None)
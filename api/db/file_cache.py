@@ -0,0 +1,185 @@
+"""
+local columnar cache of db data for offline backtests
+ - Arrow IPC files partitioned by day (UTC): {ConstantPath.CACHE_FOLDER}/{exchange}/{symbol}/{kind}/{YYYY-MM-DD}.arrow
+ - uncompressed, loaded by memory map, numeric columns are numpy views of the mapped file
+ - each file keeps the db lastest trade time when it was written, a day is
+    - complete if it ended before that time, valid until invalidated (e.g. missing trades are filled)
+    - partial (today) otherwise, valid only while the db lastest trade time is unchanged
+"""
+from datetime import date, datetime, timedelta, timezone
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+
+from api.db.candlestick import get_candlesticks
+from api.db.trade import get_lastest_trade_time, iter_trades
+from tools.constants import ConstantPath
+from tradeengine.models.candlestick import CandleBatch
+from tradeengine.models.trade import TradeBatch
+from tradeengine.tools.common import datetime_to_ns, ns_to_datetime
+
+_DAY_NS = 86400 * 10**9
+_LASTEST_KEY = b'lastest'
+
+_TRADES = 'trades'
+_TRADE_COLUMNS = ['time', 'id', 'price', 'size', 'side']
+_CANDLESTICK_COLUMNS = ['opentime', 'open', 'high', 'low', 'close', 'volume']
+
+def _candlesticks_kind(interval:str) -> str:
+    return f'candlesticks_{interval}'
+
+class FileCache:
+    """day files of one kind (trades, candlesticks_5m, ...) of one symbol, columns are ASC by the first column (epoch ns)"""
+    def __init__(self, exchange_name:str, symbol:str, kind:str, root:Path=ConstantPath.CACHE_FOLDER):
+        self.folder = Path(root, exchange_name, symbol, kind)
+
+    def _path(self, day:int) -> Path:
+        return self.folder.joinpath(f'{date(1970, 1, 1) + timedelta(days=day)}.arrow')
+
+    def is_valid(self, day:int, lastest:Optional[int]) -> bool:
+        """lastest: db lastest trade time (epoch ns), None to accept any existing file (offline)"""
+        path = self._path(day)
+        if not path.exists():
+            return False
+        if lastest is None:
+            return True
+        with pa.memory_map(str(path)) as source:
+            written_lastest = int(pa.ipc.open_file(source).schema.metadata[_LASTEST_KEY])
+        return (day + 1) * _DAY_NS <= written_lastest or written_lastest == lastest
+
+    def write(self, day:int, columns:Dict[str, np.ndarray], lastest:int) -> None:
+        """replace the file atomically, columns: ASC"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        table = pa.table({name: pa.array(column) for name, column in columns.items()})
+        table = table.replace_schema_metadata({_LASTEST_KEY: str(lastest).encode()})
+        path = self._path(day)
+        tmp_path = path.with_suffix('.tmp')
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    def read(self, day:int) -> Optional[Dict[str, np.ndarray]]:
+        """memory mapped, None if the file does not exist"""
+        path = self._path(day)
+        if not path.exists():
+            return None
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        return {name: _to_numpy(table.column(name)) for name in table.column_names}
+
+    def invalidate(self, since:Optional[int]=None) -> None:
+        """delete files of days since `since` (epoch ns), all files if None"""
+        if not self.folder.exists():
+            return
+        if since is None:
+            shutil.rmtree(self.folder)
+            return
+        first_day = since // _DAY_NS
+        for path in self.folder.glob('*.arrow'):
+            day = (date.fromisoformat(path.stem) - date(1970, 1, 1)).days
+            if day >= first_day:
+                path.unlink()
+
+def _to_numpy(column:pa.ChunkedArray) -> np.ndarray:
+    if column.num_chunks == 1 and column.null_count == 0 and pa.types.is_primitive(column.type):
+        # zero copy view of the mapped file
+        return column.chunk(0).to_numpy(zero_copy_only=True)
+    return column.to_numpy()
+
+def _days(since:datetime, until:Optional[datetime]) -> range:
+    until_ns = datetime_to_ns(until.astimezone(timezone.utc)) if until is not None else datetime_to_ns(datetime.now(timezone.utc))
+    return range(datetime_to_ns(since.astimezone(timezone.utc)) // _DAY_NS, until_ns // _DAY_NS + 1)
+
+def invalidate_cache(exchange_name:str, symbol:str, since:Optional[datetime]=None, root:Path=ConstantPath.CACHE_FOLDER) -> None:
+    """delete cached trades and candlesticks since `since` (all if None), e.g. after missing trades are filled"""
+    since_ns = datetime_to_ns(since.astimezone(timezone.utc)) if since is not None else None
+    folder = Path(root, exchange_name, symbol)
+    if not folder.exists():
+        return
+    for kind_folder in folder.iterdir():
+        FileCache(exchange_name, symbol, kind_folder.name, root).invalidate(since_ns)
+
+async def _get_lastest(exchange_name:str, symbol:str) -> int:
+    lastest = await get_lastest_trade_time(exchange_name, symbol)
+    return datetime_to_ns(lastest) if lastest is not None else 0
+
+async def cache_trades(exchange_name:str, symbol:str, since:datetime, until:Optional[datetime]=None, root:Path=ConstantPath.CACHE_FOLDER) -> None:
+    """write day files not valid for current db data, one range query per day"""
+    cache = FileCache(exchange_name, symbol, _TRADES, root)
+    lastest = await _get_lastest(exchange_name, symbol)
+    for day in _days(since, until):
+        if cache.is_valid(day, lastest):
+            continue
+        batches = [batch async for batch in iter_trades(exchange_name, symbol, ns_to_datetime(day * _DAY_NS), ns_to_datetime((day + 1) * _DAY_NS))]
+        trades = TradeBatch.concat(batches[::-1])[::-1]
+        ids = trades.ids if trades.ids.dtype != object else trades.ids.astype(str)
+        cache.write(day, dict(zip(_TRADE_COLUMNS, (trades.times, ids, trades.prices, trades.sizes, trades.sides))), lastest)
+
+def read_trades(exchange_name:str, symbol:str, since:datetime, until:Optional[datetime]=None, root:Path=ConstantPath.CACHE_FOLDER) -> Iterator[TradeBatch]:
+    """
+    cached trades only (no db access), memory is bounded by one day
+    yield: TradeBatch of each day, batches are ASC, trades in a batch are DESC (same as api.db.trade.iter_trades)
+    since: include, until: exclude
+    """
+    cache = FileCache(exchange_name, symbol, _TRADES, root)
+    since_ns = datetime_to_ns(since.astimezone(timezone.utc))
+    until_ns = datetime_to_ns(until.astimezone(timezone.utc)) if until is not None else None
+    for day in _days(since, until):
+        columns = cache.read(day)
+        if columns is None:
+            continue
+        times = columns['time']
+        start = np.searchsorted(times, since_ns, side='left')
+        end = np.searchsorted(times, until_ns, side='left') if until_ns is not None else len(times)
+        if start >= end:
+            continue
+        yield TradeBatch(
+            ids=columns['id'][start:end][::-1],
+            times=times[start:end][::-1],
+            prices=columns['price'][start:end][::-1],
+            sizes=columns['size'][start:end][::-1],
+            sides=columns['side'][start:end][::-1],
+            is_sorted=True,
+        )
+
+async def load_trades(exchange_name:str, symbol:str, since:datetime, until:Optional[datetime]=None, offline:bool=False, root:Path=ConstantPath.CACHE_FOLDER) -> TradeBatch:
+    """read through cache, return: DESC. offline: cached trades only, db is not accessed"""
+    if not offline:
+        await cache_trades(exchange_name, symbol, since, until, root)
+    batches = list(read_trades(exchange_name, symbol, since, until, root))
+    return TradeBatch.concat(batches[::-1])
+
+async def cache_candlesticks(exchange_name:str, symbol:str, interval:str, since:datetime, root:Path=ConstantPath.CACHE_FOLDER) -> None:
+    """write day files not valid for current db data, stored candlesticks must be materialized before"""
+    cache = FileCache(exchange_name, symbol, _candlesticks_kind(interval), root)
+    lastest = await _get_lastest(exchange_name, symbol)
+    for day in _days(since, None):
+        if cache.is_valid(day, lastest):
+            continue
+        candlesticks = CandleBatch.from_candlesticks(await get_candlesticks(
+            exchange_name, symbol, interval, ns_to_datetime(day * _DAY_NS), ns_to_datetime((day + 1) * _DAY_NS)))[::-1]
+        cache.write(day, dict(zip(_CANDLESTICK_COLUMNS, (
+            candlesticks.opentimes, candlesticks.opens, candlesticks.highs, candlesticks.lows, candlesticks.closes, candlesticks.volumes))), lastest)
+
+def read_candlesticks(exchange_name:str, symbol:str, interval:str, since:datetime, root:Path=ConstantPath.CACHE_FOLDER) -> CandleBatch:
+    """cached candlesticks only (no db access), return: DESC"""
+    cache = FileCache(exchange_name, symbol, _candlesticks_kind(interval), root)
+    since_ns = datetime_to_ns(since.astimezone(timezone.utc))
+    batches:List[CandleBatch] = []
+    for day in _days(since, None):
+        columns = cache.read(day)
+        if columns is None:
+            continue
+        start = np.searchsorted(columns['opentime'], since_ns, side='left')
+        batches.append(CandleBatch(*[columns[name][start:][::-1] for name in ('opentime', 'open', 'close', 'high', 'low', 'volume')]))
+    return CandleBatch.concat(batches[::-1])
+
+async def load_candlesticks(exchange_name:str, symbol:str, interval:str, since:datetime, offline:bool=False, root:Path=ConstantPath.CACHE_FOLDER) -> CandleBatch:
+    """read through cache, return: DESC. offline: cached candlesticks only, db is not accessed"""
+    if not offline:
+        await cache_candlesticks(exchange_name, symbol, interval, since, root)
+    return read_candlesticks(exchange_name, symbol, interval, since, root)
@@ -1,20 +1,34 @@
+import csv
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+import os
+import tempfile
+import time
+from typing import AsyncIterator, List, Optional, Tuple, Union
+import numpy as np
 import sqlalchemy
 from sqlalchemy import select, func
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncConnection
 
-from api.db.common import get_engine, create_sessison, Base
-from tools.common import get_now, get_unique_name
-from tradeengine.models.trade import Trade
+from api.db.common import IngestReport, create_tables, insert_ignore_sql, is_mysql, seconds_between, session_scope, to_db_datetime, Base
+from tools.common import get_now, get_unique_name, local_2_utc
+from tradeengine.models.trade import Side, Trade, TradeBatch, encode_ids, encode_sides
+from tradeengine.tools.common import datetimes_to_ns
+
+_TRADE_COLUMNS = ['id', 'price', 'size', 'side', 'execution_time']
+# rows per INSERT statement, sqlite allows at most 32766 bind parameters (5 per row)
+_INGEST_BATCH_SIZE = 5000
+_SQLITE_MAX_BATCH_SIZE = 32766 // len(_TRADE_COLUMNS)
+# TradeBatch side code -> db value
+_SIDE_VALUES = np.array([Side.SELL.value, Side.NONE.value, Side.BUY.value], dtype=object)
 
 def _get_dbtrade_table_name(exchange_name:str, symbol:str) -> str:
     return f'{get_unique_name(exchange_name, symbol)}_trade'.lower()
 
-def _init_dbtrade_schema(exchange_name:str,symbol:str) -> None:
+def _get_dbtrade_table(exchange_name:str, symbol:str) -> sqlalchemy.Table:
     table_name = _get_dbtrade_table_name(exchange_name, symbol)
     if table_name not in Base.metadata.tables:
-        sqlalchemy.Table(
+        return sqlalchemy.Table(
             table_name,
             Base.metadata,
             sqlalchemy.Column('id', sqlalchemy.String(length=15), primary_key=True),
@@ -24,78 +38,242 @@ def _init_dbtrade_schema(exchange_name:str,symbol:str) -> None:
             sqlalchemy.Column('execution_time', sqlalchemy.dialects.mysql.DATETIME(fsp=6), index=True),
             extend_existing=False,
         )
+    return Base.metadata.tables[table_name]
 
-def _init_trade_session(exchange_name:str, symbol:str) -> Session:
-    _engine = get_engine()
-    _session = create_sessison(_engine)
+def _get_dbtrade_gap_table(exchange_name:str, symbol:str) -> sqlalchemy.Table:
+    """gaps already fetched from api, no trades in them (e.g. market closed), not fetched again"""
+    table_name = f'{get_unique_name(exchange_name, symbol)}_trade_gap'.lower()
+    if table_name not in Base.metadata.tables:
+        return sqlalchemy.Table(
+            table_name,
+            Base.metadata,
+            sqlalchemy.Column('lower_id', sqlalchemy.String(length=15), primary_key=True),
+            sqlalchemy.Column('upper_id', sqlalchemy.String(length=15), primary_key=True),
+            extend_existing=False,
+        )
+    return Base.metadata.tables[table_name]
 
-    _init_dbtrade_schema(exchange_name, symbol)
-    Base.metadata.create_all(_engine)
-    return _session
+async def _init_dbtrade_table(exchange_name:str, symbol:str) -> sqlalchemy.Table:
+    """table is created at the first call of this process"""
+    table = _get_dbtrade_table(exchange_name, symbol)
+    await create_tables([table])
+    return table
 
-async def bulk_insert_trade(exchange_name: str, symbol: str, trades: List[Trade]) -> None:
-    if not trades or len(trades) <= 0:
-        return
+async def init_trade_tables(exchange_name:str, symbols:List[str]) -> None:
+    """create all tables at startup with one round-trip"""
+    await create_tables([_get_dbtrade_table(exchange_name, symbol) for symbol in symbols])
 
-    _session = _init_trade_session(exchange_name, symbol)
-    table_name = _get_dbtrade_table_name(exchange_name, symbol)
+async def bulk_insert_trade(exchange_name: str, symbol: str, trades: Union[List[Trade], TradeBatch], batch_size:int=_INGEST_BATCH_SIZE, mode:str='values') -> IngestReport:
+    """
+    insert trades, trades with existing id are skipped
+    mode:
+     - values: one multi-row INSERT per batch_size trades, sent as plain driver sql (no sqlalchemy compile per row)
+     - load_data: LOAD DATA LOCAL INFILE from a temp csv file, mysql/mariadb only, values is used for sqlite
+    """
+    if trades is None or len(trades) <= 0:
+        return IngestReport(0, 0, 0.0)
+    if mode not in ('values', 'load_data'):
+        raise ValueError(f'unknown mode: {mode}, must be "values" or "load_data"')
 
-    trade_data = [{
-        "id": trade.id,
-        "price": trade.price,
-        "size": trade.size,
-        "side": trade.side.value,
-        "execution_time": trade.execution_time}
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    start = time.perf_counter()
+    rows = _trade_rows(trades)
+
+    inserted = 0
+    async with session_scope() as _session:
+        connection = await _session.connection()
+        if mode == 'load_data' and is_mysql():
+            inserted = await _load_data(connection, table, rows)
+        else:
+            _is_mysql = is_mysql()
+            if not _is_mysql:
+                batch_size = min(batch_size, _SQLITE_MAX_BATCH_SIZE)
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                sql = insert_ignore_sql(table.name, tuple(_TRADE_COLUMNS), len(batch), connection.dialect.paramstyle, _is_mysql)
+                result = await connection.exec_driver_sql(sql, tuple(value for row in batch for value in row))
+                inserted += max(result.rowcount, 0)
+
+    return IngestReport(len(rows), inserted, time.perf_counter() - start)
+
+def _trade_rows(trades:Union[List[Trade], TradeBatch]) -> List[Tuple]:
+    """rows in _TRADE_COLUMNS order, execution_time as naive UTC str (accepted by both mysql and sqlite)"""
+    if isinstance(trades, TradeBatch):
+        times = np.datetime_as_string((trades.times // 1000).astype('datetime64[us]'), unit='us')
+        return list(zip(
+            [str(_id) for _id in trades.ids.tolist()],
+            trades.prices.tolist(),
+            trades.sizes.tolist(),
+            _SIDE_VALUES[trades.sides.astype(np.int64) + 1].tolist(),
+            [date.replace('T', ' ') for date in times.tolist()],
+        ))
+
+    return [(
+        trade.id,
+        trade.price,
+        trade.size,
+        trade.side.value,
+        to_db_datetime(trade.execution_time).isoformat(sep=' ', timespec='microseconds'))
         for trade in trades]
 
-    sql = sqlalchemy.text(f"""
-          INSERT IGNORE INTO {table_name} (id, price, size, side, execution_time)
-          VALUES (:id, :price, :size, :side, :execution_time)
-          """)
-    _session.execute(sql, trade_data)
-    _session.commit()
+async def _load_data(connection:AsyncConnection, table:sqlalchemy.Table, rows:List[Tuple]) -> int:
+    """return: inserted rows"""
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerows(rows)
 
-async def get_trades(exchange_name:str, symbol:str, last_days:Optional[int] = 90) -> List[Trade]:
-    _session = _init_trade_session(exchange_name, symbol)
-    table_name = _get_dbtrade_table_name(exchange_name, symbol)
+        sql = sqlalchemy.text(f"""
+              LOAD DATA LOCAL INFILE :path IGNORE INTO TABLE {table.name}
+              FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+              LINES TERMINATED BY '\\n'
+              ({', '.join(_TRADE_COLUMNS)})
+              """)
+        result = await connection.execute(sql, {'path': path})
+        return max(result.rowcount, 0)
+    finally:
+        os.remove(path)
 
-    now = get_now()
-    since = now - timedelta(days=last_days)
+async def get_trades(exchange_name:str, symbol:str, last_days:Optional[int] = 90, since:Optional[datetime]=None, until:Optional[datetime]=None) -> List[Trade]:
+    """
+    return: DESC
+    since: include, if set, last_days is ignored
+    until: exclude
+    """
+    if since is None:
+        since = local_2_utc(get_now() - timedelta(days=last_days))
+    batches = [batch async for batch in iter_trades(exchange_name, symbol, since, until)]
+    # batches are ASC
+    return TradeBatch.concat(batches[::-1]).to_trades()
 
-    results = _session.execute(
-        select(Base.metadata.tables[table_name])
-        .where(Base.metadata.tables[table_name].c.execution_time > since)
-        .order_by(Base.metadata.tables[table_name].c.execution_time.desc())
-    ).fetchall()
+async def iter_trades(exchange_name:str, symbol:str, since:Optional[datetime]=None, until:Optional[datetime]=None, batch_size:int=100000, columns:Optional[List[str]]=None) -> AsyncIterator[TradeBatch]:
+    """
+    stream trades by server side cursor, memory is bounded by batch_size
+    yield: TradeBatch of at most batch_size trades, batches are ASC, trades in a batch are DESC (same as TradeBatch)
+    since: include, until: exclude
+    columns: subset of "id", "price", "size", "side", "execution_time", execution_time is always read.
+             columns not read are filled with 0
+    """
+    table = await _init_dbtrade_table(exchange_name, symbol)
 
-    trades = []
-    for row in results:
-        row_dict = dict(row._mapping)
-        row_dict["execution_time"] = row_dict["execution_time"].replace(tzinfo=timezone.utc)
-        trades.append(Trade(**row_dict))
-    return trades
+    if columns is None:
+        columns = _TRADE_COLUMNS
+    else:
+        columns = [column for column in _TRADE_COLUMNS if column in columns or column == 'execution_time']
 
-async def get_lastest_trade_time(exchange_name:str, symbol:str) -> Optional[datetime]:
-    _session = _init_trade_session(exchange_name, symbol)
-    table_name = _get_dbtrade_table_name(exchange_name, symbol)
+    query = select(*[table.c[column] for column in columns])
+    if since is not None:
+        query = query.where(table.c.execution_time >= to_db_datetime(since))
+    if until is not None:
+        query = query.where(table.c.execution_time < to_db_datetime(until))
+    query = query.order_by(table.c.execution_time.asc())
+
+    async with session_scope() as _session:
+        result = await _session.stream(query, execution_options={'yield_per': batch_size})
+        try:
+            async for rows in result.partitions(batch_size):
+                yield _rows_2_trade_batch(rows, columns)
+        finally:
+            await result.close()
 
-    result = _session.query(
-        func.max(Base.metadata.tables[table_name].c.execution_time)
-    ).one_or_none()
+def _rows_2_trade_batch(rows:List, columns:List[str]) -> TradeBatch:
+    """rows: ASC, return: DESC"""
+    n = len(rows)
+    values = dict(zip(columns, zip(*rows)))
+    # db datetime is naive UTC
+    times = datetimes_to_ns(values['execution_time'])
+    ids = encode_ids(list(values['id'])) if 'id' in values else np.zeros(n, dtype=np.int64)
+    prices = np.array(values['price'], dtype=np.float64) if 'price' in values else np.zeros(n, dtype=np.float64)
+    sizes = np.array(values['size'], dtype=np.float64) if 'size' in values else np.zeros(n, dtype=np.float64)
+    sides = encode_sides(values['side']) if 'side' in values else np.zeros(n, dtype=np.int8)
+    # rows are ordered by execution_time
+    return TradeBatch(ids[::-1], times[::-1], prices[::-1], sizes[::-1], sides[::-1], tz=timezone.utc, is_sorted=True)
+
+async def get_lastest_trade_time(exchange_name:str, symbol:str) -> Optional[datetime]:
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    async with session_scope() as _session:
+        result = await _session.scalar(select(func.max(table.c.execution_time)))
 
     if result is not None:
-        result = result[0].replace(tzinfo=timezone.utc)
+        result = result.replace(tzinfo=timezone.utc)
     return result
 
 
-async def get_oldest_trade_time(exchange_name:str, symbol:str) -> Optional[datetime]:
-    _session = _init_trade_session(exchange_name, symbol)
-    table_name = _get_dbtrade_table_name(exchange_name, symbol)
+async def get_lastest_trade_id(exchange_name:str, symbol:str) -> Optional[str]:
+    """id of the lastest trade, by execution_time index"""
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    async with session_scope() as _session:
+        return await _session.scalar(select(table.c.id).order_by(table.c.execution_time.desc()).limit(1))
 
-    result = _session.query(
-        func.min(Base.metadata.tables[table_name].c.execution_time)
-    ).one_or_none()
+async def get_oldest_trade_time(exchange_name:str, symbol:str) -> Optional[datetime]:
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    async with session_scope() as _session:
+        result = await _session.scalar(select(func.min(table.c.execution_time)))
 
     if result is not None:
-        result = result[0].replace(tzinfo=timezone.utc)
-    return result
\ No newline at end of file
+        result = result.replace(tzinfo=timezone.utc)
+    return result
+
+async def get_oldest_trade_id(exchange_name:str, symbol:str) -> Optional[str]:
+    """id of the oldest trade, by execution_time index"""
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    async with session_scope() as _session:
+        return await _session.scalar(select(table.c.id).order_by(table.c.execution_time.asc()).limit(1))
+
+@dataclass
+class TradeGap:
+    """no trades are stored between the two trades"""
+    lower_id: str
+    lower_time: datetime
+    upper_id: str
+    upper_time: datetime
+
+async def find_trade_gaps(exchange_name:str, symbol:str, since:datetime, min_gap:timedelta) -> List[TradeGap]:
+    """
+    gaps longer than min_gap between neighbor trades since `since`, ASC, gaps marked by mark_trade_gaps_checked are excluded
+    only (id, execution_time) are read, covered by execution_time index (index-only scan)
+    """
+    table = await _init_dbtrade_table(exchange_name, symbol)
+    gap_table = _get_dbtrade_gap_table(exchange_name, symbol)
+    await create_tables([gap_table])
+
+    window = {'order_by': table.c.execution_time}
+    neighbors = select(
+        table.c.id,
+        table.c.execution_time,
+        func.lag(table.c.id, type_=table.c.id.type).over(**window).label('prev_id'),
+        func.lag(table.c.execution_time, type_=table.c.execution_time.type).over(**window).label('prev_time'),
+    ).where(table.c.execution_time >= to_db_datetime(since)).subquery()
+    query = select(neighbors).where(
+        neighbors.c.prev_time.is_not(None),
+        seconds_between(neighbors.c.prev_time, neighbors.c.execution_time) > min_gap.total_seconds(),
+    ).order_by(neighbors.c.execution_time)
+
+    async with session_scope() as _session:
+        rows = (await _session.execute(query)).fetchall()
+        checked = set((await _session.execute(select(gap_table.c.lower_id, gap_table.c.upper_id))).tuples().all())
+
+    return [
+        TradeGap(
+            lower_id=row.prev_id,
+            lower_time=row.prev_time.replace(tzinfo=timezone.utc),
+            upper_id=row.id,
+            upper_time=row.execution_time.replace(tzinfo=timezone.utc),
+        )
+        for row in rows if (row.prev_id, row.id) not in checked
+    ]
+
+async def mark_trade_gaps_checked(exchange_name:str, symbol:str, gaps:List[TradeGap]) -> None:
+    """
+    call after gaps are fetched from api, gaps still exist have no trades and are not returned by find_trade_gaps any more
+    filled gaps are not returned anyway
+    """
+    if not gaps:
+        return
+    gap_table = _get_dbtrade_gap_table(exchange_name, symbol)
+    await create_tables([gap_table])
+    async with session_scope() as _session:
+        connection = await _session.connection()
+        sql = insert_ignore_sql(gap_table.name, ('lower_id', 'upper_id'), 1, connection.dialect.paramstyle, is_mysql())
+        await connection.exec_driver_sql(sql, [(gap.lower_id, gap.upper_id) for gap in gaps])
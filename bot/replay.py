@@ -0,0 +1,172 @@
+"""
+deterministic replay of stored trades through the live engine (tradeengine.live.engine.LiveEngine)
+ - trades are read from file cache (api.db.file_cache) or db (api.db.trade.iter_trades) and emitted as TradeEvent
+   in time order, same as the realtime api (Exchange.stream_trades), so backtest and production share one engine
+ - a virtual clock follows the replayed trades, get_now and the engine see the replay time
+ - speed: 1.0 is real time, 100.0 is 100x, None is as fast as possible (throughput of the pipeline)
+decisions depend only on the trades, not on speed or machine load
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+import heapq
+import time
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+from api.db.file_cache import read_trades
+from api.db.trade import iter_trades
+from tools.common import set_clock
+from tradeengine.live.engine import LiveEngine, TradeEvent
+from tradeengine.models.trade import Trade, TradeBatch
+from tradeengine.tools.common import datetime_to_ns, ns_to_datetime
+
+# batches are ASC, trades in a batch are DESC (same as api.db.trade.iter_trades)
+TradeSource = Union[Iterable[TradeBatch], AsyncIterable[TradeBatch]]
+
+def file_source(exchange_name:str, symbol:str, since:datetime, until:Optional[datetime]=None) -> Iterable[TradeBatch]:
+    """cached trades, see api.db.file_cache.cache_trades"""
+    return read_trades(exchange_name, symbol, since, until)
+
+def db_source(exchange_name:str, symbol:str, since:datetime, until:Optional[datetime]=None) -> AsyncIterable[TradeBatch]:
+    return iter_trades(exchange_name, symbol, since, until)
+
+class VirtualClock:
+    """replay time, epoch ns, only moves forward"""
+    def __init__(self, start:int=0):
+        self._time = start
+
+    def now_ns(self) -> int:
+        return self._time
+
+    def now(self) -> datetime:
+        """local naive datetime, same as datetime.now() (tools.common.get_now)"""
+        return ns_to_datetime(self._time).astimezone().replace(tzinfo=None)
+
+    def advance(self, time:int) -> None:
+        if time > self._time:
+            self._time = time
+
+class _Cursor:
+    """trades of one symbol, ASC"""
+    def __init__(self, symbol:str, source:TradeSource):
+        self.symbol = symbol
+        self._is_async = hasattr(source, '__aiter__')
+        self._batches = source.__aiter__() if self._is_async else iter(source)
+        self.times:List[int] = []
+        self.trades:List[Trade] = []
+        self.position = 0
+
+    async def fill(self) -> bool:
+        """load the next non empty batch if this one is consumed, False at the end"""
+        while self.position >= len(self.trades):
+            try:
+                if self._is_async:
+                    batch = await self._batches.__anext__()
+                else:
+                    batch = next(self._batches)
+            except (StopIteration, StopAsyncIteration):
+                return False
+            self.times = batch.times[::-1].tolist()
+            self.trades = batch.to_trades()[::-1]
+            self.position = 0
+        return True
+
+class TradeReplay:
+    """
+    stored trades of symbols as TradeEvent, async iterable like Exchange.stream_trades
+     - trades of all symbols are merged in time order, ties by the order of sources
+     - message_size: max trades per event, an event has trades of one symbol only
+     - clock is advanced to the last trade of each event before it is emitted
+    """
+    def __init__(self, sources:Dict[str, TradeSource], clock:Optional[VirtualClock]=None, speed:Optional[float]=None, message_size:int=1):
+        if speed is not None and speed <= 0:
+            raise ValueError(f'speed must be positive or None (max), speed: {speed}')
+        self.sources = sources
+        self.clock = clock if clock is not None else VirtualClock()
+        self.speed = speed
+        self.message_size = max(1, message_size)
+
+        self.trades = 0
+        self.events = 0
+        self.first:Optional[int] = None # epoch ns of the first trade
+
+    def __aiter__(self) -> AsyncIterator[TradeEvent]:
+        return self._events()
+
+    async def _events(self) -> AsyncIterator[TradeEvent]:
+        cursors = [_Cursor(symbol, source) for symbol, source in self.sources.items()]
+        # (next trade time, source order)
+        heap:List[Tuple[int, int]] = []
+        for i, cursor in enumerate(cursors):
+            if await cursor.fill():
+                heap.append((cursor.times[cursor.position], i))
+        heapq.heapify(heap)
+
+        wall_start = 0
+        while heap:
+            _, i = heapq.heappop(heap)
+            cursor = cursors[i]
+            # until another symbol's trade is older, in the current batch only
+            limit = heap[0] if heap else None
+            start = cursor.position
+            end = min(start + self.message_size, len(cursor.trades))
+            position = start + 1
+            while position < end and (limit is None or (cursor.times[position], i) < limit):
+                position += 1
+            trades = cursor.trades[start:position]
+            first = cursor.times[start]
+            last = cursor.times[position - 1]
+            cursor.position = position
+            if await cursor.fill():
+                heapq.heappush(heap, (cursor.times[cursor.position], i))
+
+            if self.first is None:
+                self.first = first
+                wall_start = time.perf_counter_ns()
+            if self.speed is not None:
+                # wall time of the trade at speed, sleep only when ahead
+                delay = (wall_start + (last - self.first) / self.speed - time.perf_counter_ns()) / 1e9
+                if delay > 0.001:
+                    await asyncio.sleep(delay)
+
+            self.clock.advance(last)
+            self.trades += len(trades)
+            self.events += 1
+            yield TradeEvent(cursor.symbol, trades, time.perf_counter_ns())
+
+@dataclass
+class ReplayReport:
+    trades: int
+    events: int
+    seconds: float # wall time
+    replayed: float # seconds of replayed trades
+
+    @property
+    def trades_per_second(self) -> float:
+        return self.trades / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def speed(self) -> float:
+        return self.replayed / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.trades} trades ({self.events} events) in {self.seconds:.2f}s, '
+                f'{self.trades_per_second:.0f} trades/s, {self.speed:.0f}x real time')
+
+async def run_replay(engine:LiveEngine, replay:TradeReplay) -> ReplayReport:
+    """
+    feed replay to engine, engine.clock should be replay.clock.now_ns and engine.timer False:
+    candlesticks are closed by the virtual clock here instead (as of the first trade of each event, earlier
+    trades of the event are not late), get_now follows the virtual clock meanwhile
+    """
+    set_clock(replay.clock.now)
+    start = time.perf_counter()
+    try:
+        async for event in replay:
+            engine.close_bars(datetime_to_ns(event.trades[0].execution_time))
+            engine.on_trades(event)
+    finally:
+        set_clock(None)
+    seconds = time.perf_counter() - start
+    replayed = (replay.clock.now_ns() - replay.first) / 1e9 if replay.first is not None else 0.0
+    return ReplayReport(replay.trades, replay.events, seconds, replayed)
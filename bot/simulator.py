@@ -1,21 +1,28 @@
+import asyncio
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
 from matplotlib import pyplot as plt
 
 from config.config import Config
 from api.crypto.exchange import Exchange
-from tools.common import get_now, local_2_utc, get_unique_name
+from api.db.file_cache import cache_trades, read_trades
+from tools.common import get_now, local_2_utc, get_unique_name, run_async
 from tools.constants import MarketInfo
-from tradeengine.models.trade import Trade
+from bot.replay import ReplayReport, TradeReplay, VirtualClock, file_source, run_replay
+from tradeengine.live.engine import Decision, LiveEngine
 from tradeengine.models.candlestick import CandleStick, get_candlestick_prices, get_indicator
 from tradeengine.tools.common import create_folder_if_not_exists
 from tradeengine.tools.convertor import convert_dataclass_to_dataframe
 from tradeengine.models.invest import FixedInvest, Invest
 from tradeengine.simulator.simulator import Simulator as EngineSimulator
-from tradeengine.core.ml.reinforcement_learning import rl_training, rl_run
+from tradeengine.simulator.sweep import SWEEP_COLUMNS, DecisionFrame, SweepConfig, build_decision_frame, result_row, run_config
+from tradeengine.models.trade import TradeBatch
+from tradeengine.core.ml.reinforcement_learning import rl_training, rl_run, rl_strategy
+from tradeengine.tools.log import log
 
 import concurrent.futures
 from multiprocessing import cpu_count
@@ -24,40 +31,125 @@ class Simulator:
         self.exchange = exchagne
         self.config = Config()
 
-    def run(self, account_money:int=50000, last_days:int=90) -> None:
+    def run(self, account_money:int=50000, last_days:int=90, offline:bool=False) -> None:
+        """offline: backtest on cached trades only, neither api nor db is accessed"""
         since = get_now() - timedelta(days=last_days)
         since = local_2_utc(since)
 
-        data = self.exchange.fetch_trades(since)
+        # workers read trades from file cache (memory mapped) day by day, only save and cache them here
+        if not offline:
+            self.exchange.sync_trades(since)
+            for symbol in self.exchange.symbols:
+                run_async(cache_trades(self.exchange.exchange_name, symbol, since))
 
         invest_stragety = FixedInvest(
             balance=account_money,
-            loss_cut=self.config.bitflyer.loss_cut,
-            invest=self.config.bitflyer.invest_money,
+            loss_cut=self.config.exchange(self.exchange.exchange_name).loss_cut,
+            invest=self.config.exchange(self.exchange.exchange_name).invest_money,
         )
 
-        with concurrent.futures.ProcessPoolExecutor(max_workers=cpu_count()) as executor:
-            futures = [executor.submit(self._engin_simulator_run, trades, symbol, invest_stragety) for symbol, trades in data.items()]
+        # only small jobs are pickled (not self, exchange client or trades), workers map the same cache files
+        jobs = [
+            BacktestJob(self.exchange.exchange_name, symbol, since, invest_stragety, self.exchange.candlestick_interval, self.exchange.fetch_data_interval_minute)
+            for symbol in self.exchange.symbols
+        ]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(cpu_count(), len(jobs)))) as executor:
+            futures = [executor.submit(_engin_simulator_run, job) for job in jobs]
             done, not_done = concurrent.futures.wait(futures)
             
             for future in done:
                 if future.exception():
                     raise Exception(future.exception())
 
-    def _engin_simulator_run(self, trades:List[Trade], symbol:str, invest_stragety:Invest) -> None:
-
-        engine_simulator = EngineSimulator(
-            trades=trades,
-            invest=invest_stragety,
-            name = get_unique_name(self.exchange.exchange_name, symbol),
-        )
-
-        engine_simulator.run(MarketInfo.CANDLESTICK_NUMS, self.exchange.candlestick_interval, self.exchange.fetch_data_interval_minute, self.exchange.exchange_name, symbol)
-
-    def test_ml(self,  last_days:int=59, training_test_ratio:float=0.5) -> None:
+    def sweep(self, configs:List[SweepConfig], account_money:int=50000, last_days:int=90, offline:bool=False, max_workers:Optional[int]=None) -> pd.DataFrame:
+        """
+        backtest all configs (e.g. tradeengine.simulator.sweep.make_grid) of all symbols
+         1. one DecisionFrame (candlesticks, indicators, decision points) per symbol and (candlestick_interval, fetch_interval)
+         2. frames are sent once to each worker, configs run on them without rebuilding
+        return: one row per symbol and config, best total first
+        """
+        since = get_now() - timedelta(days=last_days)
+        since = local_2_utc(since)
+        if not offline:
+            self.exchange.sync_trades(since)
+            for symbol in self.exchange.symbols:
+                run_async(cache_trades(self.exchange.exchange_name, symbol, since))
+
+        max_workers = max_workers or cpu_count()
+        keys = sorted({config.frame_key for config in configs})
+        frame_jobs = [(symbol, key) for symbol in self.exchange.symbols for key in keys]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(frame_jobs)))) as executor:
+            futures = [
+                executor.submit(_build_frame, self.exchange.exchange_name, symbol, since, MarketInfo.CANDLESTICK_NUMS, *key)
+                for symbol, key in frame_jobs
+            ]
+            frames = {job: future.result() for job, future in zip(frame_jobs, futures)}
+
+        runs = [(symbol, config) for symbol in self.exchange.symbols for config in configs]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(runs))), initializer=_init_sweep_worker, initargs=(frames,)) as executor:
+            rows = list(executor.map(
+                _run_sweep_config,
+                [symbol for symbol, _ in runs], [config for _, config in runs],
+                [account_money] * len(runs), [get_unique_name(self.exchange.exchange_name, symbol) for symbol, _ in runs],
+                chunksize=max(1, len(runs) // (max_workers * 4)),
+            ))
+
+        return pd.DataFrame(rows, columns=SWEEP_COLUMNS).sort_values('total', ascending=False, ignore_index=True)
+
+    def replay(self, account_money:int=50000, last_days:int=10, speed:Optional[float]=None, offline:bool=False) -> Tuple[List[Decision], ReplayReport, Dict[str, float]]:
+        """
+        stored trades of all symbols through the live engine, candlesticks are closed by the replay time
+        same strategy (rl_run) and account rules (sim_buy / sim_sell) as run, fills are logged to {name}_replay.log
+        speed: 1.0 is real time, None is as fast as possible
+        return: decisions, replay report, {symbol: money + coin at the last close}
+        """
+        since = get_now() - timedelta(days=last_days)
+        since = local_2_utc(since)
+        if not offline:
+            self.exchange.sync_trades(since)
+            for symbol in self.exchange.symbols:
+                run_async(cache_trades(self.exchange.exchange_name, symbol, since))
+
+        names = {symbol: get_unique_name(self.exchange.exchange_name, symbol) for symbol in self.exchange.symbols}
+        accounts = {
+            symbol: EngineSimulator(
+                trades=[],
+                invest=FixedInvest(
+                    balance=account_money,
+                    loss_cut=self.config.exchange(self.exchange.exchange_name).loss_cut,
+                    invest=self.config.exchange(self.exchange.exchange_name).invest_money,
+                ),
+                name=name,
+            )
+            for symbol, name in names.items()
+        }
+        logs = {symbol: log(f'{name}_replay.log', f'replay.{name}') for symbol, name in names.items()}
+        last_prices:Dict[str, float] = {}
+
+        decisions:List[Decision] = []
+        def on_decision(decision:Decision) -> None:
+            decisions.append(decision)
+            last_prices[decision.symbol] = decision.candlestick.Close
+            accounts[decision.symbol].fill(decision.time, decision.status, decision.candlestick.Close, logs[decision.symbol])
+
+        clock = VirtualClock()
+        engine = LiveEngine(self.exchange.symbols, timedelta(minutes=self.exchange.candlestick_interval), MarketInfo.CANDLESTICK_NUMS,
+                            strategy={symbol: rl_strategy(name) for symbol, name in names.items()},
+                            on_decision=on_decision, clock=clock.now_ns, timer=False)
+        replay = TradeReplay({symbol: file_source(self.exchange.exchange_name, symbol, since) for symbol in self.exchange.symbols}, clock, speed)
+        report = asyncio.run(run_replay(engine, replay))
+        totals = {symbol: account.total(last_prices.get(symbol, 0.0)) for symbol, account in accounts.items()}
+        print(f'replay: {report}')
+        print(f'engine: {engine.report()}')
+        for symbol, account in accounts.items():
+            print(f'{symbol}: money {account.account_money:.2f}, coin {account.account_coin}, total {totals[symbol]:.2f} ({totals[symbol] - account_money:+.2f})')
+        return decisions, report, totals
+
+    def test_ml(self,  last_days:int=59, training_test_ratio:float=0.5, offline:bool=False, n_envs:int=1) -> None:
+        """n_envs: env copies stepped in parallel while training, see rl_training"""
         since = get_now() - timedelta(days=last_days)
         since = local_2_utc(since)
-        data = self.exchange.fetch_candlesticks(since, use_yahoo_finance=False)
+        data = self.exchange.fetch_candlesticks(since, use_yahoo_finance=False, offline=offline)
 
         for symbol, candlesticks_info in data.items():
             print(symbol)
@@ -75,16 +167,55 @@ class Simulator:
                 test_indicators = indicators[:index]
 
                 best_buy_times, best_sell_times = _find_best_trade(candlesticks)
-                rl_training(name, training_candlesticks, training_indicators, best_buy_times, best_sell_times)
+                rl_training(name, training_candlesticks, training_indicators, best_buy_times, best_sell_times, n_envs=n_envs)
                 rl_run(name, test_candlesticks, test_indicators, show_pic=True)
 
-    def find_best_trade(self, since:datetime) -> None:
-        data = self.exchange.fetch_candlesticks(since, use_yahoo_finance=False)
+    def find_best_trade(self, since:datetime, offline:bool=False) -> None:
+        data = self.exchange.fetch_candlesticks(since, use_yahoo_finance=False, offline=offline)
         for symbol, candlestick_info in data.items():
             for _, candlesticks in candlestick_info.items():
                 find_best_trade(candlesticks, name=get_unique_name(self.exchange.exchange_name, symbol))
 
 
+@dataclass
+class BacktestJob:
+    """
+    arguments of a backtest worker, trades are not included,
+    the worker attaches to the memory mapped day files of api.db.file_cache by exchange_name and symbol
+    """
+    exchange_name: str
+    symbol: str
+    since: datetime
+    invest: Invest
+    candlestick_interval: int
+    fetch_interval: int
+
+def _engin_simulator_run(job:BacktestJob) -> None:
+    """runs in a worker process, no api or db access"""
+    trades = read_trades(job.exchange_name, job.symbol, job.since)
+
+    engine_simulator = EngineSimulator(
+        trades=trades,
+        invest=job.invest,
+        name = get_unique_name(job.exchange_name, job.symbol),
+    )
+
+    engine_simulator.run(MarketInfo.CANDLESTICK_NUMS, job.candlestick_interval, job.fetch_interval, job.exchange_name, job.symbol)
+
+def _build_frame(exchange_name:str, symbol:str, since:datetime, candlesticks_num:int, candlestick_interval:int, fetch_interval:int) -> DecisionFrame:
+    """runs in a worker process, trades are read from the file cache"""
+    trades = TradeBatch.concat(list(read_trades(exchange_name, symbol, since))[::-1])
+    return build_decision_frame(trades, candlesticks_num, candlestick_interval, fetch_interval)
+
+# frames of Simulator.sweep, set once per worker process by the pool initializer
+_sweep_frames:Dict[Tuple[str, Tuple[int, int]], DecisionFrame] = {}
+
+def _init_sweep_worker(frames:Dict[Tuple[str, Tuple[int, int]], DecisionFrame]) -> None:
+    _sweep_frames.update(frames)
+
+def _run_sweep_config(symbol:str, config:SweepConfig, account_money:float, name:str) -> Dict:
+    frame = _sweep_frames[(symbol, config.frame_key)]
+    return result_row(symbol, config, run_config(frame, config, account_money, MarketInfo.CANDLESTICK_NUMS, name))
 
 def _find_best_trade(candlesticks:List[CandleStick]) -> Tuple[List[datetime], List[datetime]]:
     """return: best_buy_times, best_sell_times"""
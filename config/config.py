@@ -1,13 +1,14 @@
-from typing import List
+from typing import Dict, List, Optional
 import yaml
 
 class Config:
     def __init__(self):
         self._config_path = 'config.yaml'
-        self._load_config()
-
         self._connection_string: str
         self._bitflyer: Bitflyer
+        # exchange name -> config, in order of config.yaml
+        self._exchanges: Dict[str, ExchangeConfig] = {}
+        self._load_config()
 
     def _load_config(self):
         with open(self._config_path, 'r', encoding='utf8') as file:
@@ -23,8 +24,12 @@ class Config:
                 match exchange_name:
                     case 'bitflyer':
                         self._bitflyer = Bitflyer(info['api_key'], info['api_secret'], symbols, dry_run, info['invest_money'], info['loss_cut'])
+                        self._exchanges[exchange_name] = self._bitflyer
                     case _:
-                        raise NotImplementedError(f'{exchange_name} in {self._config_path} not implemented')
+                        # any ccxt exchange, or "fake" (in memory, for tests), see api.crypto.registry
+                        self._exchanges[exchange_name] = ExchangeConfig(
+                            exchange_name, info.get('api_key', ''), info.get('api_secret', ''), symbols, dry_run,
+                            info.get('invest_money', 0.0), info.get('loss_cut'), info.get('options'))
 
     @property
     def connection_string(self) -> str:
@@ -34,15 +39,33 @@ class Config:
     def bitflyer(self) -> 'Bitflyer':
         return self._bitflyer
 
+    @property
+    def exchanges(self) -> Dict[str, 'ExchangeConfig']:
+        return self._exchanges
+
+    def exchange(self, exchange_name:str) -> 'ExchangeConfig':
+        if exchange_name not in self._exchanges:
+            raise KeyError(f'{exchange_name} not in {self._config_path}')
+        return self._exchanges[exchange_name]
+
 class ExchangeBase():
     def __init__(self, symbols:List[str], dry_run_symbols:List[str]):
         self.symbols = symbols
         self.dry_run_symbols = dry_run_symbols
 
-class Bitflyer(ExchangeBase):
-    def __init__(self, api_key:str, api_secret:str, symbols:List[str], dry_run:List[str], invest_money:float, loss_cut:float):
+class ExchangeConfig(ExchangeBase):
+    """
+    options: passed to the exchange client as is, e.g. ccxt config ({"options": {"defaultType": "spot"}})
+    """
+    def __init__(self, exchange_name:str, api_key:str, api_secret:str, symbols:List[str], dry_run:List[str], invest_money:float, loss_cut:Optional[float], options:Optional[Dict]=None):
+        self.exchange_name = exchange_name
         self.api_key = api_key
         self.api_secret = api_secret
         self.invest_money = invest_money
         self.loss_cut = loss_cut
+        self.options = options or {}
         super().__init__(symbols, dry_run)
+
+class Bitflyer(ExchangeConfig):
+    def __init__(self, api_key:str, api_secret:str, symbols:List[str], dry_run:List[str], invest_money:float, loss_cut:float):
+        super().__init__('bitflyer', api_key, api_secret, symbols, dry_run, invest_money, loss_cut)
@@ -0,0 +1,107 @@
+"""
+get_indicator micro benchmark, run from repo root:
+    python -m scripts.benchmark.indicator
+"""
+from datetime import datetime, timedelta, timezone
+import time
+from typing import Callable, List
+
+import numpy as np
+import talib
+from talib import MA_Type
+
+from tradeengine.models.candlestick import CandleBatch, CandleStick, Indicator, get_indicator, get_indicator_batch
+
+def _get_indicator_np_append(candlesticks:List[CandleStick]) -> List[Indicator]:
+    """previous implementation, np.append in loop"""
+    opens = []
+    closes = []
+    highs = []
+    lows = []
+    opentimes = []
+    for i in range(len(candlesticks)-1, -1, -1):
+        opens = np.append(opens, candlesticks[i].Open)
+        closes = np.append(closes, candlesticks[i].Close)
+        highs = np.append(highs, candlesticks[i].High)
+        lows = np.append(lows, candlesticks[i].Low)
+        opentimes = np.append(opentimes, candlesticks[i].Opentime)
+
+    stoch_k, stoch_d = talib.STOCH(
+        high=highs, low=lows, close=closes,
+        fastk_period=14, slowk_period=3, slowk_matype= MA_Type.SMA,
+        slowd_period=3, slowd_matype= MA_Type.SMA)
+    bband_plus_2, _, bband_minus_2 =talib.BBANDS(real=closes, timeperiod=20, nbdevup=2, nbdevdn=2, matype=MA_Type.SMA)
+    bband_plus_3, _, bband_minus_3 =talib.BBANDS(real=closes, timeperiod=20, nbdevup=3, nbdevdn=3, matype=MA_Type.SMA)
+    sma_20 = talib.SMA(real=closes, timeperiod=20)
+    sma_200 = talib.SMA(real=closes, timeperiod=200)
+    rsi = talib.RSI(real=closes, timeperiod=14)
+    macd, macdsignal, macdhist = talib.MACD(real=closes, fastperiod=12, slowperiod=26, signalperiod=9)
+
+    res = []
+    for i in range(len(candlesticks)-1, -1, -1):
+        res.append(Indicator(
+            BBBands_Plus_2 = bband_plus_2[i],
+            BBBands_Plus_3 = bband_plus_3[i],
+            BBBands_Minus_2 = bband_minus_2[i],
+            BBBands_Minus_3 = bband_minus_3[i],
+            Stoch_K = stoch_k[i],
+            Stoch_D = stoch_d[i],
+            SMA_20=sma_20[i],
+            SMA_200=sma_200[i],
+            RSI=rsi[i],
+            MACD=macd[i],
+            MACD_SIGNAL=macdsignal[i],
+            MACD_HIST=macdhist[i],
+            Opentime = opentimes[i],
+        ))
+    return res
+
+def _make_candlesticks(num:int, seed:int=0) -> List[CandleStick]:
+    rng = np.random.default_rng(seed)
+    closes = 1e7 + np.cumsum(rng.normal(0, 1e4, num))
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    candlesticks = [
+        CandleStick(
+            Open=close - 100,
+            Close=close,
+            High=close + abs(rng.normal(0, 5e3)),
+            Low=close - abs(rng.normal(0, 5e3)),
+            Volume=1.0,
+            Opentime=start + timedelta(minutes=5 * i),
+        )
+        for i, close in enumerate(closes.tolist())
+    ]
+    candlesticks.reverse()
+    return candlesticks
+
+def _timeit(func:Callable, repeat:int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main() -> None:
+    print(f'{"bars":>8} {"np.append":>12} {"list":>12} {"batch":>12} {"batch+list":>12}')
+    for num in (1_000, 10_000, 100_000):
+        candlesticks = _make_candlesticks(num)
+        batch = CandleBatch.from_candlesticks(candlesticks)
+        repeat = 5 if num < 100_000 else 1
+
+        # same output
+        expected = _get_indicator_np_append(candlesticks[:2000])
+        actual = get_indicator(candlesticks[:2000])
+        np.testing.assert_allclose(
+            [[getattr(i, f) for f in ('SMA_200', 'RSI', 'MACD_HIST', 'Stoch_D')] for i in actual],
+            [[getattr(i, f) for f in ('SMA_200', 'RSI', 'MACD_HIST', 'Stoch_D')] for i in expected],
+        )
+
+        old = _timeit(lambda: _get_indicator_np_append(candlesticks), repeat)
+        new_list = _timeit(lambda: get_indicator(candlesticks), repeat)
+        new_batch = _timeit(lambda: get_indicator_batch(batch), repeat)
+        new_batch_list = _timeit(lambda: get_indicator_batch(batch).to_indicators(), repeat)
+        print(f'{num:>8} {old*1000:>10.2f}ms {new_list*1000:>10.2f}ms {new_batch*1000:>10.2f}ms {new_batch_list*1000:>10.2f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+bulk_insert_trade throughput on the db of config.yaml, run from repo root:
+    python -m scripts.benchmark.ingest
+tables of exchange "benchmark" are created and dropped
+"""
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import numpy as np
+
+from api.db.common import Base, format_pool_metrics, get_engine, is_mysql
+from api.db.trade import _get_dbtrade_table, bulk_insert_trade
+from tools.common import run_async
+from tradeengine.models.trade import Side, Trade, TradeBatch
+
+_EXCHANGE_NAME = 'benchmark'
+
+def _make_trades(num:int, seed:int=0) -> List[Trade]:
+    rng = np.random.default_rng(seed)
+    prices = 1e7 + np.cumsum(rng.normal(0, 1e3, num))
+    seconds = np.cumsum(rng.uniform(0, 2, num))
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    trades = [
+        Trade(
+            id=str(i),
+            side=Side.BUY if i % 2 else Side.SELL,
+            size=0.01,
+            execution_time=start + timedelta(seconds=second),
+            price=price,
+        )
+        for i, (price, second) in enumerate(zip(prices.tolist(), seconds.tolist()))
+    ]
+    trades.reverse()
+    return trades
+
+async def _drop(symbol:str) -> None:
+    table = _get_dbtrade_table(_EXCHANGE_NAME, symbol)
+    async with get_engine().begin() as connection:
+        await connection.run_sync(lambda sync_connection: table.drop(sync_connection, checkfirst=True))
+    Base.metadata.remove(table)
+
+def main() -> None:
+    trades = _make_trades(200_000)
+    batch = TradeBatch.from_trades(trades)
+    cases = [
+        ('values', 1_000, trades),
+        ('values', 5_000, trades),
+        ('values', 5_000, batch),
+        ('values', 20_000, batch),
+    ]
+    if is_mysql():
+        cases.append(('load_data', 0, batch))
+
+    print(f'{"mode":>10} {"batch":>8} {"input":>10} {"rows/s":>10}')
+    for i, (mode, batch_size, data) in enumerate(cases):
+        symbol = f'case{i}'
+        try:
+            report = run_async(bulk_insert_trade(_EXCHANGE_NAME, symbol, data, batch_size=batch_size or 1, mode=mode))
+        finally:
+            run_async(_drop(symbol))
+        print(f'{mode:>10} {batch_size:>8} {type(data).__name__:>10} {report.rows_per_second:>10.0f}')
+    print(f'db pool: {format_pool_metrics()}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+tick-to-decision latency of LiveEngine over a local websocket replay of random trades, run from repo root:
+    python -m scripts.benchmark.live
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import numpy as np
+
+from api.crypto.bitflyer.stream import ReplayServer, stream_executions
+from tradeengine.live.engine import LiveEngine
+from tradeengine.models.trade import Side, Trade
+
+_SYMBOL = 'BTC_JPY'
+
+def _make_trades(num:int, seed:int=0) -> List[Trade]:
+    """DESC, one trade per second"""
+    rng = np.random.default_rng(seed)
+    prices = 1e7 + np.cumsum(rng.normal(0, 1e3, num))
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    trades = [
+        Trade(id=str(i), side=Side.BUY if i % 2 else Side.SELL, size=0.01, execution_time=start + timedelta(seconds=i), price=price)
+        for i, price in enumerate(prices.tolist())
+    ]
+    trades.reverse()
+    return trades
+
+async def _replay(engine:LiveEngine, trades:List[Trade], batch_size:int) -> None:
+    async with ReplayServer({_SYMBOL: trades}, batch_size=batch_size) as server:
+        await engine.run(stream_executions([_SYMBOL], server.url, reconnect=False))
+
+def main() -> None:
+    interval = timedelta(minutes=1)
+    trades = _make_trades(100_000)
+    # first part is history, the rest is replayed
+    history, replayed = trades[50_000:], trades[:50_000]
+    for batch_size in (1, 10, 100):
+        # replay is faster than real time, candlesticks are closed by trades only
+        engine = LiveEngine([_SYMBOL], interval, 1000, timer=False)
+        engine.warm_up(_SYMBOL, history)
+        asyncio.run(_replay(engine, replayed, batch_size))
+        print(f'batch {batch_size:>4}: {engine.decisions} decisions, tick to decision {engine.latency}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Simulator.push_trade per-tick cost, strategy excluded (always HOLD), run from repo root:
+    python -m scripts.benchmark.simulator
+"""
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import time
+from typing import Deque, Optional
+
+import numpy as np
+
+from tradeengine.core.strategies import TradeStatus
+from tradeengine.models.candlestick import Indicator
+from tradeengine.models.incremental_indicator import IncrementalIndicator
+from tradeengine.models.invest import FixedInvest
+from tradeengine.models.trade import TradeBatch
+from tradeengine.simulator import simulator
+from tradeengine.tools.common import datetime_to_ns
+from tradeengine.tools.convertor import CandleStickBuilder
+
+def _hold(name, candlesticks, indicators) -> TradeStatus:
+    return TradeStatus.HOLD
+
+def _push_trade_per_trade(trades:TradeBatch, candlesticks_num:int, candlestick_interval:int, fetch_interval:int) -> int:
+    """previous implementation, one Trade object and one comparison per trade"""
+    period = (candlesticks_num + 2) * candlestick_interval
+    end_time:Optional[datetime] = None
+    builder = CandleStickBuilder(timedelta(minutes=candlestick_interval), candlesticks_num)
+    indicator_stream = IncrementalIndicator()
+    indicators:Deque[Indicator] = deque(maxlen=candlesticks_num)
+    decisions = 0
+    for trade in trades[::-1]:
+        if end_time is None:
+            end_time = trade.execution_time + timedelta(minutes=period)
+        closed_candlestick = builder.push(trade)
+        if closed_candlestick is not None:
+            simulator.Simulator._push_indicator(None, indicator_stream.update(closed_candlestick), indicators)
+        if trade.execution_time > end_time:
+            candlesticks = builder.candlesticks()
+            simulator.Simulator._push_indicator(None, indicator_stream.update(candlesticks[0]), indicators)
+            _hold('', candlesticks, list(indicators))
+            decisions += 1
+            end_time += timedelta(minutes=fetch_interval)
+    return decisions
+
+def _make_trades(num:int, seed:int=0) -> TradeBatch:
+    """DESC, 10 trades per second"""
+    rng = np.random.default_rng(seed)
+    start = datetime_to_ns(datetime(2025, 1, 1, tzinfo=timezone.utc))
+    times = start + np.arange(num, dtype=np.int64) * 100_000_000
+    prices = 1e7 + np.cumsum(rng.normal(0, 1e3, num))
+    return TradeBatch(
+        ids=np.arange(num).astype(str).astype(object)[::-1],
+        times=times[::-1],
+        prices=prices[::-1],
+        sizes=np.full(num, 0.01)[::-1],
+        sides=np.zeros(num, dtype=np.int8),
+    )
+
+def main() -> None:
+    simulator.rl_run = _hold
+    candlesticks_num, candlestick_interval, fetch_interval = 10, 1, 1
+    print(f'{"trades":>9} {"decisions":>10} {"per trade":>12} {"new":>12} {"per decision":>14} {"new":>12}')
+    for num in (10_000, 100_000, 1_000_000):
+        trades = _make_trades(num)
+        start = time.perf_counter()
+        decisions = _push_trade_per_trade(trades, candlesticks_num, candlestick_interval, fetch_interval)
+        old = time.perf_counter() - start
+
+        sim = simulator.Simulator(trades, FixedInvest(balance=50000, loss_cut=None, invest=1000), 'benchmark')
+        start = time.perf_counter()
+        sim.push_trade(trades, candlesticks_num, candlestick_interval, fetch_interval, None)
+        new = time.perf_counter() - start
+        per_decision = max(decisions, 1)
+        print(f'{num:>9} {decisions:>10} {old/num*1e9:>10.0f}ns {new/num*1e9:>10.0f}ns '
+              f'{old/per_decision*1e6:>12.1f}us {new/per_decision*1e6:>10.1f}us')
+
+if __name__ == '__main__':
+    main()
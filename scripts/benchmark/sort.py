@@ -0,0 +1,97 @@
+"""
+trade sorting micro benchmark, previous List[Trade] paths vs timestamp arrays, run from repo root:
+    python -m scripts.benchmark.sort
+"""
+from datetime import datetime, timedelta, timezone
+import heapq
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from tradeengine.models.trade import Side, Trade, TradeBatch, sort_trades_desc
+from tradeengine.tools.sort import argsort_desc, merge_desc
+
+def _sort_trades_desc_dispatch(trades:List[Trade]) -> List[Trade]:
+    """previous sort_trades_desc, datetime check then sorted or heapq over 10k"""
+    if all(
+        trades[i].execution_time >= trades[i + 1].execution_time
+        for i in range(len(trades) - 1)
+    ):
+        return trades
+    elif len(trades) < 10000:
+        return _sort_trades_desc(trades)
+    else:
+        return _sort_trades_desc_heapq(trades)
+
+def _sort_trades_desc(trades:List[Trade]) -> List[Trade]:
+    """previous small data path"""
+    return sorted(trades, key=lambda trade: trade.execution_time, reverse=True)
+
+def _sort_trades_desc_heapq(trades:List[Trade]) -> List[Trade]:
+    """previous big data path"""
+    heap = []
+    for trade in trades:
+        heapq.heappush(heap, (-trade.execution_time.timestamp(), id(trade), trade))
+    sorted_trades = []
+    while heap:
+        _, _, trade = heapq.heappop(heap)
+        sorted_trades.append(trade)
+    return sorted_trades
+
+def _make_trades(num:int, seed:int=0) -> List[Trade]:
+    """DESC, some trades share a time"""
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    seconds = np.sort(rng.integers(0, num, num))[::-1]
+    return [
+        Trade(id=str(i), side=Side.BUY, size=0.01, execution_time=start + timedelta(seconds=int(second)), price=1e7)
+        for i, second in enumerate(seconds.tolist())
+    ]
+
+def _timeit(func:Callable, repeat:int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main() -> None:
+    rng = np.random.default_rng(1)
+    print(f'{"trades":>9} {"case":>9} {"dispatch":>10} {"sorted":>10} {"heapq":>10} {"new list":>10} {"argsort":>10} {"flagged":>10}')
+    for num in (10_000, 100_000, 1_000_000):
+        repeat = 3 if num < 1_000_000 else 1
+        expected = _make_trades(num)
+        shuffled = [expected[i] for i in rng.permutation(num)]
+        for case, trades in (('sorted', expected), ('shuffled', shuffled)):
+            # same order as the previous small data path (stable)
+            assert sort_trades_desc(trades) == _sort_trades_desc(trades)
+            batch = TradeBatch.from_trades(trades)
+            flagged = batch.sort_desc()
+            times = [
+                _timeit(lambda: _sort_trades_desc_dispatch(trades), repeat),
+                _timeit(lambda: _sort_trades_desc(trades), repeat),
+                _timeit(lambda: _sort_trades_desc_heapq(trades), repeat),
+                _timeit(lambda: sort_trades_desc(trades), repeat),
+                _timeit(lambda: argsort_desc(batch.times), repeat),
+                _timeit(lambda: flagged.sort_desc(), repeat),
+            ]
+            print(f'{num:>9} {case:>9} ' + ' '.join(f'{t*1000:>8.2f}ms' for t in times))
+
+        # k-way merge of sorted pages in any order, e.g. db or api pages
+        times = TradeBatch.from_trades(expected).times
+        for k in (10, 100):
+            pages = [times[i:i + num // k] for i in range(0, num, num // k)]
+            order = rng.permutation(len(pages))
+            shuffled_pages = [pages[i] for i in order]
+            # overlapping pages: every k-th trade
+            overlapping = [times[i::k] for i in range(k)]
+            np.testing.assert_array_equal(np.concatenate(shuffled_pages)[merge_desc(shuffled_pages)], times)
+            np.testing.assert_array_equal(np.concatenate(overlapping)[merge_desc(overlapping)], times)
+            print(f'{num:>9} {"k=" + str(k):>9} merge pages {_timeit(lambda: merge_desc(shuffled_pages), repeat)*1000:.2f}ms, '
+                  f'overlapping {_timeit(lambda: merge_desc(overlapping), repeat)*1000:.2f}ms, '
+                  f'argsort {_timeit(lambda: np.argsort(-np.concatenate(overlapping)), repeat)*1000:.2f}ms')
+
+if __name__ == '__main__':
+    main()
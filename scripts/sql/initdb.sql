@@ -4,4 +4,7 @@ CREATE USER 'tradebot'@'localhost' IDENTIFIED BY '{your_password}';
 
 GRANT ALL PRIVILEGES ON tradedb.* TO 'tradebot'@'localhost';
 
-FLUSH PRIVILEGES;
\ No newline at end of file
+FLUSH PRIVILEGES;
+
+-- bulk_insert_trade(mode="load_data") uses LOAD DATA LOCAL INFILE
+SET GLOBAL local_infile = 1;
\ No newline at end of file
@@ -10,15 +10,19 @@ setup(
         "ccxt~=4.4",
         "pandas~=2.2",
         "numpy~=2.2",
+        "pyarrow~=19.0",
         "PyYAML",
         "pytest",
-        "SQLAlchemy~=2.0",
+        "SQLAlchemy[asyncio]~=2.0",
         "mariadb~=1.1",
+        "asyncmy~=0.2",
+        "aiosqlite~=0.20",
         "TA-Lib~=0.6",
         "gymnasium~=1.0",
         "stable_baselines3~=2.4",
         "yfinance~=0.2",
         "matplotlib~=3.10",
+        "websockets~=14.0",
     ],
     # entry_points={
     #     "console_scripts": [
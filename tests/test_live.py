@@ -0,0 +1,146 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+import api.crypto.bitflyer.stream as stream
+from api.crypto.bitflyer.stream import ReplayServer, stream_executions
+from tradeengine.core.strategies import TradeStatus
+from tradeengine.live.engine import Decision, LiveEngine, TradeEvent
+from tradeengine.models.trade import Side, Trade
+from tradeengine.tools.common import datetime_to_ns
+
+_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+_SYMBOL = 'BTC_JPY'
+
+def _trades(first:int, last:int, step:int=1) -> List[Trade]:
+    """ids first..last, trade i at i * step seconds, ASC"""
+    return [
+        Trade(id=str(i), side=Side.BUY, size=0.1, execution_time=_START + timedelta(seconds=i * step), price=100.0 + i)
+        for i in range(first, last + 1)
+    ]
+
+def _engine(decisions:List[Decision]) -> LiveEngine:
+    """1 minute candlesticks, buys on every complete decision"""
+    return LiveEngine([_SYMBOL], timedelta(minutes=1), 100, strategy=lambda candlesticks, indicators: TradeStatus.BUY,
+                      on_decision=decisions.append, timer=False)
+
+def _event(trades:List[Trade], **kwargs) -> TradeEvent:
+    return TradeEvent(_SYMBOL, trades, 0, **kwargs)
+
+def _ns(seconds:float) -> int:
+    return datetime_to_ns(_START) + int(seconds * 1e9)
+
+def test_engine_decides_once_per_closed_candlestick():
+    decisions:List[Decision] = []
+    engine = _engine(decisions)
+    # 10s apart, candlesticks of 00:00 .. 00:04 are closed by trades of the next one
+    engine.on_trades(_event(_trades(0, 29, step=10)))
+    assert [decision.candlestick.Opentime for decision in decisions] == [_START + timedelta(minutes=i) for i in range(4)]
+    # the first decision has no previous candlestick
+    assert [decision.status for decision in decisions] == [TradeStatus.HOLD] + [TradeStatus.BUY] * 3
+    assert all(decision.complete for decision in decisions)
+
+def test_engine_drops_late_trades():
+    decisions:List[Decision] = []
+    engine = _engine(decisions)
+    engine.on_trades(_event(_trades(0, 7, step=10)))
+    # 00:00 is closed by the trade of 00:01
+    engine.on_trades(_event(_trades(3, 3, step=10)))
+    assert engine.late_trades() == {_SYMBOL: 1}
+    assert decisions[0].candlestick.Volume == pytest.approx(6 * 0.1)
+
+def test_engine_holds_on_candlesticks_overlapping_a_gap():
+    decisions:List[Decision] = []
+    engine = _engine(decisions)
+    engine.on_trades(_event(_trades(0, 12, step=10)))
+    # trades 13..35 (02:10 .. 05:50) are lost
+    engine.on_trades(_event(_trades(36, 60, step=10), gap=True))
+    by_opentime = {decision.candlestick.Opentime: decision for decision in decisions}
+    # 02:00 has the gap's start, 06:00 its end, 07:00 compares with 06:00
+    incomplete = [_START + timedelta(minutes=i) for i in (2, 6, 7)]
+    for opentime, decision in by_opentime.items():
+        assert decision.complete == (opentime not in incomplete), opentime
+        if opentime in incomplete:
+            assert decision.status == TradeStatus.HOLD
+    assert 'feed gaps: 1' in engine.report()
+
+def test_engine_does_not_close_candlesticks_while_disconnected():
+    """outage over the close of 10:00 (600s), the backfilled trades of it are not late"""
+    decisions:List[Decision] = []
+    engine = _engine(decisions)
+    engine.on_trades(_event(_trades(0, 630)))
+    engine.on_trades(_event([], disconnected=True))
+    assert engine.close_bars(_ns(660.5)) == []
+    # backfill after reconnecting, then the stream again
+    engine.on_trades(_event(_trades(631, 659)))
+    engine.on_trades(_event(_trades(660, 700)))
+    assert engine.late_trades() == {_SYMBOL: 0}
+    assert 'feed gaps: 0' in engine.report()
+    decision = decisions[-1]
+    assert decision.candlestick.Opentime == _START + timedelta(minutes=10)
+    assert decision.candlestick.Volume == pytest.approx(60 * 0.1)
+    assert decision.complete
+    # closed by clock again once the feed is back
+    assert len(engine.close_bars(_ns(720.5))) == 1
+
+async def _collect(url:str, backfill:Optional[Callable], last:int, lastest:Optional[Dict[str, Trade]]=None) -> List[TradeEvent]:
+    """events until the trade of id last"""
+    events:List[TradeEvent] = []
+    async for event in stream_executions([_SYMBOL], url, reconnect_delay=0.01, backfill=backfill, lastest=lastest):
+        events.append(event)
+        if event.trades and event.trades[-1].id == str(last):
+            break
+    return events
+
+def _run_servers(monkeypatch, sent:List[List[Trade]], backfill:Optional[Callable], last:int,
+                 lastest:Optional[Dict[str, Trade]]=None) -> Tuple[List[str], List[TradeEvent]]:
+    """one ReplayServer per connection, each sends its trades and closes"""
+    async def _run():
+        servers = [ReplayServer({_SYMBOL: trades[::-1]}) for trades in sent]
+        for server in servers:
+            await server.__aenter__()
+        urls = iter([server.url for server in servers])
+        connect = stream.connect
+        monkeypatch.setattr(stream, 'connect', lambda url: connect(next(urls)))
+        try:
+            events = await asyncio.wait_for(_collect('unused', backfill, last, lastest), 10)
+        finally:
+            for server in servers:
+                await server.__aexit__()
+        return [trade.id for event in events for trade in event.trades], events
+    return asyncio.run(_run())
+
+def _api(trades:List[Trade], complete:bool=True) -> Callable:
+    """backfill of trades newer than after_id, DESC"""
+    def _backfill(symbol:str, since:datetime, after_id:Optional[str]) -> Tuple[List[Trade], bool]:
+        return [trade for trade in trades if int(trade.id) > int(after_id)][::-1], complete
+    return _backfill
+
+def test_replay_server_sends_trades_in_order():
+    async def _run():
+        async with ReplayServer({_SYMBOL: _trades(1, 25)[::-1]}, batch_size=10) as server:
+            return [event async for event in stream_executions([_SYMBOL], server.url, reconnect=False)]
+    events = asyncio.run(_run())
+    assert [len(event.trades) for event in events] == [10, 10, 5]
+    assert [trade.id for event in events for trade in event.trades] == [str(i) for i in range(1, 26)]
+
+def test_stream_backfills_trades_missed_while_reconnecting(monkeypatch):
+    # the api has 41..70 after reconnecting, the second connection sends 41..100 (41..70 again)
+    ids, events = _run_servers(monkeypatch, [_trades(1, 40), _trades(41, 100)], _api(_trades(1, 70)), 100)
+    assert ids == [str(i) for i in range(1, 101)]
+    assert not any(event.gap for event in events)
+    assert sum(event.disconnected for event in events) == 1
+
+def test_stream_marks_gap_without_backfill(monkeypatch):
+    ids, events = _run_servers(monkeypatch, [_trades(1, 40), _trades(61, 100)], None, 100)
+    assert ids == [str(i) for i in range(1, 41)] + [str(i) for i in range(61, 101)]
+    assert sum(event.gap for event in events) == 1
+
+def test_stream_backfills_first_connection(monkeypatch):
+    """trades between the warm-up history (until 30) and the subscription"""
+    warmed_up = _trades(1, 30)
+    ids, events = _run_servers(monkeypatch, [_trades(51, 60)], _api(_trades(1, 50)), 60, lastest={_SYMBOL: warmed_up[-1]})
+    assert ids == [str(i) for i in range(31, 61)]
+    assert not any(event.gap for event in events)
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from api.crypto.fake import FakeExchange
+from api.crypto.registry import ExchangeRegistry
+from tradeengine.models.trade import Side, Trade
+
+_START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+def _trades(first:int, last:int) -> List[Trade]:
+    """ids first..last, one second apart, DESC"""
+    return [
+        Trade(id=str(i), side=Side.BUY, size=0.1, execution_time=_START + timedelta(seconds=i), price=100.0 + i)
+        for i in range(last, first - 1, -1)
+    ]
+
+def _fake(exchange_name:str) -> FakeExchange:
+    exchange = FakeExchange(['BTC'], [], exchange_name, page_size=3, public_api_limit=(1000, 1.0, 1000))
+    exchange.add_trades('BTC', _trades(1, 3))
+    # 7 trades arrive after the first poll, more than a page
+    fetch_recent_trades = exchange.fetch_recent_trades
+    def _fetch(symbol:str) -> List[Trade]:
+        page = fetch_recent_trades(symbol)
+        if exchange.calls == 1:
+            exchange.add_trades(symbol, _trades(4, 10))
+        return page
+    exchange.fetch_recent_trades = _fetch
+    return exchange
+
+def _stream(registry:ExchangeRegistry) -> Dict[str, List[Tuple[List[str], bool]]]:
+    """exchange_name -> [(ids, gap)] of events"""
+    async def _collect():
+        events:Dict[str, List[Tuple[List[str], bool]]] = {exchange.exchange_name: [] for exchange in registry}
+        async for exchange_name, event in registry.stream_trades(poll_interval=0.0, polls=2):
+            events[exchange_name].append(([trade.id for trade in event.trades], event.gap))
+        return events
+    return asyncio.run(_collect())
+
+def test_poll_fetches_trades_older_than_the_page():
+    registry = ExchangeRegistry([_fake('fake1'), _fake('fake2')])
+    events = _stream(registry)
+    for exchange_name in ('fake1', 'fake2'):
+        assert events[exchange_name] == [
+            (['1', '2', '3'], False),
+            ([str(i) for i in range(4, 11)], False),
+        ]
+    assert registry.gaps == {}
+
+def test_poll_marks_gap_if_missed_trades_are_not_fetched():
+    registry = ExchangeRegistry([_fake('fake1'), _fake('fake2')])
+    # one page since the last forwarded trade, trades 6 and 7 are missed
+    registry.max_gap_pages = 1
+    events = _stream(registry)
+    for exchange_name in ('fake1', 'fake2'):
+        assert events[exchange_name] == [
+            (['1', '2', '3'], False),
+            (['4', '5', '8', '9', '10'], True),
+        ]
+    assert registry.gaps == {('fake1', 'BTC'): 1, ('fake2', 'BTC'): 1}
+
+def test_poll_skips_warmed_up_trades():
+    registry = ExchangeRegistry([_fake('fake1'), _fake('fake2')])
+    # the fake's first page (1..3) was fetched as history, newer trades of the same time may follow
+    warmed_up = _trades(1, 3)
+    lastest = {exchange_name: {'BTC': warmed_up[:1]} for exchange_name in ('fake1', 'fake2')}
+    async def _collect():
+        events:Dict[str, List[List[str]]] = {'fake1': [], 'fake2': []}
+        async for exchange_name, event in registry.stream_trades(lastest, poll_interval=0.0, polls=2):
+            events[exchange_name].append([trade.id for trade in event.trades])
+        return events
+    events = asyncio.run(_collect())
+    for exchange_name in ('fake1', 'fake2'):
+        assert events[exchange_name] == [[str(i) for i in range(4, 11)]]
@@ -1,14 +1,79 @@
 from datetime import datetime, timezone
+import asyncio
+from concurrent.futures import Future
 import os
+import threading
+from typing import AsyncIterator, Callable, Coroutine, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+# long-lived event loop for sync callers, async db connections are bound to the loop they are created in
+_loop:Optional[asyncio.AbstractEventLoop] = None
+_loop_pid:Optional[int] = None
+_loop_lock = threading.Lock()
+
+# replaces datetime.now() of get_now, e.g. virtual clock of a replay (bot.replay)
+_clock:Optional[Callable[[], datetime]] = None
 
 def get_unique_name(exchange_name:str, symbol:str) -> str:
     return f'{exchange_name}_{symbol}'
 
 def get_now() -> datetime:
+    """local naive datetime, time of the clock set by set_clock if any"""
+    if _clock is not None:
+        return _clock()
     return datetime.now()
 
+def set_clock(clock:Optional[Callable[[], datetime]]) -> None:
+    """clock of get_now, None to use system clock again"""
+    global _clock
+    _clock = clock
+
 def local_2_utc(local: datetime) -> datetime:
     return local.astimezone(timezone.utc)
 
 def create_folder_if_not_exists(folder_path) -> None:
-    os.makedirs(folder_path, exist_ok=True)
\ No newline at end of file
+    os.makedirs(folder_path, exist_ok=True)
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """event loop running forever in a daemon thread, recreated in forked child process"""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name='async-loop', daemon=True).start()
+        return _loop
+
+def submit_async(coro:Coroutine[object, object, T]) -> 'Future[T]':
+    """schedule coro on the long-lived loop and return at once, e.g. write db while fetching next data"""
+    loop = get_event_loop()
+    if _is_loop_thread(loop):
+        raise RuntimeError('submit_async/run_async cannot be called from the loop thread, use await')
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+def run_async(coro:Coroutine[object, object, T]) -> T:
+    """run coro on the long-lived loop and wait for the result, use instead of asyncio.run"""
+    return submit_async(coro).result()
+
+def iterate_async(iterator:AsyncIterator[T]) -> Iterator[T]:
+    """iterate an async iterator from sync code, one item is awaited at a time"""
+    try:
+        while True:
+            try:
+                yield run_async(_anext(iterator))
+            except StopAsyncIteration:
+                break
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            run_async(aclose())
+
+async def _anext(iterator:AsyncIterator[T]) -> T:
+    return await iterator.__anext__()
+
+def _is_loop_thread(loop:asyncio.AbstractEventLoop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
@@ -8,4 +8,5 @@ class MarketInfo:
 
 @dataclass(frozen=True)
 class ConstantPath:
-    LOG_FOLDER:Path = Path('log')
\ No newline at end of file
+    LOG_FOLDER:Path = Path('log')
+    CACHE_FOLDER:Path = Path('cache')
\ No newline at end of file
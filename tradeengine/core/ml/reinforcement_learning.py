@@ -1,44 +1,75 @@
+from collections import deque
 from datetime import datetime
+from functools import lru_cache, partial
 import math
+import os
 from pathlib import Path
+import time
 from gymnasium import spaces
 import gymnasium as gym
 import numpy as np
-from typing import List
+from typing import Callable, Deque, List, Tuple, Union
 from stable_baselines3 import DQN
 from stable_baselines3.common.env_checker import check_env
-from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
 import matplotlib.pyplot as plt
 
-from tradeengine.models.candlestick import CandleStick, Indicator
+from tradeengine.models.candlestick import CandleBatch, CandleStick, Indicator, IndicatorBatch, _INDICATOR_COLUMNS
 from tradeengine.core.strategies import TradeStatus
-from tradeengine.tools.common import create_folder_if_not_exists
+from tradeengine.tools.common import create_folder_if_not_exists, datetimes_to_ns
 
 
+# action codes of MarketEnv
+_HOLD = TradeStatus.HOLD.value[0]
+_BUY = TradeStatus.BUY.value[0]
+_SELL = TradeStatus.SELL.value[0]
+# future candlesticks in a reward, including the current one
+_FUTURE_WINDOW = 4
+
 class MarketEnv(gym.Env):
+    """
+    one step per candlestick (same order as candlesticks), observations and rewards which do not
+    depend on actions are precomputed at construction, step() only looks them up
+    """
     def __init__(self, 
-                 indicators: List[Indicator], 
-                 candlesticks: List[CandleStick], 
+                 indicators: Union[List[Indicator], IndicatorBatch], 
+                 candlesticks: Union[List[CandleStick], CandleBatch], 
                  best_buy_times: List[datetime] = [],
                  best_sell_times: List[datetime] = []):
         super(MarketEnv, self).__init__()
         
-        self.indicators = indicators
-        self.candlesticks = candlesticks
-        
         self.observation_space = spaces.Box(
-            low=-np.inf, high=np.inf, shape=(13,), dtype=np.float64
+            low=-np.inf, high=np.inf, shape=(13,), dtype=np.float32
         )
         self.action_space = spaces.Discrete(3)
 
-        self.buy_prices:List[float] = []
+        # (steps, 13)
+        self.observations = get_observations(candlesticks, indicators).astype(np.float32)
+        if isinstance(candlesticks, CandleBatch):
+            closes = candlesticks.closes.astype(np.float64)
+            opentimes = candlesticks.opentimes
+        else:
+            closes = np.fromiter((candlestick.Close for candlestick in candlesticks), dtype=np.float64, count=len(candlesticks))
+            opentimes = datetimes_to_ns([candlestick.Opentime for candlestick in candlesticks])
+        self.closes = closes
+        self.num = len(closes)
+
+        # max close of the current and next 3 candlesticks, shorter at the end
+        padded = np.concatenate((closes, np.full(_FUTURE_WINDOW - 1, -np.inf)))
+        future_max = np.lib.stride_tricks.sliding_window_view(padded, _FUTURE_WINDOW).max(axis=1)
+        future_ratio = np.array([self._get_ratio(close, future) for close, future in zip(closes.tolist(), future_max.tolist())], dtype=np.float64)
+        is_best_buy = np.isin(opentimes, datetimes_to_ns(list(best_buy_times)))
+        is_best_sell = np.isin(opentimes, datetimes_to_ns(list(best_sell_times)))
+        # 1.5: payment for selling reward
+        self.buy_rewards = 1.5 * future_ratio + 0.1 * is_best_buy
+        # the trade reward of sell is added at step
+        self.sell_rewards = 0.5 * -1 * future_ratio + 0.1 * is_best_sell
+
+        self.buy_prices:Deque[float] = deque()
         
         self.current_step = 0
         self.done = False
 
-        self.best_buy_times = set(best_buy_times)
-        self.best_sell_time = set(best_sell_times)
-
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
 
@@ -48,66 +79,33 @@ class MarketEnv(gym.Env):
         return self._get_observation(), {}
 
     def step(self, action):
-        reward = 0
+        reward = 0.0
+        step = self.current_step
+        action = int(action)
     
-        current_price = self.candlesticks[self.current_step].Close
-        # future 3 candlesticks
-        future_prices = []
-        for index in range(self.current_step, min(self.current_step + 4, len(self.candlesticks))):
-            future_prices.append(self.candlesticks[index].Close)
-
-        open_time = self.candlesticks[self.current_step].Opentime
-        is_best_buy_time = open_time in self.best_buy_times
-        is_best_sell_time = open_time in self.best_sell_time
-    
-        if action == TradeStatus.BUY.value: # buy
-            self.buy_prices.append(current_price)
-            reward = 1.5 * self._get_ratio(current_price, max(future_prices)) # 1.5: payment for selling reward
-            if len(self.best_buy_times) > 0 and is_best_buy_time:
-                reward += 0.1
-        elif action == TradeStatus.SELL.value:  # sell
-            reward = 0.0
+        if action == _BUY: # buy
+            self.buy_prices.append(self.closes[step])
+            reward = self.buy_rewards[step]
+        elif action == _SELL:  # sell
             if len(self.buy_prices) > 0:
-                buy_price = self.buy_prices.pop(0)
+                buy_price = self.buy_prices.popleft()
                 # trade reward
-                reward += self._get_ratio(buy_price, current_price)
+                reward += self._get_ratio(buy_price, self.closes[step])
             # future prices reward
-            reward += 0.5 * -1 * (self._get_ratio(current_price, max(future_prices)))
-            if len(self.best_sell_time) > 0 and is_best_sell_time:
-                reward += 0.1
-        elif action == TradeStatus.HOLD.value:  # hold
+            reward += self.sell_rewards[step]
+        elif action == _HOLD:  # hold
             reward = -0.1 # trade quickly
     
         # update status
         self.current_step += 1
-        terminated = self.current_step >= len(self.candlesticks) - 1
+        terminated = self.current_step >= self.num - 1
         truncated = False
     
-        return self._get_observation(), reward, terminated, truncated, {}
+        return self._get_observation(), float(reward), terminated, truncated, {}
 
 
     def _get_observation(self):
-        indicator = self.indicators[self.current_step]
-        candlestick = self.candlesticks[self.current_step]
-        
-        return np.array([
-            indicator.BBBands_Plus_2,
-            indicator.BBBands_Plus_3,
-            indicator.BBBands_Minus_2,
-            indicator.BBBands_Minus_3,
-            indicator.Stoch_K,
-            indicator.Stoch_D,
-            indicator.SMA_20,
-            indicator.SMA_200,
-            indicator.RSI,
-            indicator.MACD,
-            indicator.MACD_SIGNAL,
-            indicator.MACD_HIST,
-            # candlestick.Open,
-            candlestick.Close,
-            # candlestick.High,
-            # candlestick.Low,
-        ], dtype=np.float64)
+        return self.observations[self.current_step]
 
     def _get_ratio(self, old_num:float, new_num:float) -> float:
         return round((old_num - new_num) / old_num, 3)
@@ -119,42 +117,99 @@ def _get_model_path(name:str) -> Path:
     file_name = f'{name}_dqn_model.zip'
     return Path(folder, file_name)
 
-def rl_training(name:str, candlesticks:List[CandleStick], indicators:List[Indicator], best_buy_times:List[datetime]=[], best_sell_times:List[datetime]=[], save_model=True) -> DQN:
-    env = DummyVecEnv([lambda: MarketEnv(indicators, candlesticks, best_buy_times, best_sell_times)])
-    check_env(env.envs[0], warn=True)
-
-    model = DQN("MlpPolicy", env, verbose=1)
+def _split_envs(num:int, n_envs:int) -> List[Tuple[int, int]]:
+    """contiguous (start, end) of each env, every env has at least 2 steps"""
+    n_envs = max(1, min(n_envs, num // 2))
+    bounds = np.linspace(0, num, n_envs + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def rl_training(name:str, candlesticks:List[CandleStick], indicators:List[Indicator], best_buy_times:List[datetime]=[], best_sell_times:List[datetime]=[], save_model=True, n_envs:int=1, subproc:bool=False) -> DQN:
+    """
+    n_envs: candlesticks are split into n_envs contiguous parts, each is stepped by its own env copy,
+            so one pass over candlesticks (total_timesteps) takes n_envs times fewer env rounds.
+            train_freq of DQN counts env rounds, gradient_steps is scaled by n_envs to keep the same gradient
+            updates per step as one env
+    subproc: run env copies in processes (SubprocVecEnv), else in this process (DummyVecEnv)
+    """
+    env_fns = [
+        partial(MarketEnv, indicators[start:end], candlesticks[start:end], best_buy_times, best_sell_times)
+        for start, end in _split_envs(len(candlesticks), n_envs)
+    ]
+    check_env(env_fns[0](), warn=True)
+    env = SubprocVecEnv(env_fns) if subproc and len(env_fns) > 1 else DummyVecEnv(env_fns)
+
+    # default train_freq=4, gradient_steps=1: one update per 4 steps of one env
+    model = DQN("MlpPolicy", env, verbose=1, gradient_steps=len(env_fns))
+    start_time = time.perf_counter()
     model.learn(total_timesteps=len(candlesticks))
+    seconds = time.perf_counter() - start_time
+    print(f'{name}: {model.num_timesteps} steps ({model._n_updates} gradient updates) in {seconds:.2f}s, '
+          f'{model.num_timesteps / seconds:.0f} steps/s, {len(env_fns)} envs')
+    env.close()
 
     if save_model:
         model.save(_get_model_path(name))
     return model
 
+# models kept in memory by rl_run, one per symbol is enough for the simulator
+_MODEL_CACHE_SIZE = 8
 
-def rl_run(name:str, candlesticks:List[CandleStick], indicators:List[Indicator], load_model=True, model=None, show_pic:bool=False) -> TradeStatus:
+@lru_cache(maxsize=_MODEL_CACHE_SIZE)
+def _load_model(path:str, mtime_ns:int) -> DQN:
+    """keyed by mtime too, a retrained (saved again) model is loaded again"""
+    return DQN.load(path)
+
+def get_model(name:str) -> DQN:
+    """saved model of rl_training, loaded from disk only at the first call or after the file changed"""
+    path = _get_model_path(name)
+    return _load_model(str(path), os.stat(path).st_mtime_ns)
+
+def get_observations(candlesticks:Union[List[CandleStick], CandleBatch], indicators:Union[List[Indicator], IndicatorBatch]) -> np.ndarray:
+    """MarketEnv observations of all steps as one (len(candlesticks), 13) matrix, row i is step i"""
+    if isinstance(indicators, IndicatorBatch):
+        columns = [indicators.columns[name] for name in _INDICATOR_COLUMNS]
+    else:
+        columns = [np.fromiter((getattr(indicator, name) for indicator in indicators), dtype=np.float64, count=len(indicators)) for name in _INDICATOR_COLUMNS]
+    if isinstance(candlesticks, CandleBatch):
+        closes = candlesticks.closes
+    else:
+        closes = np.fromiter((candlestick.Close for candlestick in candlesticks), dtype=np.float64, count=len(candlesticks))
+    return np.column_stack(columns + [closes[:len(indicators)]]).astype(np.float64, copy=False)
+
+def predict_actions(model:DQN, observations:np.ndarray, deterministic:bool=False) -> np.ndarray:
+    """
+    one batched forward pass for all rows
+    not deterministic: each row explores with model.exploration_rate, same as calling model.predict row by row
+    """
+    actions, _ = model.policy.predict(observations, deterministic=True)
+    actions = np.asarray(actions).reshape(-1)
+    if not deterministic and model.exploration_rate > 0:
+        explore = np.random.rand(len(actions)) < model.exploration_rate
+        actions[explore] = np.random.randint(model.action_space.n, size=int(np.count_nonzero(explore)))
+    return actions
+
+def rl_strategy(name:str) -> Callable[[Union[List[CandleStick], CandleBatch], List[Indicator]], TradeStatus]:
+    """rl_run of the saved model as a strategy of tradeengine.live.engine.LiveEngine (candlesticks and indicators DESC)"""
+    def strategy(candlesticks:Union[List[CandleStick], CandleBatch], indicators:List[Indicator]) -> TradeStatus:
+        return rl_run(name, candlesticks, indicators)
+    return strategy
+
+def rl_run(name:str, candlesticks:Union[List[CandleStick], CandleBatch], indicators:Union[List[Indicator], IndicatorBatch], load_model=True, model=None, show_pic:bool=False) -> TradeStatus:
     if load_model:
-        model= DQN.load(_get_model_path(name))
+        model = get_model(name)
     else:
         model = model
 
-    env = DummyVecEnv([lambda: MarketEnv(indicators, candlesticks)])
-    check_env(env.envs[0], warn=True)
-
-    action:int
-    actions:List[int] = []
-    obs = env.reset()
-    for _ in range(len(candlesticks)):
-        action, _states = model.predict(obs)
-        obs, reward, done, info = env.step(action)
-        actions.append(action)
-        if done:
-            break
+    # same steps as MarketEnv from reset until done, observations do not depend on actions
+    steps = max(len(candlesticks) - 1, 1)
+    actions:List[int] = predict_actions(model, get_observations(candlesticks[:steps], indicators[:steps])).tolist()
+    action = actions[-1]
 
     if show_pic:
         prices = [c.Close for c in candlesticks]
         times = [c.Opentime for c in candlesticks]  # 提取 opentime
-        buy_points = [i for i, a in enumerate(actions) if a == TradeStatus.BUY.value]
-        sell_points = [i for i, a in enumerate(actions) if a == TradeStatus.SELL.value]
+        buy_points = [i for i, a in enumerate(actions) if a == TradeStatus.BUY.value[0]]
+        sell_points = [i for i, a in enumerate(actions) if a == TradeStatus.SELL.value[0]]
 
         plt.figure(figsize=(12, 6))
         plt.plot(times, prices, label=name)
@@ -179,4 +234,4 @@ def rl_run(name:str, candlesticks:List[CandleStick], indicators:List[Indicator],
         plt.tight_layout()
         plt.show()
 
-    return TradeStatus(action)
\ No newline at end of file
+    return TradeStatus((action,))
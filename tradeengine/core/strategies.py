@@ -1,7 +1,7 @@
 from copy import copy
-from typing import List
+from typing import List, Optional
 from enum import Enum
-from tradeengine.models.candlestick import CandleStick, get_indicator
+from tradeengine.models.candlestick import CandleStick, Indicator, IndicatorBatch, get_indicator
 import numpy as np
 
 class TradeStatus(Enum):
@@ -9,9 +9,18 @@ class TradeStatus(Enum):
     SELL = 2,
     HOLD = 0,
 
-def simple_strategy(candlesticks:List[CandleStick]) -> TradeStatus:
-    """bascily for test, do not use this for real trading"""
-    indicators = get_indicator(candlesticks)
+# TradeStatus as int8 codes in signal arrays
+SIGNAL_HOLD = TradeStatus.HOLD.value[0]
+SIGNAL_BUY = TradeStatus.BUY.value[0]
+SIGNAL_SELL = TradeStatus.SELL.value[0]
+
+def simple_strategy(candlesticks:List[CandleStick], indicators:Optional[List[Indicator]]=None) -> TradeStatus:
+    """
+    bascily for test, do not use this for real trading
+    indicators: precomputed ones of candlesticks (e.g. IncrementalIndicator), computed from candlesticks if None
+    """
+    if indicators is None:
+        indicators = get_indicator(candlesticks)
 
     if indicators[1].Stoch_D < 25 or indicators[1].Stoch_K < 25:
         if candlesticks[1].Close <= indicators[1].BBBands_Minus_2 and candlesticks[0].Close >= indicators[0].BBBands_Minus_2:
@@ -21,4 +30,24 @@ def simple_strategy(candlesticks:List[CandleStick]) -> TradeStatus:
         if candlesticks[1].Close >= indicators[1].BBBands_Plus_2 and candlesticks[0].Close <= indicators[0].BBBands_Plus_2:
             return TradeStatus.SELL
 
-    return TradeStatus.HOLD
\ No newline at end of file
+    return TradeStatus.HOLD
+
+def simple_signals(closes:np.ndarray, prev_closes:np.ndarray, indicators:IndicatorBatch, prev_indicators:IndicatorBatch) -> np.ndarray:
+    """
+    vectorized simple_strategy for many decisions at once, all arrays are aligned by decision
+     - closes, indicators: candlesticks[0] and indicators[0] of simple_strategy (the open candlestick)
+     - prev_closes, prev_indicators: candlesticks[1] and indicators[1]
+    return: int8 SIGNAL_* codes
+    """
+    prev = prev_indicators.columns
+    current = indicators.columns
+    is_low = (prev['Stoch_D'] < 25) | (prev['Stoch_K'] < 25)
+    is_high = (prev['Stoch_D'] > 75) | (prev['Stoch_K'] > 75)
+    is_buy = is_low & (prev_closes <= prev['BBBands_Minus_2']) & (closes >= current['BBBands_Minus_2'])
+    is_sell = is_high & (prev_closes >= prev['BBBands_Plus_2']) & (closes <= current['BBBands_Plus_2'])
+
+    signals = np.full(len(closes), SIGNAL_HOLD, dtype=np.int8)
+    signals[is_sell] = SIGNAL_SELL
+    # buy is checked first by simple_strategy
+    signals[is_buy] = SIGNAL_BUY
+    return signals
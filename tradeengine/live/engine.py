@@ -0,0 +1,213 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import time
+from typing import AsyncIterable, Callable, Deque, Dict, List, Optional, Union
+
+import numpy as np
+
+from tradeengine.core.strategies import TradeStatus, simple_strategy
+from tradeengine.models.candlestick import CandleBatch, CandleStick, Indicator
+from tradeengine.models.incremental_indicator import IncrementalIndicator
+from tradeengine.models.trade import Trade
+from tradeengine.tools.common import datetime_to_ns, ns_to_datetime, timedelta_to_ns
+from tradeengine.tools.convertor import CandleStickBuilder
+
+@dataclass
+class TradeEvent:
+    """
+    trades of one feed message, ASC. received: time.perf_counter_ns() when the message arrived
+    gap: trades between the previous event of the symbol and these may be missing (e.g. lost while reconnecting
+         and not recovered from the api), trades may be empty
+    disconnected: the feed of the symbol is down, trades is empty. candlesticks of the symbol are not closed by clock
+                  until its next event (e.g. trades fetched after reconnecting), so they are not closed with part of their trades
+    """
+    symbol: str
+    trades: List[Trade]
+    received: int
+    gap: bool = False
+    disconnected: bool = False
+
+@dataclass
+class Decision:
+    symbol: str
+    status: TradeStatus
+    candlestick: CandleStick # the closed one
+    time: datetime # engine clock
+    latency: int # ns, from receipt of the trade (or timer) which closed the candlestick to the decision
+    close_lag: int # ns, from the end of the candlestick to the decision, includes feed delay and clock skew
+    complete: bool = True # False: the candlestick or the previous one overlaps a gap of the feed, status is HOLD
+
+class LatencyStats:
+    """latencies of the last `size` samples, ns"""
+    def __init__(self, size:int=100000):
+        self.samples:Deque[int] = deque(maxlen=size)
+
+    def add(self, ns:int) -> None:
+        self.samples.append(ns)
+
+    def percentile(self, q:float) -> float:
+        """ms, nan if no sample"""
+        if not self.samples:
+            return float('nan')
+        return float(np.percentile(np.fromiter(self.samples, dtype=np.int64, count=len(self.samples)), q)) / 1e6
+
+    def __str__(self) -> str:
+        return f'p50 {self.percentile(50):.3f}ms, p99 {self.percentile(99):.3f}ms, n {len(self.samples)}'
+
+# strategy of closed candlesticks: (candlesticks, indicators), both DESC, index 0 is the just closed one
+LiveStrategy = Callable[[Union[CandleBatch, List[CandleStick]], List[Indicator]], TradeStatus]
+
+class _SymbolState:
+    def __init__(self, interval:timedelta, capacity:int, strategy:LiveStrategy):
+        self.builder = CandleStickBuilder(interval, capacity)
+        self.strategy = strategy
+        self.indicator_stream = IncrementalIndicator()
+        # closed candlesticks only, DESC
+        self.indicators:Deque[Indicator] = deque(maxlen=capacity)
+        self.late_trades = 0
+        # epoch ns of the last pushed trade
+        self.last_time:Optional[int] = None
+        # feed gap [since, until], epoch ns, until is None until the next trade arrives
+        self.gap_since:Optional[int] = None
+        self.gap_until:Optional[int] = None
+        self.gaps = 0
+        self.incomplete_decisions = 0
+        # feed is down, see TradeEvent.disconnected
+        self.disconnected = False
+
+    def overlaps_gap(self, opentime:int, interval:int) -> bool:
+        if self.gap_since is None:
+            return False
+        return opentime + interval > self.gap_since and (self.gap_until is None or opentime <= self.gap_until)
+
+class LiveEngine:
+    """
+    execution feed -> CandleStickBuilder -> IncrementalIndicator -> strategy, once per closed candlestick
+     - a candlestick is closed by the first trade of a newer one, or by `clock` when its interval has
+       ended `close_delay` ago, so decisions do not wait for the next trade
+     - trades of closed candlesticks (arrived later than close_delay) are dropped and counted
+     - gaps of the feed (TradeEvent.gap) are counted, candlesticks overlapping one are not decided on (HOLD)
+     - while the feed of a symbol is down (TradeEvent.disconnected), its candlesticks are not closed by clock
+     - clock: epoch ns of now, wall clock or a virtual one (e.g. bot.replay.VirtualClock)
+     - strategy: one for all symbols, or {symbol: strategy} (e.g. rl models trained per symbol)
+     - timer: close candlesticks by clock in background, else the caller calls close_bars
+       (e.g. replay faster than real time, where asyncio.sleep does not follow the clock)
+    """
+    def __init__(self, symbols:List[str], interval:timedelta, capacity:int, strategy:Union[LiveStrategy, Dict[str, LiveStrategy]]=simple_strategy,
+                 on_decision:Optional[Callable[[Decision], None]]=None, close_delay:timedelta=timedelta(milliseconds=200),
+                 clock:Callable[[], int]=time.time_ns, timer:bool=True):
+        self.interval = interval
+        self.strategy = strategy
+        self.on_decision = on_decision
+        self.close_delay = close_delay
+        self.clock = clock
+        self.timer = timer
+        self._interval_ns = timedelta_to_ns(interval)
+        self._states = {
+            symbol: _SymbolState(interval, capacity, strategy[symbol] if isinstance(strategy, dict) else strategy)
+            for symbol in symbols
+        }
+
+        self.latency = LatencyStats()
+        self.close_lag = LatencyStats()
+        self.decisions = 0
+
+    def late_trades(self) -> Dict[str, int]:
+        return {symbol: state.late_trades for symbol, state in self._states.items()}
+
+    def warm_up(self, symbol:str, trades:List[Trade]) -> None:
+        """history before the feed, DESC (same as Exchange.fetch_trades), no decision is made"""
+        state = self._states[symbol]
+        for trade in reversed(trades):
+            closed = state.builder.push(trade)
+            if closed is not None:
+                state.indicators.appendleft(state.indicator_stream.update(closed))
+        if trades:
+            state.last_time = datetime_to_ns(trades[0].execution_time)
+
+    def on_trades(self, event:TradeEvent) -> List[Decision]:
+        state = self._states[event.symbol]
+        state.disconnected = event.disconnected
+        if event.gap:
+            state.gaps += 1
+            if state.gap_since is None or state.gap_until is not None:
+                state.gap_since = state.last_time if state.last_time is not None else 0
+            state.gap_until = None
+        decisions:List[Decision] = []
+        for trade in event.trades:
+            trade_time = datetime_to_ns(trade.execution_time)
+            if state.builder.is_late(trade_time):
+                state.late_trades += 1
+                continue
+            if state.gap_since is not None and state.gap_until is None:
+                state.gap_until = trade_time
+            state.last_time = trade_time
+            closed = state.builder.push(trade)
+            if closed is not None:
+                decisions.append(self._decide(event.symbol, state, closed, event.received))
+        return decisions
+
+    def close_bars(self, now:int) -> List[Decision]:
+        """close open candlesticks whose interval ended close_delay before now (epoch ns)"""
+        received = time.perf_counter_ns()
+        decisions:List[Decision] = []
+        close_delay_ns = timedelta_to_ns(self.close_delay)
+        for symbol, state in self._states.items():
+            opentime = state.builder.opentime
+            if state.disconnected or opentime is None or opentime + self._interval_ns + close_delay_ns > now:
+                continue
+            decisions.append(self._decide(symbol, state, state.builder.close(), received))
+        return decisions
+
+    def _decide(self, symbol:str, state:_SymbolState, closed:CandleStick, received:int) -> Decision:
+        state.indicators.appendleft(state.indicator_stream.update(closed))
+        candlesticks = state.builder.to_batch()
+        if state.builder.open_candlestick is not None:
+            candlesticks = candlesticks[1:]
+        # strategies compare the last two closed candlesticks
+        complete = not any(state.overlaps_gap(int(opentime), self._interval_ns) for opentime in candlesticks.opentimes[:2])
+        if not complete:
+            state.incomplete_decisions += 1
+        status = state.strategy(candlesticks, list(state.indicators)) if complete and len(candlesticks) >= 2 else TradeStatus.HOLD
+
+        latency = time.perf_counter_ns() - received
+        now = self.clock()
+        close_lag = now - (datetime_to_ns(closed.Opentime) + self._interval_ns)
+        self.latency.add(latency)
+        self.close_lag.add(close_lag)
+        self.decisions += 1
+        decision = Decision(symbol, status, closed, ns_to_datetime(now, closed.Opentime.tzinfo), latency, close_lag, complete)
+        if self.on_decision is not None:
+            self.on_decision(decision)
+        return decision
+
+    async def close_by_clock(self) -> None:
+        """close candlesticks by clock forever, run() starts it if timer, or run it as a task when feeding on_trades directly"""
+        close_delay_ns = timedelta_to_ns(self.close_delay)
+        while True:
+            # next interval end + close_delay, intervals are aligned to epoch
+            now = self.clock()
+            wake = now - now % self._interval_ns + self._interval_ns + close_delay_ns
+            if wake - self._interval_ns > now:
+                wake -= self._interval_ns
+            await asyncio.sleep((wake - now) / 1e9)
+            self.close_bars(self.clock())
+
+    async def run(self, events:AsyncIterable[TradeEvent]) -> None:
+        """until events end"""
+        timer = asyncio.create_task(self.close_by_clock()) if self.timer else None
+        try:
+            async for event in events:
+                self.on_trades(event)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def report(self) -> str:
+        late = sum(state.late_trades for state in self._states.values())
+        gaps = sum(state.gaps for state in self._states.values())
+        incomplete = sum(state.incomplete_decisions for state in self._states.values())
+        return (f'{self.decisions} decisions ({incomplete} on gaps), latency: {self.latency}, close lag: {self.close_lag}, '
+                f'late trades: {late}, feed gaps: {gaps}')
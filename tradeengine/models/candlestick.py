@@ -1,11 +1,13 @@
-from dataclasses import dataclass
-from datetime import datetime
-from typing import List
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone, tzinfo
+from typing import Dict, Iterator, List, Optional, Union
 
 import numpy as np
 import talib
 from talib import MA_Type
 
+from tradeengine.tools.common import datetimes_to_ns, ns_to_datetime
+
 @dataclass
 class CandleStick:
     Open: float
@@ -18,6 +20,98 @@ class CandleStick:
     def __post_init__(self):
         self.Volume = round(self.Volume, 3)
 
+class CandleBatch:
+    """
+    struct-of-arrays candlesticks, same order with List[CandleStick] (DESC, index 0 is the lastest)
+     - opentimes: epoch ns, int64
+     - opens, closes, highs, lows, volumes: float64
+    slicing returns views, CandleStick objects are only created when indexed or iterated
+    """
+    __slots__ = ('opentimes', 'opens', 'closes', 'highs', 'lows', 'volumes', 'tz')
+
+    def __init__(self, opentimes:np.ndarray, opens:np.ndarray, closes:np.ndarray, highs:np.ndarray, lows:np.ndarray, volumes:np.ndarray, tz:Optional[tzinfo]=timezone.utc):
+        if not (len(opentimes) == len(opens) == len(closes) == len(highs) == len(lows) == len(volumes)):
+            raise ValueError('all columns must have same length')
+        self.opentimes = opentimes
+        self.opens = opens
+        self.closes = closes
+        self.highs = highs
+        self.lows = lows
+        self.volumes = volumes
+        self.tz = tz
+
+    @classmethod
+    def from_candlesticks(cls, candlesticks:List[CandleStick]) -> 'CandleBatch':
+        n = len(candlesticks)
+        tz = candlesticks[0].Opentime.tzinfo if n > 0 else timezone.utc
+        return cls(
+            opentimes=datetimes_to_ns([candlestick.Opentime for candlestick in candlesticks]),
+            opens=np.fromiter((candlestick.Open for candlestick in candlesticks), dtype=np.float64, count=n),
+            closes=np.fromiter((candlestick.Close for candlestick in candlesticks), dtype=np.float64, count=n),
+            highs=np.fromiter((candlestick.High for candlestick in candlesticks), dtype=np.float64, count=n),
+            lows=np.fromiter((candlestick.Low for candlestick in candlesticks), dtype=np.float64, count=n),
+            volumes=np.fromiter((candlestick.Volume for candlestick in candlesticks), dtype=np.float64, count=n),
+            tz=tz,
+        )
+
+    @classmethod
+    def empty(cls, tz:Optional[tzinfo]=timezone.utc) -> 'CandleBatch':
+        empty = np.empty(0, dtype=np.float64)
+        return cls(np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty, tz)
+
+    @classmethod
+    def concat(cls, batches:List['CandleBatch']) -> 'CandleBatch':
+        """batches must be in DESC order, newest batch first"""
+        batches = [batch for batch in batches if len(batch) > 0]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return cls(
+            opentimes=np.concatenate([batch.opentimes for batch in batches]),
+            opens=np.concatenate([batch.opens for batch in batches]),
+            closes=np.concatenate([batch.closes for batch in batches]),
+            highs=np.concatenate([batch.highs for batch in batches]),
+            lows=np.concatenate([batch.lows for batch in batches]),
+            volumes=np.concatenate([batch.volumes for batch in batches]),
+            tz=batches[0].tz,
+        )
+
+    def __len__(self) -> int:
+        return len(self.opentimes)
+
+    def __getitem__(self, key:Union[int, slice, np.ndarray]) -> Union[CandleStick, 'CandleBatch']:
+        if isinstance(key, (int, np.integer)):
+            return self._candlestick(key)
+        # slice is a view, index/mask array is a copy
+        return CandleBatch(self.opentimes[key], self.opens[key], self.closes[key], self.highs[key], self.lows[key], self.volumes[key], self.tz)
+
+    def __iter__(self) -> Iterator[CandleStick]:
+        for i in range(len(self)):
+            yield self._candlestick(i)
+
+    def _candlestick(self, i:int) -> CandleStick:
+        return CandleStick(
+            Open=float(self.opens[i]),
+            Close=float(self.closes[i]),
+            High=float(self.highs[i]),
+            Low=float(self.lows[i]),
+            Volume=float(self.volumes[i]),
+            Opentime=ns_to_datetime(self.opentimes[i], self.tz),
+        )
+
+    def to_candlesticks(self) -> List[CandleStick]:
+        return [
+            CandleStick(Open=o, Close=c, High=h, Low=l, Volume=v, Opentime=ns_to_datetime(t, self.tz))
+            for t, o, c, h, l, v in zip(
+                self.opentimes.tolist(), self.opens.tolist(), self.closes.tolist(),
+                self.highs.tolist(), self.lows.tolist(), self.volumes.tolist())
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        return self.opentimes.nbytes + self.opens.nbytes + self.closes.nbytes + self.highs.nbytes + self.lows.nbytes + self.volumes.nbytes
+
 @dataclass
 class Indicator:
     BBBands_Plus_2: float
@@ -34,18 +128,63 @@ class Indicator:
     MACD_HIST: float
     Opentime: datetime # 最初取引の時刻。
 
-def get_indicator(candlesticks:List[CandleStick]) -> List[Indicator]:
-    opens = []
-    closes = []
-    highs = []
-    lows = []
-    opentimes = []
-    for i in range(len(candlesticks)-1, -1, -1):
-        opens = np.append(opens, candlesticks[i].Open)
-        closes = np.append(closes, candlesticks[i].Close)
-        highs = np.append(highs, candlesticks[i].High)
-        lows = np.append(lows, candlesticks[i].Low)
-        opentimes = np.append(opentimes, candlesticks[i].Opentime)
+# Indicator fields except Opentime, in declared order
+_INDICATOR_COLUMNS = [field.name for field in fields(Indicator) if field.name != 'Opentime']
+
+class IndicatorBatch:
+    """
+    columnar indicators, same order with candlesticks (DESC, index 0 is the lastest)
+     - columns: Indicator field name -> float64 array
+     - opentimes: epoch ns, int64
+    Indicator objects are only created when indexed, iterated or by to_indicators()
+    """
+    __slots__ = ('columns', 'opentimes', 'tz')
+
+    def __init__(self, columns:Dict[str, np.ndarray], opentimes:np.ndarray, tz:Optional[tzinfo]=timezone.utc):
+        self.columns = columns
+        self.opentimes = opentimes
+        self.tz = tz
+
+    def __len__(self) -> int:
+        return len(self.opentimes)
+
+    def __getitem__(self, key:Union[int, slice, np.ndarray]) -> Union[Indicator, 'IndicatorBatch']:
+        if isinstance(key, (int, np.integer)):
+            return Indicator(
+                **{name: float(column[key]) for name, column in self.columns.items()},
+                Opentime=ns_to_datetime(self.opentimes[key], self.tz),
+            )
+        return IndicatorBatch({name: column[key] for name, column in self.columns.items()}, self.opentimes[key], self.tz)
+
+    def __iter__(self) -> Iterator[Indicator]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_indicators(self) -> List[Indicator]:
+        values = zip(*[self.columns[name].tolist() for name in _INDICATOR_COLUMNS])
+        return [
+            Indicator(*row, Opentime=ns_to_datetime(opentime, self.tz))
+            for opentime, row in zip(self.opentimes.tolist(), values)
+        ]
+
+def get_indicator(candlesticks:Union[List[CandleStick], CandleBatch]) -> List[Indicator]:
+    return get_indicator_batch(candlesticks).to_indicators()
+
+def get_indicator_batch(candlesticks:Union[List[CandleStick], CandleBatch]) -> IndicatorBatch:
+    # talib needs ASC arrays
+    if isinstance(candlesticks, CandleBatch):
+        closes = np.ascontiguousarray(candlesticks.closes[::-1], dtype=np.float64)
+        highs = np.ascontiguousarray(candlesticks.highs[::-1], dtype=np.float64)
+        lows = np.ascontiguousarray(candlesticks.lows[::-1], dtype=np.float64)
+        opentimes = candlesticks.opentimes
+        tz = candlesticks.tz
+    else:
+        n = len(candlesticks)
+        closes = np.fromiter((candlestick.Close for candlestick in reversed(candlesticks)), dtype=np.float64, count=n)
+        highs = np.fromiter((candlestick.High for candlestick in reversed(candlesticks)), dtype=np.float64, count=n)
+        lows = np.fromiter((candlestick.Low for candlestick in reversed(candlesticks)), dtype=np.float64, count=n)
+        opentimes = datetimes_to_ns([candlestick.Opentime for candlestick in candlesticks])
+        tz = candlesticks[0].Opentime.tzinfo if n > 0 else timezone.utc
 
     # Stoch
     stoch_k, stoch_d = talib.STOCH(
@@ -67,26 +206,22 @@ def get_indicator(candlesticks:List[CandleStick]) -> List[Indicator]:
     # MACD
     macd, macdsignal, macdhist = talib.MACD(real=closes, fastperiod=12, slowperiod=26, signalperiod=9)
 
-    # result
-    res = []
-    for i in range(len(candlesticks)-1, -1, -1):
-        res.append(Indicator(
-            BBBands_Plus_2 = bband_plus_2[i],
-            BBBands_Plus_3 = bband_plus_3[i],
-            BBBands_Minus_2 = bband_minus_2[i],
-            BBBands_Minus_3 = bband_minus_3[i],
-            Stoch_K = stoch_k[i],
-            Stoch_D = stoch_d[i],
-            SMA_20=sma_20[i],
-            SMA_200=sma_200[i],
-            RSI=rsi[i],
-            MACD=macd[i],
-            MACD_SIGNAL=macdsignal[i],
-            MACD_HIST=macdhist[i],
-            Opentime = opentimes[i],
-        ))
-
-    return res
+    # result, reversed views back to DESC
+    columns = {
+        'BBBands_Plus_2': bband_plus_2[::-1],
+        'BBBands_Plus_3': bband_plus_3[::-1],
+        'BBBands_Minus_2': bband_minus_2[::-1],
+        'BBBands_Minus_3': bband_minus_3[::-1],
+        'Stoch_K': stoch_k[::-1],
+        'Stoch_D': stoch_d[::-1],
+        'SMA_20': sma_20[::-1],
+        'SMA_200': sma_200[::-1],
+        'RSI': rsi[::-1],
+        'MACD': macd[::-1],
+        'MACD_SIGNAL': macdsignal[::-1],
+        'MACD_HIST': macdhist[::-1],
+    }
+    return IndicatorBatch(columns, opentimes, tz)
 
 def get_candlestick_prices(candlesticks:List[CandleStick], mode:str='close') -> List[float]:
     """mode must be \"open\", \"close\", \"high\", \"low\", \"opentime\""""
@@ -0,0 +1,282 @@
+from collections import deque
+import math
+from typing import Deque, List, Optional
+
+from tradeengine.models.candlestick import CandleStick, Indicator
+
+# same as TA_IS_ZERO in ta-lib
+def _is_zero(value:float) -> bool:
+    return -0.00000001 < value < 0.00000001
+
+def _sum(values) -> float:
+    """sequential sum, same order as ta-lib (builtin sum may be compensated)"""
+    total = 0.0
+    for value in values:
+        total += value
+    return total
+
+class _RollingSum:
+    """sum and sum of squares of the last (period - 1) committed values, the pending value is added on read"""
+    # recompute totals from window after this many pushes, to stop float drift in long running bots
+    _RESYNC = 10000
+
+    def __init__(self, period:int):
+        self.period = period
+        self.values:Deque[float] = deque(maxlen=period - 1)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._pushes = 0
+
+    def push(self, value:float) -> None:
+        if len(self.values) == self.values.maxlen:
+            old = self.values[0]
+            self.total -= old
+            self.total_sq -= old * old
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+
+        self._pushes += 1
+        if self._pushes >= self._RESYNC:
+            self._pushes = 0
+            self.total = _sum(self.values)
+            self.total_sq = _sum(v * v for v in self.values)
+
+    def is_ready(self) -> bool:
+        return len(self.values) == self.period - 1
+
+    def mean(self, value:float) -> float:
+        if not self.is_ready():
+            return math.nan
+        return (self.total + value) / self.period
+
+    def variance(self, value:float) -> float:
+        if not self.is_ready():
+            return math.nan
+        mean = (self.total + value) / self.period
+        return (self.total_sq + value * value) / self.period - mean * mean
+
+class _Stoch:
+    """ta-lib STOCH(fastk=14, slowk=3 SMA, slowd=3 SMA)"""
+    def __init__(self, fastk_period:int=14, slowk_period:int=3, slowd_period:int=3):
+        self.highs:Deque[float] = deque(maxlen=fastk_period - 1)
+        self.lows:Deque[float] = deque(maxlen=fastk_period - 1)
+        self.fastks:Deque[float] = deque(maxlen=slowk_period - 1)
+        self.slowks:Deque[float] = deque(maxlen=slowd_period - 1)
+        self.slowk_period = slowk_period
+        self.slowd_period = slowd_period
+
+    def _peek(self, high:float, low:float, close:float):
+        """return: fastk, slowk, slowd"""
+        if len(self.highs) < self.highs.maxlen:
+            return math.nan, math.nan, math.nan
+        highest = max(max(self.highs), high)
+        lowest = min(min(self.lows), low)
+        diff = (highest - lowest) / 100.0
+        fastk = (close - lowest) / diff if diff != 0.0 else 0.0
+
+        if len(self.fastks) < self.fastks.maxlen:
+            return fastk, math.nan, math.nan
+        slowk = (_sum(self.fastks) + fastk) / self.slowk_period
+
+        if len(self.slowks) < self.slowks.maxlen:
+            return fastk, slowk, math.nan
+        slowd = (_sum(self.slowks) + slowk) / self.slowd_period
+        return fastk, slowk, slowd
+
+    def peek(self, high:float, low:float, close:float):
+        """return: slowk, slowd, both nan until slowd is ready (same as ta-lib)"""
+        _, slowk, slowd = self._peek(high, low, close)
+        if math.isnan(slowd):
+            return math.nan, math.nan
+        return slowk, slowd
+
+    def push(self, high:float, low:float, close:float) -> None:
+        fastk, slowk, _ = self._peek(high, low, close)
+        if not math.isnan(fastk):
+            self.fastks.append(fastk)
+        if not math.isnan(slowk):
+            self.slowks.append(slowk)
+        self.highs.append(high)
+        self.lows.append(low)
+
+class _RSI:
+    """ta-lib RSI, wilder smoothing seeded with simple average of the first period changes"""
+    def __init__(self, period:int=14):
+        self.period = period
+        self.count = 0
+        self.last_close:Optional[float] = None
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def _peek(self, close:float):
+        """return: gain, loss, rsi"""
+        if self.last_close is None:
+            return 0.0, 0.0, math.nan
+        diff = close - self.last_close
+        gain, loss = self.gain, self.loss
+        if self.count < self.period:
+            # sum of changes
+            if diff < 0:
+                loss -= diff
+            else:
+                gain += diff
+            if self.count == self.period - 1:
+                loss /= self.period
+                gain /= self.period
+        else:
+            loss *= (self.period - 1)
+            gain *= (self.period - 1)
+            if diff < 0:
+                loss -= diff
+            else:
+                gain += diff
+            loss /= self.period
+            gain /= self.period
+
+        if self.count < self.period - 1:
+            return gain, loss, math.nan
+        total = gain + loss
+        return gain, loss, 100 * (gain / total) if not _is_zero(total) else 0.0
+
+    def peek(self, close:float) -> float:
+        return self._peek(close)[2]
+
+    def push(self, close:float) -> None:
+        gain, loss, _ = self._peek(close)
+        if self.last_close is not None:
+            self.gain, self.loss = gain, loss
+            self.count += 1
+        self.last_close = close
+
+class _MACD:
+    """
+    ta-lib MACD(12, 26, 9), both EMA are seeded at the same bar (slow_period - 1):
+    slow with SMA of the first 26 closes, fast with SMA of the last 12 of them
+    """
+    def __init__(self, fast_period:int=12, slow_period:int=26, signal_period:int=9):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.signal_period = signal_period
+        self.fast_k = 2.0 / (fast_period + 1)
+        self.slow_k = 2.0 / (slow_period + 1)
+        self.signal_k = 2.0 / (signal_period + 1)
+
+        self.count = 0
+        self.warmup_closes:List[float] = []
+        self.warmup_macds:List[float] = []
+        self.fast_ema = math.nan
+        self.slow_ema = math.nan
+        self.signal_ema = math.nan
+
+    def _peek(self, close:float):
+        """return: slow EMA, fast EMA, macd, signal of this bar, nan when not ready"""
+        if self.count < self.slow_period - 1:
+            return math.nan, math.nan, math.nan, math.nan
+        if self.count == self.slow_period - 1:
+            slow = (_sum(self.warmup_closes) + close) / self.slow_period
+            fast = (_sum(self.warmup_closes[self.slow_period - self.fast_period:]) + close) / self.fast_period
+        else:
+            slow = ((close - self.slow_ema) * self.slow_k) + self.slow_ema
+            fast = ((close - self.fast_ema) * self.fast_k) + self.fast_ema
+        macd = fast - slow
+
+        signal_start = self.slow_period - 1 + self.signal_period - 1
+        if self.count < signal_start:
+            signal = math.nan
+        elif self.count == signal_start:
+            signal = (_sum(self.warmup_macds) + macd) / self.signal_period
+        else:
+            signal = ((macd - self.signal_ema) * self.signal_k) + self.signal_ema
+        return slow, fast, macd, signal
+
+    def peek(self, close:float):
+        """return: macd, signal, hist, all nan until signal is ready (same as ta-lib)"""
+        _, _, macd, signal = self._peek(close)
+        if math.isnan(signal):
+            return math.nan, math.nan, math.nan
+        return macd, signal, macd - signal
+
+    def push(self, close:float) -> None:
+        slow, fast, macd, signal = self._peek(close)
+        if self.count < self.slow_period - 1:
+            self.warmup_closes.append(close)
+        else:
+            self.warmup_closes = []
+            self.slow_ema, self.fast_ema = slow, fast
+            if math.isnan(signal):
+                self.warmup_macds.append(macd)
+            else:
+                self.warmup_macds = []
+                self.signal_ema = signal
+        self.count += 1
+
+class IncrementalIndicator:
+    """
+    streaming version of get_indicator, O(1) per candlestick
+    update() with a newer Opentime commits the previous candlestick,
+    with the same Opentime replaces it (the open candlestick is updated in place)
+    results match get_indicator over the same candlesticks within float tolerance
+    """
+    def __init__(self):
+        self._sma_20 = _RollingSum(20)
+        self._sma_200 = _RollingSum(200)
+        self._stoch = _Stoch()
+        self._rsi = _RSI()
+        self._macd = _MACD()
+
+        self._pending:Optional[CandleStick] = None
+        self.latest:Optional[Indicator] = None
+
+    @classmethod
+    def from_candlesticks(cls, candlesticks:List[CandleStick]) -> 'IncrementalIndicator':
+        """warm up with candlesticks (DESC, same order as get_indicator)"""
+        indicator = cls()
+        for candlestick in reversed(candlesticks):
+            indicator.update(candlestick)
+        return indicator
+
+    def update(self, candlestick:CandleStick) -> Indicator:
+        if self._pending is not None:
+            if candlestick.Opentime < self._pending.Opentime:
+                raise ValueError(f'candlestick is older than current one, {candlestick.Opentime} < {self._pending.Opentime}')
+            if candlestick.Opentime > self._pending.Opentime:
+                self._commit(self._pending)
+        self._pending = candlestick
+        self.latest = self._peek(candlestick)
+        return self.latest
+
+    def _commit(self, candlestick:CandleStick) -> None:
+        close = candlestick.Close
+        self._sma_20.push(close)
+        self._sma_200.push(close)
+        self._stoch.push(candlestick.High, candlestick.Low, close)
+        self._rsi.push(close)
+        self._macd.push(close)
+
+    def _peek(self, candlestick:CandleStick) -> Indicator:
+        close = candlestick.Close
+
+        sma_20 = self._sma_20.mean(close)
+        variance = self._sma_20.variance(close)
+        stddev = math.sqrt(variance) if variance > 0 else 0.0
+        if math.isnan(variance):
+            stddev = math.nan
+        stoch_k, stoch_d = self._stoch.peek(candlestick.High, candlestick.Low, close)
+        macd, macd_signal, macd_hist = self._macd.peek(close)
+
+        return Indicator(
+            BBBands_Plus_2 = sma_20 + 2 * stddev,
+            BBBands_Plus_3 = sma_20 + 3 * stddev,
+            BBBands_Minus_2 = sma_20 - 2 * stddev,
+            BBBands_Minus_3 = sma_20 - 3 * stddev,
+            Stoch_K = stoch_k,
+            Stoch_D = stoch_d,
+            SMA_20 = sma_20,
+            SMA_200 = self._sma_200.mean(close),
+            RSI = self._rsi.peek(close),
+            MACD = macd,
+            MACD_SIGNAL = macd_signal,
+            MACD_HIST = macd_hist,
+            Opentime = candlestick.Opentime,
+        )
\ No newline at end of file
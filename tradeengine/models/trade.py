@@ -1,8 +1,13 @@
 from dataclasses import dataclass
 from enum import Enum
-from datetime import datetime
-import heapq
-from typing import List
+from datetime import datetime, timezone, tzinfo
+import sys
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+
+from tradeengine.tools.common import datetimes_to_ns, ns_to_datetime
+from tradeengine.tools.sort import argsort_desc, is_sorted_desc, merge_desc
 
 
 class Side(Enum):
@@ -18,34 +23,162 @@ class Trade:
     execution_time: datetime
     price: float
 
+_SIDE_TO_CODE = {Side.BUY: 1, Side.SELL: -1, Side.NONE: 0}
+# trades from db have str side
+_SIDE_TO_CODE.update({side.value: code for side, code in list(_SIDE_TO_CODE.items())})
+_CODE_TO_SIDE = {1: Side.BUY, -1: Side.SELL, 0: Side.NONE}
+
+class TradeBatch:
+    """
+    struct-of-arrays trades, same order with List[Trade] (DESC, index 0 is the lastest)
+     - ids: int64 if all ids are plain numbers (bitflyer), else object array of interned str
+     - times: epoch ns, int64
+     - prices, sizes: float64
+     - sides: int8, 1: buy, -1: sell, 0: none
+     - is_sorted: known to be DESC (e.g. db query order, sort_desc), order checks are skipped
+    slicing returns views, Trade objects are only created when indexed or iterated
+    """
+    __slots__ = ('ids', 'times', 'prices', 'sizes', 'sides', 'tz', 'is_sorted')
+
+    def __init__(self, ids:np.ndarray, times:np.ndarray, prices:np.ndarray, sizes:np.ndarray, sides:np.ndarray, tz:Optional[tzinfo]=timezone.utc, is_sorted:bool=False):
+        if not (len(ids) == len(times) == len(prices) == len(sizes) == len(sides)):
+            raise ValueError(f'all columns must have same length, ids: {len(ids)}, times: {len(times)}, prices: {len(prices)}, sizes: {len(sizes)}, sides: {len(sides)}')
+        self.ids = ids
+        self.times = times
+        self.prices = prices
+        self.sizes = sizes
+        self.sides = sides
+        self.tz = tz
+        self.is_sorted = is_sorted
+
+    @classmethod
+    def from_trades(cls, trades:List[Trade]) -> 'TradeBatch':
+        n = len(trades)
+        tz = trades[0].execution_time.tzinfo if n > 0 else timezone.utc
+        return cls(
+            ids=encode_ids([trade.id for trade in trades]),
+            times=datetimes_to_ns([trade.execution_time for trade in trades]),
+            prices=np.fromiter((trade.price for trade in trades), dtype=np.float64, count=n),
+            sizes=np.fromiter((trade.size for trade in trades), dtype=np.float64, count=n),
+            sides=encode_sides([trade.side for trade in trades]),
+            tz=tz,
+        )
+
+    @classmethod
+    def empty(cls, tz:Optional[tzinfo]=timezone.utc) -> 'TradeBatch':
+        return cls(
+            ids=np.empty(0, dtype=np.int64),
+            times=np.empty(0, dtype=np.int64),
+            prices=np.empty(0, dtype=np.float64),
+            sizes=np.empty(0, dtype=np.float64),
+            sides=np.empty(0, dtype=np.int8),
+            tz=tz,
+            is_sorted=True,
+        )
+
+    @classmethod
+    def concat(cls, batches:List['TradeBatch']) -> 'TradeBatch':
+        """batches must be in DESC order, newest batch first"""
+        batches = [batch for batch in batches if len(batch) > 0]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        ids = [batch.ids for batch in batches]
+        if any(_ids.dtype == object for _ids in ids):
+            ids = [_ids.astype(str).astype(object) if _ids.dtype != object else _ids for _ids in ids]
+        # sorted batches stay sorted if their boundaries are in order, O(number of batches)
+        is_sorted = all(batch.is_sorted for batch in batches) and all(
+            batches[i].times[-1] >= batches[i + 1].times[0] for i in range(len(batches) - 1))
+        return cls(
+            ids=np.concatenate(ids),
+            times=np.concatenate([batch.times for batch in batches]),
+            prices=np.concatenate([batch.prices for batch in batches]),
+            sizes=np.concatenate([batch.sizes for batch in batches]),
+            sides=np.concatenate([batch.sides for batch in batches]),
+            tz=batches[0].tz,
+            is_sorted=is_sorted,
+        )
+
+    @classmethod
+    def merge(cls, batches:List['TradeBatch']) -> 'TradeBatch':
+        """batches in any order (e.g. pages fetched concurrently), each sorted DESC, see tools.sort.merge_desc"""
+        batches = [batch.sort_desc() for batch in batches if len(batch) > 0]
+        if len(batches) <= 1:
+            return batches[0] if batches else cls.empty()
+        merged = cls.concat(batches)
+        if merged.is_sorted:
+            return merged
+        merged = merged[merge_desc([batch.times for batch in batches])]
+        merged.is_sorted = True
+        return merged
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __getitem__(self, key:Union[int, slice, np.ndarray]) -> Union[Trade, 'TradeBatch']:
+        if isinstance(key, (int, np.integer)):
+            return self._trade(key)
+        # slice is a view, index/mask array is a copy
+        # sorted only for slices in the same direction
+        is_sorted = self.is_sorted and isinstance(key, slice) and (key.step is None or key.step > 0)
+        return TradeBatch(self.ids[key], self.times[key], self.prices[key], self.sizes[key], self.sides[key], self.tz, is_sorted)
+
+    def __iter__(self) -> Iterator[Trade]:
+        for i in range(len(self)):
+            yield self._trade(i)
+
+    def _trade(self, i:int) -> Trade:
+        return Trade(
+            id=str(self.ids[i]),
+            side=_CODE_TO_SIDE[int(self.sides[i])],
+            size=float(self.sizes[i]),
+            execution_time=ns_to_datetime(self.times[i], self.tz),
+            price=float(self.prices[i]),
+        )
+
+    def to_trades(self) -> List[Trade]:
+        return list(self)
+
+    def sort_desc(self) -> 'TradeBatch':
+        """stable, no check if is_sorted, O(n) check otherwise"""
+        if self.is_sorted:
+            return self
+        if is_sorted_desc(self.times):
+            self.is_sorted = True
+            return self
+        batch = self[argsort_desc(self.times)]
+        batch.is_sorted = True
+        return batch
+
+    @property
+    def nbytes(self) -> int:
+        """array memory, interned str ids are not included"""
+        return self.ids.nbytes + self.times.nbytes + self.prices.nbytes + self.sizes.nbytes + self.sides.nbytes
+
+def encode_sides(sides:List[Union[Side, str]]) -> np.ndarray:
+    """Side or its value -> int8, 1: buy, -1: sell, 0: none"""
+    return np.fromiter((_SIDE_TO_CODE[side] for side in sides), dtype=np.int8, count=len(sides))
+
+def encode_ids(ids:List[str]) -> np.ndarray:
+    """int64 if every id round-trips as a number, else interned str"""
+    try:
+        encoded = np.array(ids, dtype=np.int64)
+        if all(str(_id) == _ids for _id, _ids in zip(encoded.tolist(), ids)):
+            return encoded
+    except (ValueError, OverflowError):
+        pass
+    return np.array([sys.intern(str(_id)) for _id in ids], dtype=object)
+
 
 def sort_trades_desc(trades: List[Trade]) -> List[Trade]:
+    """
+    stable, O(n) check then O(nlogn) sort
+    datetime keys sort as fast as converting them to timestamps for argsort, use TradeBatch.sort_desc for arrays
+    """
     if all(
         trades[i].execution_time >= trades[i + 1].execution_time
         for i in range(len(trades) - 1)
     ):
-        # check sorted, O(n)
         return trades
-    elif len(trades) < 10000:
-        # O(nlogn)
-        return _sort_trades_desc(trades)
-    else: 
-        # O(logn) push/pop, O(n) create
-        return _sort_trades_desc_heapq(trades)
-
-def _sort_trades_desc(trades: List[Trade]) -> List[Trade]:
-    """sort trades by execution_time DESC, use this when small data"""
     return sorted(trades, key=lambda trade: trade.execution_time, reverse=True)
-
-def _sort_trades_desc_heapq(trades: List[Trade]) -> List[Trade]:
-    """sort trades by execution_time DESC, use this when big data"""
-    heap = []
-    for trade in trades:
-        heapq.heappush(heap, (-trade.execution_time.timestamp(), id(trade), trade))
-    
-    sorted_trades = []
-    while heap:
-        _, _, trade = heapq.heappop(heap)
-        sorted_trades.append(trade)
-    
-    return sorted_trades
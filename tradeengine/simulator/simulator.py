@@ -1,21 +1,31 @@
 
 from datetime import datetime, timedelta
 import os
-from typing import List, Optional
+from typing import Deque, Iterable, Iterator, List, Optional, Union
 from collections import deque
 
+import numpy as np
+
 from tradeengine.core.ml.reinforcement_learning import rl_run
 from tradeengine.core.strategies import TradeStatus, simple_strategy
-from tradeengine.models.trade import Trade, sort_trades_desc
-from tradeengine.models.candlestick import get_indicator
+from tradeengine.models.trade import Trade, TradeBatch
+from tradeengine.models.candlestick import Indicator
+from tradeengine.models.incremental_indicator import IncrementalIndicator
 from tradeengine.models.invest import *
-from tradeengine.tools.convertor import datetime_to_str, ConvertTradeToCandleStick
-from tradeengine.tools.common import get_unique_name
+from tradeengine.tools.convertor import datetime_to_str, CandleStickBuilder
+from tradeengine.tools.common import get_unique_name, ns_to_datetime, timedelta_to_ns
 from tradeengine.tools.log import log
 
 class Simulator:
-    def __init__(self, trades: List[Trade], invest: Invest, name:str, is_margin:bool=False):
-        self.trades = sort_trades_desc(trades)
+    def __init__(self, trades: Union[List[Trade], TradeBatch, Iterable[TradeBatch]], invest: Invest, name:str, is_margin:bool=False):
+        """
+        trades: List[Trade] or TradeBatch, or batches in time order (ASC, e.g. api.db.trade.iter_trades)
+                batches are consumed one by one, so memory is bounded by batch size
+        """
+        if isinstance(trades, list):
+            # sorted on timestamps, push_trade works on batches
+            trades = TradeBatch.from_trades(trades).sort_desc()
+        self.trades = trades
         self.account_money = invest.balance
         self.account_coin:float = 0.0
         self.loss_cut = invest.loss_cut
@@ -35,34 +45,73 @@ class Simulator:
     def run_realtime(self) -> None:
         pass
 
-    def push_trade(self, trades:List[Trade], candlesticks_num:int, candlestick_interval:int, fetch_interval:int, _log:log):
-        period = (candlesticks_num + 2) * candlestick_interval
-        end_time = trades[-1].execution_time + timedelta(minutes=period)
-        cached_candlesticks = None
-        # TODO: data too small, not difference between O(1), O(n). Consider deque use more resource than list, list is faster
-        #       try use deque when big data
-        # tmp_trades = deque([])
-        tmp_trades = []
-        for trade in reversed(trades):
-            # tmp_trades.appendleft(trade)
-            tmp_trades.insert(0, trade)
-            if trade.execution_time > end_time:
-                _, cached_candlesticks = ConvertTradeToCandleStick(tmp_trades, cached_candlesticks, check_trades_order=False).by_minutes(candlestick_interval)
-                indicators = get_indicator(cached_candlesticks)
-                # trade_status = simple_strategy(cached_candlesticks)
-                trade_status = rl_run(self.name, cached_candlesticks, indicators)
-
-                if trade_status == TradeStatus.BUY:
-                    self.sim_buy(trade.execution_time, cached_candlesticks[0].Close, self._get_buy_money(), _log)
-                elif trade_status == TradeStatus.SELL:
-                    self.sim_sell(trade.execution_time, cached_candlesticks[0].Close, self._get_sell_size(), _log)
-                end_time += timedelta(minutes=fetch_interval)
-                # update tmp_trades
-                start_time = end_time - timedelta(minutes=period)
-                index = len(tmp_trades) - 1
-                while index >= 0 and tmp_trades[index].execution_time < start_time:
-                    tmp_trades.pop()
-                    index -= 1
+    def push_trade(self, trades:Union[List[Trade], TradeBatch, Iterable[TradeBatch]], candlesticks_num:int, candlestick_interval:int, fetch_interval:int, _log:log):
+        """
+        decisions on the time-sorted arrays of each batch, no Trade object per trade:
+        the next decision trade is found by binary search from the current index, trades up to it are
+        pushed to the builder at once (views of the batch, nothing is copied or moved per decision)
+        """
+        period_ns = timedelta_to_ns(timedelta(minutes=(candlesticks_num + 2) * candlestick_interval))
+        fetch_ns = timedelta_to_ns(timedelta(minutes=fetch_interval))
+        end_time:Optional[int] = None
+        builder = CandleStickBuilder(timedelta(minutes=candlestick_interval), candlesticks_num)
+        indicator_stream = IncrementalIndicator()
+        # DESC, aligned with builder's candlesticks
+        indicators:Deque[Indicator] = deque(maxlen=candlesticks_num)
+        for batch in self._iter_batches(trades):
+            n = len(batch)
+            # ASC views
+            times = batch.times[::-1]
+            if end_time is None and n > 0:
+                end_time = int(times[0]) + period_ns
+            start = 0
+            while start < n:
+                # first trade after end_time, same as comparing trade by trade
+                decision = start + int(np.searchsorted(times[start:], end_time, side='right'))
+                end = min(decision + 1, n)
+                # batch is DESC, trades [start, end) of ASC are batch[n - end:n - start]
+                closed_candlesticks = builder.push_batch(batch[n - end:n - start])
+                for i in range(len(closed_candlesticks) - 1, -1, -1):
+                    self._push_indicator(indicator_stream.update(closed_candlesticks[i]), indicators)
+                start = end
+                if decision >= n:
+                    break
+
+                open_candlestick = builder.open_candlestick
+                self._push_indicator(indicator_stream.update(open_candlestick), indicators)
+                # trade_status = simple_strategy(candlesticks)
+                trade_status = rl_run(self.name, builder.to_batch(), list(indicators))
+
+                self.fill(ns_to_datetime(times[decision], batch.tz), trade_status, open_candlestick.Close, _log)
+                end_time += fetch_ns
+
+    def _iter_batches(self, trades:Union[List[Trade], TradeBatch, Iterable[TradeBatch]]) -> Iterator[TradeBatch]:
+        """batches in time order, trades in a batch are DESC"""
+        if isinstance(trades, list):
+            yield TradeBatch.from_trades(trades)
+            return
+        if isinstance(trades, TradeBatch):
+            yield trades
+            return
+        yield from trades
+
+    def _push_indicator(self, indicator:Indicator, indicators:Deque[Indicator]) -> None:
+        """indicators: DESC, replace the open candlestick's indicator or add a new one"""
+        if indicators and indicators[0].Opentime == indicator.Opentime:
+            indicators[0] = indicator
+        else:
+            indicators.appendleft(indicator)
+
+    def fill(self, time:datetime, trade_status:TradeStatus, price:float, _log:log) -> None:
+        """account update of a decision, also used by decisions of the live engine (bot.simulator.Simulator.replay)"""
+        if trade_status == TradeStatus.BUY:
+            self.sim_buy(time, price, self._get_buy_money(), _log)
+        elif trade_status == TradeStatus.SELL:
+            self.sim_sell(time, price, self._get_sell_size(), _log)
+
+    def total(self, price:float) -> float:
+        """money + coin at price"""
+        return self.account_money + self.account_coin * price
 
     def _get_buy_money(self) -> float:
         _type = type(self.invest_strategy)
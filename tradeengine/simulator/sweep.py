@@ -0,0 +1,242 @@
+from dataclasses import asdict, dataclass, fields
+from datetime import timedelta
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tradeengine.core.strategies import SIGNAL_HOLD, TradeStatus, simple_signals, simple_strategy
+from tradeengine.models.candlestick import CandleBatch, Indicator, IndicatorBatch, _INDICATOR_COLUMNS
+from tradeengine.models.incremental_indicator import IncrementalIndicator
+from tradeengine.models.invest import FixedInvest
+from tradeengine.models.trade import TradeBatch
+from tradeengine.tools.common import timedelta_to_ns
+from tradeengine.simulator.vectorized import backtest_signals
+from tradeengine.tools.convertor import aggregate_trades
+
+@dataclass(frozen=True)
+class SweepConfig:
+    """one simulator setting, intervals are minutes (same as Simulator.run), invest is FixedInvest.invest"""
+    candlestick_interval: int
+    fetch_interval: int
+    invest: float
+    loss_cut: Optional[float]
+    strategy: str
+
+    @property
+    def frame_key(self) -> Tuple[int, int]:
+        """configs with the same key share one DecisionFrame"""
+        return (self.candlestick_interval, self.fetch_interval)
+
+def make_grid(candlestick_intervals:List[int], fetch_intervals:List[int], invests:List[float], loss_cuts:List[Optional[float]], strategies:List[str]) -> List[SweepConfig]:
+    """all combinations"""
+    return [SweepConfig(*values) for values in itertools.product(candlestick_intervals, fetch_intervals, invests, loss_cuts, strategies)]
+
+class DecisionFrame:
+    """
+    everything a strategy sees at each decision of Simulator.push_trade, precomputed once for one
+    (symbol, candlestick_interval, fetch_interval) and shared by all invest / loss_cut / strategy settings
+    arrays are in time order (ASC), window() returns DESC like the rest of tradeengine
+     - times, prices: trade which triggered the decision, epoch ns / price (= close of the open candlestick)
+     - bar_indexes: index of the open candlestick in bars
+     - open_bars, open_indicators: the open candlestick and its indicator at the decision
+     - bars, indicators: all candlesticks (final values) and their indicators
+    """
+    __slots__ = ('times', 'prices', 'bar_indexes', 'open_bars', 'open_indicators', 'bars', 'indicators')
+
+    def __init__(self, times:np.ndarray, prices:np.ndarray, bar_indexes:np.ndarray, open_bars:CandleBatch, open_indicators:IndicatorBatch, bars:CandleBatch, indicators:IndicatorBatch):
+        self.times = times
+        self.prices = prices
+        self.bar_indexes = bar_indexes
+        self.open_bars = open_bars
+        self.open_indicators = open_indicators
+        self.bars = bars
+        self.indicators = indicators
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def window(self, k:int, size:int) -> Tuple[CandleBatch, IndicatorBatch]:
+        """candlesticks and indicators at decision k, DESC, index 0 is the open one, at most size"""
+        bar = int(self.bar_indexes[k])
+        start = max(0, bar - size + 1)
+        closed_bars = self.bars[start:bar][::-1]
+        closed_indicators = self.indicators[start:bar][::-1]
+        candlesticks = CandleBatch.concat([self.open_bars[k:k + 1], closed_bars])
+        indicators = IndicatorBatch(
+            {name: np.concatenate((self.open_indicators.columns[name][k:k + 1], column)) for name, column in closed_indicators.columns.items()},
+            np.concatenate((self.open_indicators.opentimes[k:k + 1], closed_indicators.opentimes)),
+            self.open_indicators.tz,
+        )
+        return candlesticks, indicators
+
+def decision_indexes(times:np.ndarray, start_time:int, step:int) -> np.ndarray:
+    """
+    trades which trigger a decision in Simulator.push_trade, times: ASC epoch ns
+    the k-th decision is the first trade after the (k-1)-th one with time > start_time + k * step,
+    i_k = max(i_{k-1} + 1, s_k) = k + max(s_j - j for j <= k), s_k is found by binary search
+    """
+    if len(times) <= 0 or times[-1] <= start_time:
+        return np.empty(0, dtype=np.int64)
+    count = int((int(times[-1]) - start_time - 1) // step) + 1
+    ks = np.arange(count, dtype=np.int64)
+    searched = np.searchsorted(times, start_time + ks * step, side='right')
+    indexes = ks + np.maximum.accumulate(searched - ks)
+    return indexes[indexes < len(times)]
+
+def build_decision_frame(trades:TradeBatch, candlesticks_num:int, candlestick_interval:int, fetch_interval:int) -> DecisionFrame:
+    """same decisions, candlesticks and indicators as Simulator.push_trade, trades: DESC (TradeBatch order)"""
+    interval_ns = timedelta_to_ns(timedelta(minutes=candlestick_interval))
+    times = np.ascontiguousarray(trades.times[::-1])
+    prices = np.ascontiguousarray(trades.prices[::-1])
+    sizes = np.ascontiguousarray(trades.sizes[::-1])
+
+    # ASC candlesticks, final values
+    bars = CandleBatch(*[column[::-1] for column in aggregate_trades(trades.times, trades.prices, trades.sizes, 0, interval_ns)], tz=trades.tz)
+
+    period_ns = timedelta_to_ns(timedelta(minutes=(candlesticks_num + 2) * candlestick_interval))
+    start_time = int(times[0]) + period_ns if len(times) > 0 else 0
+    indexes = decision_indexes(times, start_time, timedelta_to_ns(timedelta(minutes=fetch_interval)))
+
+    # open candlestick at each decision: trades from the candlestick's first one to the decision one
+    bar_indexes = np.searchsorted(bars.opentimes, times[indexes] - times[indexes] % interval_ns)
+    starts = np.searchsorted(times, bars.opentimes[bar_indexes], side='left')
+    bounds = np.stack((starts, indexes + 1), axis=1).ravel()
+    # reduceat needs indexes < length, the sentinel is never part of a result
+    _prices = np.append(prices, 0.0)
+    _sizes = np.append(sizes, 0.0)
+    open_bars = CandleBatch(
+        opentimes=bars.opentimes[bar_indexes],
+        opens=prices[starts],
+        closes=prices[indexes],
+        highs=np.maximum.reduceat(_prices, bounds)[::2],
+        lows=np.minimum.reduceat(_prices, bounds)[::2],
+        volumes=np.add.reduceat(_sizes, bounds)[::2],
+        tz=trades.tz,
+    )
+
+    # one streaming pass in the same order as the simulator: open candlesticks at decisions, then the closed one
+    open_values = np.empty((len(indexes), len(_INDICATOR_COLUMNS)), dtype=np.float64)
+    closed_values = np.empty((len(bars), len(_INDICATOR_COLUMNS)), dtype=np.float64)
+    indicator_stream = IncrementalIndicator()
+    k = 0
+    for bar in range(len(bars)):
+        while k < len(indexes) and bar_indexes[k] == bar:
+            open_values[k] = _indicator_values(indicator_stream.update(open_bars[k]))
+            k += 1
+        closed_values[bar] = _indicator_values(indicator_stream.update(bars[bar]))
+
+    return DecisionFrame(
+        times=times[indexes],
+        prices=prices[indexes],
+        bar_indexes=bar_indexes,
+        open_bars=open_bars,
+        open_indicators=IndicatorBatch(dict(zip(_INDICATOR_COLUMNS, open_values.T)), open_bars.opentimes, trades.tz),
+        bars=bars,
+        indicators=IndicatorBatch(dict(zip(_INDICATOR_COLUMNS, closed_values.T)), bars.opentimes, trades.tz),
+    )
+
+def _indicator_values(indicator:Indicator) -> List[float]:
+    return [getattr(indicator, name) for name in _INDICATOR_COLUMNS]
+
+# strategy: (frame, decision index, candlesticks_num, model name) -> TradeStatus
+Strategy = Callable[[DecisionFrame, int, int, str], TradeStatus]
+
+def _simple(frame:DecisionFrame, k:int, candlesticks_num:int, name:str) -> TradeStatus:
+    candlesticks, indicators = frame.window(k, 2)
+    return simple_strategy(candlesticks, indicators)
+
+def _rl(frame:DecisionFrame, k:int, candlesticks_num:int, name:str) -> TradeStatus:
+    # imported here, stable_baselines3 is slow to import and not needed by other strategies
+    from tradeengine.core.ml.reinforcement_learning import rl_run
+    candlesticks, indicators = frame.window(k, candlesticks_num)
+    return rl_run(name, candlesticks, indicators)
+
+STRATEGIES:Dict[str, Strategy] = {
+    'simple': _simple,
+    'rl': _rl,
+}
+
+def _simple_signals(frame:DecisionFrame, candlesticks_num:int, name:str) -> np.ndarray:
+    previous = frame.bar_indexes - 1
+    # simple_strategy needs the previous candlestick, hold without it
+    has_previous = previous >= 0
+    previous = np.maximum(previous, 0)
+    signals = simple_signals(frame.prices, frame.bars.closes[previous], frame.open_indicators, frame.indicators[previous])
+    signals[~has_previous] = SIGNAL_HOLD
+    return signals
+
+def _rl_signals(frame:DecisionFrame, candlesticks_num:int, name:str) -> np.ndarray:
+    """
+    rl_run of all decisions in one forward pass: rl_run returns the action of the second oldest
+    candlestick in the window (the last MarketEnv step), so one observation per decision is enough
+    """
+    from tradeengine.core.ml.reinforcement_learning import get_model, get_observations, predict_actions
+    # window position of the last step, 0 is the open candlestick
+    sizes = np.minimum(candlesticks_num, frame.bar_indexes + 1)
+    positions = np.maximum(sizes - 1, 1) - 1
+    bars = np.maximum(frame.bar_indexes - positions, 0)
+    closed = get_observations(frame.bars[bars], frame.indicators[bars])
+    opened = get_observations(frame.open_bars, frame.open_indicators)
+    observations = np.where((positions == 0)[:, None], opened, closed)
+    return predict_actions(get_model(name), observations).astype(np.int8)
+
+# signals of all decisions at once: (frame, candlesticks_num, model name) -> int8 SIGNAL_* codes
+Signals = Callable[[DecisionFrame, int, str], np.ndarray]
+
+# strategies whose decisions do not depend on the account, run by backtest_signals instead of the decision loop
+SIGNALS:Dict[str, Signals] = {
+    'simple': _simple_signals,
+    'rl': _rl_signals,
+}
+
+@dataclass
+class SweepResult:
+    buys: int
+    sells: int
+    loss_cuts: int # sells which left money under loss_cut (logged only by Simulator)
+    account_money: float
+    account_coin: float
+    total: float # money + coin at the last decision price
+
+def run_config(frame:DecisionFrame, config:SweepConfig, balance:float, candlesticks_num:int, name:str, vectorized:bool=True) -> SweepResult:
+    """
+    same account rules as Simulator.sim_buy / sim_sell with FixedInvest, without logging
+    vectorized: use SIGNALS and backtest_signals if the strategy has them, else call the strategy per decision
+    """
+    if vectorized and config.strategy in SIGNALS:
+        backtest = backtest_signals(frame.prices, SIGNALS[config.strategy](frame, candlesticks_num, name), FixedInvest(balance=balance, loss_cut=config.loss_cut, invest=config.invest))
+        if len(frame) <= 0:
+            return SweepResult(0, 0, 0, balance, 0.0, balance)
+        return SweepResult(backtest.buys, backtest.sells, backtest.loss_cuts,
+                           float(backtest.money[-1]), float(backtest.coin[-1]), float(backtest.equity[-1]))
+
+    strategy = STRATEGIES[config.strategy]
+    money = balance
+    coin = 0.0
+    buys = sells = loss_cuts = 0
+    prices = frame.prices.tolist()
+    for k in range(len(frame)):
+        status = strategy(frame, k, candlesticks_num, name)
+        if status == TradeStatus.BUY:
+            if money <= config.invest:
+                continue
+            coin += config.invest / prices[k]
+            money -= config.invest
+            buys += 1
+        elif status == TradeStatus.SELL:
+            if coin < 0.001:
+                continue
+            money += prices[k] * coin
+            coin = 0.0
+            sells += 1
+            if config.loss_cut and money < config.loss_cut:
+                loss_cuts += 1
+    last_price = prices[-1] if prices else 0.0
+    return SweepResult(buys, sells, loss_cuts, money, coin, money + coin * last_price)
+
+def result_row(symbol:str, config:SweepConfig, result:SweepResult) -> Dict:
+    """one DataFrame row"""
+    return {'symbol': symbol, **asdict(config), **asdict(result)}
+
+SWEEP_COLUMNS = ['symbol'] + [field.name for field in fields(SweepConfig)] + [field.name for field in fields(SweepResult)]
@@ -0,0 +1,96 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from tradeengine.core.strategies import SIGNAL_BUY, SIGNAL_HOLD, SIGNAL_SELL
+from tradeengine.models.invest import FixedInvest
+
+@dataclass
+class VectorizedBacktest:
+    """
+    account after each decision, arrays are aligned with the signals (time order)
+     - fills: int8 SIGNAL_* code of filled orders, SIGNAL_HOLD if nothing was filled
+     - money, coin: account_money and account_coin of Simulator
+     - equity: money + coin at the decision price
+    """
+    fills: np.ndarray
+    money: np.ndarray
+    coin: np.ndarray
+    equity: np.ndarray
+    loss_cuts: int # sells which left money under loss_cut (logged only by Simulator)
+
+    @property
+    def buys(self) -> int:
+        return int(np.count_nonzero(self.fills == SIGNAL_BUY))
+
+    @property
+    def sells(self) -> int:
+        return int(np.count_nonzero(self.fills == SIGNAL_SELL))
+
+def backtest_signals(prices:np.ndarray, signals:np.ndarray, invest:FixedInvest) -> VectorizedBacktest:
+    """
+    FixedInvest rules of Simulator.sim_buy / sim_sell on precomputed signals (e.g. strategies.simple_signals)
+     - buy: invest money at the price, skipped if money <= invest
+     - sell: all coin at the price, skipped if coin < 0.001
+    signals are only filtered per round trip (first buy to the sell which closes it) by binary search,
+    balances and equity curve are cumulative sums, same float operations in same order as Simulator
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    n = len(prices)
+    buy_indexes = np.flatnonzero(signals == SIGNAL_BUY)
+    sell_indexes = np.flatnonzero(signals == SIGNAL_SELL)
+    sizes = invest.invest / prices
+
+    fills = np.full(n, SIGNAL_HOLD, dtype=np.int8)
+    money_deltas = np.zeros(n, dtype=np.float64)
+    coin_deltas = np.zeros(n, dtype=np.float64)
+    money = invest.balance
+    loss_cuts = 0
+    start = 0
+    while True:
+        first = np.searchsorted(buy_indexes, start)
+        if first >= len(buy_indexes) or money <= invest.invest:
+            # no buy can be filled, then no sell either
+            break
+        # buys until money runs out, later buy signals of the round trip are skipped
+        candidates = buy_indexes[first:]
+        affordable = 0
+        left = money
+        while affordable < len(candidates) and left > invest.invest:
+            left -= invest.invest
+            affordable += 1
+        buys = candidates[:affordable]
+        coins = np.cumsum(sizes[buys])
+
+        # the first sell after coin reaches 0.001 closes the round trip (coins is increasing)
+        sell = None
+        enough = np.searchsorted(coins, 0.001, side='left')
+        if enough < len(buys):
+            position = np.searchsorted(sell_indexes, buys[enough])
+            if position < len(sell_indexes):
+                sell = int(sell_indexes[position])
+                bought = np.searchsorted(buys, sell)
+                buys = buys[:bought]
+                coins = coins[:bought]
+
+        fills[buys] = SIGNAL_BUY
+        money_deltas[buys] = -invest.invest
+        coin_deltas[buys] = sizes[buys]
+        for _ in range(len(buys)):
+            money -= invest.invest
+        if sell is None:
+            break
+
+        coin = float(coins[-1])
+        fills[sell] = SIGNAL_SELL
+        money_deltas[sell] = prices[sell] * coin
+        coin_deltas[sell] = -coin
+        money += prices[sell] * coin
+        if invest.loss_cut and money < invest.loss_cut:
+            loss_cuts += 1
+        start = sell + 1
+
+    # sequential sums from the initial balance, same as Simulator's in-place updates
+    money_curve = np.cumsum(np.concatenate(([float(invest.balance)], money_deltas)))[1:]
+    coin_curve = np.cumsum(coin_deltas)
+    return VectorizedBacktest(fills, money_curve, coin_curve, money_curve + coin_curve * prices, loss_cuts)
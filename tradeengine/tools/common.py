@@ -1,7 +1,39 @@
+from datetime import datetime, timedelta, timezone, tzinfo
 import os
+from typing import List, Optional
+
+import numpy as np
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_ONE_MICROSECOND = timedelta(microseconds=1)
 
 def get_unique_name(exchange_name:str, symbol:str) -> str:
     return f'{exchange_name}_{symbol}'
 
 def create_folder_if_not_exists(folder_path) -> None:
-    os.makedirs(folder_path, exist_ok=True)
\ No newline at end of file
+    os.makedirs(folder_path, exist_ok=True)
+
+def datetime_to_ns(date:datetime) -> int:
+    """epoch nanoseconds, exact to microsecond. naive datetime is counted from naive epoch"""
+    epoch = _EPOCH if date.tzinfo is None else _EPOCH_UTC
+    return (date - epoch) // _ONE_MICROSECOND * 1000
+
+def timedelta_to_ns(delta:timedelta) -> int:
+    return delta // _ONE_MICROSECOND * 1000
+
+def ns_to_datetime(ns:int, tz:Optional[tzinfo]=timezone.utc) -> datetime:
+    """inverse of datetime_to_ns, tz=None returns naive datetime"""
+    if tz is None:
+        return _EPOCH + timedelta(microseconds=int(ns) // 1000)
+    if tz is timezone.utc:
+        return _EPOCH_UTC + timedelta(microseconds=int(ns) // 1000)
+    return (_EPOCH_UTC + timedelta(microseconds=int(ns) // 1000)).astimezone(tz)
+
+def datetimes_to_ns(dates:List[datetime]) -> np.ndarray:
+    """vectorized datetime_to_ns, all dates must be all aware or all naive"""
+    if len(dates) > 0 and dates[0].tzinfo is not None:
+        # float seconds keep sub-microsecond precision for current epoch, round back to exact microsecond
+        seconds = np.fromiter((date.timestamp() for date in dates), dtype=np.float64, count=len(dates))
+        return np.rint(seconds * 1e6).astype(np.int64) * 1000
+    return np.fromiter((datetime_to_ns(date) for date in dates), dtype=np.int64, count=len(dates))
\ No newline at end of file
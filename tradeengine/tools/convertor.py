@@ -1,82 +1,415 @@
 from dataclasses import fields
-from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 
-from tradeengine.models.candlestick import CandleStick
-from tradeengine.models.trade import Trade, sort_trades_desc
+from tradeengine.models.candlestick import CandleBatch, CandleStick
+from tradeengine.models.trade import Trade, TradeBatch, sort_trades_desc
+from tradeengine.tools.common import datetime_to_ns, datetimes_to_ns, ns_to_datetime, timedelta_to_ns
 
 def datetime_to_str(date:datetime) -> str:
     return date.strftime('%Y-%m-%d %H:%M:%S')
 
 class ConvertTradeToCandleStick:
-    def __init__(self, trades:List[Trade], cached:Optional[List[CandleStick]]=None, check_trades_order:bool=True):
-        if check_trades_order:
+    def __init__(self, trades:Union[List[Trade], TradeBatch], cached:Optional[Union[List[CandleStick], CandleBatch]]=None, check_trades_order:bool=True, as_batch:bool=False):
+        """as_batch: by_* return CandleBatch instead of List[CandleStick]"""
+        self._arrays:Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._tz:Optional[tzinfo] = None
+        if isinstance(trades, TradeBatch):
+            if check_trades_order:
+                trades = trades.sort_desc()
+            self._arrays = (trades.times, trades.prices, trades.sizes)
+            self._tz = trades.tz
+            trades = []
+        elif check_trades_order:
             trades = sort_trades_desc(trades)
         self.trades = trades
         self.cached = cached
+        self.as_batch = as_batch
+
+    @classmethod
+    def from_arrays(cls, times:np.ndarray, prices:np.ndarray, sizes:np.ndarray, cached:Optional[Union[List[CandleStick], CandleBatch]]=None, tz:Optional[tzinfo]=timezone.utc, as_batch:bool=False) -> 'ConvertTradeToCandleStick':
+        """columnar input, times: epoch ns, all arrays sorted DESC"""
+        convertor = cls([], cached, check_trades_order=False, as_batch=as_batch)
+        convertor._arrays = (times, prices, sizes)
+        convertor._tz = tz
+        return convertor
 
     def by_seconds(self, second:int) -> Tuple[str, List[CandleStick]]:
         if type(second) is not int or not (second > 0 and second <=60):
             raise ValueError(f'second must int and in 1~60, wrong second: {second}')
-        lastest_open_time_second = (self.trades[0].execution_time.second // second) * second
-        open_time = self.trades[0].execution_time.replace(second=lastest_open_time_second, microsecond=0)
+        lastest_open_time_second = (self._lastest_time().second // second) * second
+        open_time = self._lastest_time().replace(second=lastest_open_time_second, microsecond=0)
         interval = timedelta(seconds=second)
         return f'{second}s', self._convert(open_time, interval)
 
     def by_minutes(self, minute:int) -> Tuple[List[CandleStick], timedelta]:
         if type(minute) is not int or not (minute > 0 and minute <= 60):
             raise ValueError(f'minute must int and in 1~60, wrong minute: {minute}')
-        lastest_open_time_minute = (self.trades[0].execution_time.minute // minute) * minute
-        open_time = self.trades[0].execution_time.replace(minute=lastest_open_time_minute, second=0, microsecond=0)
+        lastest_open_time_minute = (self._lastest_time().minute // minute) * minute
+        open_time = self._lastest_time().replace(minute=lastest_open_time_minute, second=0, microsecond=0)
         interval = timedelta(minutes=minute)
         return f'{minute}m', self._convert(open_time, interval)
     
     def by_hours(self, hour:int) -> Tuple[List[CandleStick], timedelta]:
         if type(hour) is not int or not (hour > 0 and hour <= 24):
             raise ValueError(f'hour must int and in 1~24, wrong hour: {hour}')
-        lastest_open_time_hour = (self.trades[0].execution_time.hour // hour) * hour
-        open_time = self.trades[0].execution_time.replace(hour=lastest_open_time_hour, minute=0, second=0, microsecond=0)
+        lastest_open_time_hour = (self._lastest_time().hour // hour) * hour
+        open_time = self._lastest_time().replace(hour=lastest_open_time_hour, minute=0, second=0, microsecond=0)
         interval = timedelta(hours=hour)
         return f'{hour}h', self._convert(open_time, interval)
 
     def by_days(self, day:int) -> Tuple[List[CandleStick], timedelta]:
         if type(day) is not int or not (day > 0 and day <= 28):
             raise ValueError(f'day must int and in 1~28, wrong day: {day}')
-        lastest_open_time_day = (self.trades[0].execution_time.day // day) * day
-        open_time = self.trades[0].execution_time.replace(day=lastest_open_time_day, hour=0 ,minute=0, second=0, microsecond=0)
+        lastest_open_time_day = (self._lastest_time().day // day) * day
+        open_time = self._lastest_time().replace(day=lastest_open_time_day, hour=0 ,minute=0, second=0, microsecond=0)
         interval = timedelta(days=day)
         return f'{day}d', self._convert(open_time, interval)
 
-    def _convert(self, open_time:datetime, interval:timedelta) -> List[CandleStick]:
-        candlesticks = []
-        tmp_trades_price = []
-        tmp_volume:float = 0
-        for i in range(len(self.trades)):
-            if self.trades[i].execution_time < open_time:
-                new_candlestick = CandleStick(
-                    Open=tmp_trades_price[-1],
-                    Close=tmp_trades_price[0],
-                    High=np.max(tmp_trades_price),
-                    Low=np.min(tmp_trades_price),
-                    Volume=tmp_volume,
-                    Opentime=open_time,
-                )
-                candlesticks.append(new_candlestick)
-                # init first element
-                open_time -= interval
-                tmp_trades_price = [self.trades[i].price]
-                tmp_volume = self.trades[i].size
-
-            if self.cached and open_time == self.cached[0].Opentime: # if open_time != cached[0].opentime means different time scale, won't use cached data
-                candlesticks += self.cached[1:]
-                break
-
-            tmp_trades_price = np.append(tmp_trades_price, self.trades[i].price)
-            tmp_volume += self.trades[i].size
-        return candlesticks
+    def by_interval(self, interval:timedelta) -> Tuple[str, Union[List[CandleStick], CandleBatch]]:
+        """any interval, candlesticks open at multiples of interval since epoch (same as CandleStickBuilder)"""
+        interval_ns = timedelta_to_ns(interval)
+        if interval_ns <= 0:
+            raise ValueError(f'interval must be positive, wrong interval: {interval}')
+        lastest_time = self._lastest_time()
+        lastest_ns = datetime_to_ns(lastest_time)
+        open_time = lastest_time - timedelta(microseconds=(lastest_ns % interval_ns) // 1000)
+        return interval_to_str(interval), self._convert(open_time, interval)
+
+    def _convert(self, open_time:datetime, interval:timedelta) -> Union[List[CandleStick], CandleBatch]:
+        times, prices, sizes = self._to_arrays()
+        origin = datetime_to_ns(open_time)
+        interval_ns = timedelta_to_ns(interval)
+
+        cached_tail:Union[List[CandleStick], CandleBatch] = []
+        # if cached[0].Opentime is not on the same grid, means different time scale, won't use cached data
+        if self.cached and (origin - datetime_to_ns(self.cached[0].Opentime)) % interval_ns == 0:
+            cached_open_ns = datetime_to_ns(self.cached[0].Opentime)
+            # trades are DESC, count trades newer than or equal to cached[0]
+            count = int(np.searchsorted(-times, -cached_open_ns, side='right'))
+            if count < len(times):
+                # cached[0] may be a partial candlestick, rebuild it from trades and reuse older ones
+                times, prices, sizes = times[:count], prices[:count], sizes[:count]
+                cached_tail = self.cached[1:]
+
+        candlesticks = CandleBatch(*aggregate_trades(times, prices, sizes, origin, interval_ns), tz=open_time.tzinfo)
+        if len(cached_tail) <= 0:
+            # the oldest candlestick is not complete
+            candlesticks = candlesticks[:-1]
+
+        if self.as_batch:
+            if isinstance(cached_tail, list):
+                cached_tail = CandleBatch.from_candlesticks(cached_tail)
+            return CandleBatch.concat([candlesticks, cached_tail])
+        if isinstance(cached_tail, CandleBatch):
+            cached_tail = cached_tail.to_candlesticks()
+        return candlesticks.to_candlesticks() + cached_tail
+
+    def _lastest_time(self) -> datetime:
+        if self._arrays is None:
+            return self.trades[0].execution_time
+        return ns_to_datetime(self._arrays[0][0], self._tz)
+
+    def _to_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """return: times(epoch ns), prices, sizes, DESC"""
+        if self._arrays is not None:
+            return self._arrays
+        n = len(self.trades)
+        times = datetimes_to_ns([trade.execution_time for trade in self.trades])
+        prices = np.fromiter((trade.price for trade in self.trades), dtype=np.float64, count=n)
+        sizes = np.fromiter((trade.size for trade in self.trades), dtype=np.float64, count=n)
+        return times, prices, sizes
+
+class CandleStickBuilder:
+    """
+    stateful trades -> candlesticks, O(1) per trade
+     - trades must be pushed in time order (ASC)
+     - candlesticks open at multiples of interval since epoch, empty intervals have no candlestick
+     - keeps the last `capacity` candlesticks (including the open one), closed ones in a ring buffer
+    """
+    def __init__(self, interval:timedelta, capacity:int):
+        if capacity < 1:
+            raise ValueError(f'capacity must be positive, wrong capacity: {capacity}')
+        self.interval = interval
+        self.capacity = capacity
+        self._interval_ns = timedelta_to_ns(interval)
+        self._tz:Optional[tzinfo] = None
+
+        # closed candlesticks, ring buffer, _head is the lastest
+        self._opentimes = np.zeros(capacity - 1, dtype=np.int64)
+        self._opens = np.zeros(capacity - 1, dtype=np.float64)
+        self._closes = np.zeros(capacity - 1, dtype=np.float64)
+        self._highs = np.zeros(capacity - 1, dtype=np.float64)
+        self._lows = np.zeros(capacity - 1, dtype=np.float64)
+        self._volumes = np.zeros(capacity - 1, dtype=np.float64)
+        self._head = -1
+        self._closed_size = 0
+
+        # open candlestick
+        self._opentime:Optional[int] = None
+        # opentime of the candlestick closed by close(), older data is rejected while no candlestick is open
+        self._closed_opentime:Optional[int] = None
+        self._open = 0.0
+        self._close = 0.0
+        self._high = 0.0
+        self._low = 0.0
+        self._volume = 0.0
+
+    def __len__(self) -> int:
+        return self._closed_size + (1 if self._opentime is not None else 0)
+
+    def push(self, trade:Trade) -> Optional[CandleStick]:
+        """return: the candlestick closed by this trade, None if the open candlestick continues"""
+        if self._tz is None:
+            self._tz = trade.execution_time.tzinfo
+        return self.push_values(datetime_to_ns(trade.execution_time), trade.price, trade.size)
+
+    def push_values(self, time:int, price:float, size:float) -> Optional[CandleStick]:
+        """time: epoch ns"""
+        return self._push(time, price, price, price, price, size)
+
+    def _push(self, time:int, open:float, high:float, low:float, close:float, volume:float) -> Optional[CandleStick]:
+        opentime = time - time % self._interval_ns
+        if self._opentime is not None and opentime == self._opentime:
+            self._close = close
+            if high > self._high:
+                self._high = high
+            if low < self._low:
+                self._low = low
+            self._volume += volume
+            return None
+        if self._opentime is not None and opentime < self._opentime:
+            raise ValueError(f'data must be pushed in time order, time(ns): {time}, open candlestick(ns): {self._opentime}')
+        if self._opentime is None and self._closed_opentime is not None and opentime <= self._closed_opentime:
+            raise ValueError(f'candlestick is already closed, time(ns): {time}, closed candlestick(ns): {self._closed_opentime}')
+
+        closed = self._close_candlestick()
+        self._opentime = opentime
+        self._open = open
+        self._high = high
+        self._low = low
+        self._close = close
+        self._volume = volume
+        return closed
+
+    def extend(self, trades:Iterable[Trade]) -> None:
+        """trades: ASC"""
+        for trade in trades:
+            self.push(trade)
+
+    def close(self) -> Optional[CandleStick]:
+        """
+        close the open candlestick without a newer trade, e.g. its interval has ended
+        return: the closed candlestick, None if no candlestick is open
+        """
+        closed = self._close_candlestick()
+        if closed is not None:
+            self._closed_opentime = self._opentime
+            self._opentime = None
+        return closed
+
+    def is_late(self, time:int) -> bool:
+        """time(epoch ns) belongs to a candlestick already closed, push would raise ValueError"""
+        opentime = time - time % self._interval_ns
+        latest = self._opentime if self._opentime is not None else self._closed_opentime
+        return latest is not None and (opentime < latest or (self._opentime is None and opentime == latest))
+
+    def push_batch(self, trades:TradeBatch) -> CandleBatch:
+        """
+        vectorized push, trades: DESC (TradeBatch order), all newer than pushed ones
+        return: candlesticks closed by these trades, DESC
+        """
+        if len(trades) <= 0:
+            return CandleBatch.empty(self._tz)
+        if self._tz is None:
+            self._tz = trades.tz
+        # ASC views
+        opentimes, opens, closes, highs, lows, volumes = [
+            column[::-1] for column in aggregate_trades(trades.times, trades.prices, trades.sizes, 0, self._interval_ns)]
+        if self._opentime is not None and opentimes[0] < self._opentime:
+            raise ValueError(f'trades must be pushed in time order, trade time(ns): {int(trades.times[-1])}, open candlestick(ns): {self._opentime}')
+        if self._opentime is None and self._closed_opentime is not None and opentimes[0] <= self._closed_opentime:
+            raise ValueError(f'candlestick is already closed, trade time(ns): {int(trades.times[-1])}, closed candlestick(ns): {self._closed_opentime}')
+
+        start = 0
+        if self._opentime is not None and opentimes[0] == self._opentime:
+            self._close = float(closes[0])
+            self._high = max(self._high, float(highs[0]))
+            self._low = min(self._low, float(lows[0]))
+            self._volume += float(volumes[0])
+            start = 1
+        if start == len(opentimes):
+            return CandleBatch.empty(self._tz)
+
+        # closed: current open candlestick + all new ones except the lastest
+        closed = [opentimes[start:-1], opens[start:-1], closes[start:-1], highs[start:-1], lows[start:-1], volumes[start:-1]]
+        if self._opentime is not None:
+            current = [self._opentime, self._open, self._close, self._high, self._low, self._volume]
+            closed = [np.concatenate(([value], column)) for value, column in zip(current, closed)]
+        self._append_closed(*closed)
+
+        self._opentime = int(opentimes[-1])
+        self._open = float(opens[-1])
+        self._close = float(closes[-1])
+        self._high = float(highs[-1])
+        self._low = float(lows[-1])
+        self._volume = float(volumes[-1])
+        return CandleBatch(*[column[::-1] for column in closed], tz=self._tz)
+
+    def _append_closed(self, opentimes:np.ndarray, opens:np.ndarray, closes:np.ndarray, highs:np.ndarray, lows:np.ndarray, volumes:np.ndarray) -> None:
+        """ASC arrays into ring buffer, only the last capacity - 1 are kept"""
+        size = self.capacity - 1
+        if size <= 0 or len(opentimes) <= 0:
+            return
+        count = min(len(opentimes), size)
+        index = (self._head + 1 + np.arange(count)) % size
+        for ring, column in ((self._opentimes, opentimes), (self._opens, opens), (self._closes, closes),
+                             (self._highs, highs), (self._lows, lows), (self._volumes, volumes)):
+            ring[index] = column[-count:]
+        self._head = int(index[-1])
+        self._closed_size = min(self._closed_size + count, size)
+
+    def _close_candlestick(self) -> Optional[CandleStick]:
+        if self._opentime is None:
+            return None
+        closed = CandleStick(
+            Open=self._open,
+            Close=self._close,
+            High=self._high,
+            Low=self._low,
+            Volume=self._volume,
+            Opentime=ns_to_datetime(self._opentime, self._tz),
+        )
+        if self.capacity > 1:
+            # overwrite the oldest one when full
+            self._head = (self._head + 1) % (self.capacity - 1)
+            self._opentimes[self._head] = self._opentime
+            self._opens[self._head] = self._open
+            self._closes[self._head] = self._close
+            self._highs[self._head] = self._high
+            self._lows[self._head] = self._low
+            self._volumes[self._head] = self._volume
+            self._closed_size = min(self._closed_size + 1, self.capacity - 1)
+        return closed
+
+    @property
+    def opentime(self) -> Optional[int]:
+        """epoch ns of the open candlestick, None if no candlestick is open"""
+        return self._opentime
+
+    @property
+    def open_candlestick(self) -> Optional[CandleStick]:
+        if self._opentime is None:
+            return None
+        return CandleStick(
+            Open=self._open,
+            Close=self._close,
+            High=self._high,
+            Low=self._low,
+            Volume=self._volume,
+            Opentime=ns_to_datetime(self._opentime, self._tz),
+        )
+
+    def to_batch(self) -> CandleBatch:
+        """DESC, the open candlestick is the first one, only closed ones after close()"""
+        index = (self._head - np.arange(self._closed_size)) % max(self.capacity - 1, 1)
+        if self._opentime is None:
+            if self._closed_size <= 0:
+                return CandleBatch.empty(self._tz)
+            return CandleBatch(
+                self._opentimes[index], self._opens[index], self._closes[index],
+                self._highs[index], self._lows[index], self._volumes[index], self._tz)
+        return CandleBatch(
+            opentimes=np.concatenate(([self._opentime], self._opentimes[index])),
+            opens=np.concatenate(([self._open], self._opens[index])),
+            closes=np.concatenate(([self._close], self._closes[index])),
+            highs=np.concatenate(([self._high], self._highs[index])),
+            lows=np.concatenate(([self._low], self._lows[index])),
+            volumes=np.concatenate(([self._volume], self._volumes[index])),
+            tz=self._tz,
+        )
+
+    def candlesticks(self) -> List[CandleStick]:
+        """DESC, the open candlestick is the first one"""
+        return self.to_batch().to_candlesticks()
+
+def rollup_candlesticks(candlesticks:CandleBatch, interval:timedelta) -> CandleBatch:
+    """
+    vectorized roll up to a bigger interval, candlesticks: DESC
+    interval must be a multiple of candlesticks' interval, result opens at multiples of interval since epoch
+    """
+    if len(candlesticks) <= 0:
+        return CandleBatch.empty(candlesticks.tz)
+    interval_ns = timedelta_to_ns(interval)
+    buckets = candlesticks.opentimes // interval_ns
+    starts = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(candlesticks)]))
+    return CandleBatch(
+        opentimes=buckets[starts] * interval_ns,
+        opens=candlesticks.opens[ends - 1],
+        closes=candlesticks.closes[starts],
+        highs=np.maximum.reduceat(candlesticks.highs, starts),
+        lows=np.minimum.reduceat(candlesticks.lows, starts),
+        volumes=np.add.reduceat(candlesticks.volumes, starts),
+        tz=candlesticks.tz,
+    )
+
+_INTERVAL_UNITS = [('d', timedelta(days=1)), ('h', timedelta(hours=1)), ('m', timedelta(minutes=1)), ('s', timedelta(seconds=1))]
+
+def parse_interval(interval:str) -> timedelta:
+    """\"5m\" -> timedelta(minutes=5), unit must be \"s\", \"m\", \"h\", \"d\""""
+    for unit, delta in _INTERVAL_UNITS:
+        if interval.endswith(unit) and interval[:-1].isdigit() and int(interval[:-1]) > 0:
+            return int(interval[:-1]) * delta
+    raise ValueError(f'invalid interval: {interval}, must be like \"30s\", \"5m\", \"1h\", \"1d\"')
+
+def smallest_interval(intervals:List[str]) -> str:
+    """the interval built from trades, others are rolled up from it and must be its multiples"""
+    if not intervals:
+        raise ValueError('intervals is empty')
+    deltas = {interval: parse_interval(interval) for interval in intervals}
+    base = min(intervals, key=lambda interval: deltas[interval])
+    for interval, delta in deltas.items():
+        if delta % deltas[base] != timedelta(0):
+            raise ValueError(f'{interval} is not a multiple of {base}')
+    return base
+
+def interval_to_str(interval:timedelta) -> str:
+    """timedelta(minutes=60) -> \"1h\", biggest unit which divides interval"""
+    for unit, delta in _INTERVAL_UNITS:
+        if interval >= delta and interval % delta == timedelta(0):
+            return f'{interval // delta}{unit}'
+    raise ValueError(f'interval must be whole seconds, wrong interval: {interval}')
+
+def aggregate_trades(times:np.ndarray, prices:np.ndarray, sizes:np.ndarray, origin:int, interval:int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    columnar OHLCV aggregation, one pass without python loop
+     - times: epoch ns, sorted DESC (same order with List[Trade])
+     - origin: epoch ns of any candlestick open time, candlesticks open at origin + k * interval
+     - interval: ns
+    return: opentimes(epoch ns), opens, closes, highs, lows, volumes, DESC, only buckets which have trades
+    """
+    if len(times) <= 0:
+        empty = np.empty(0, dtype=np.float64)
+        return np.empty(0, dtype=np.int64), empty, empty, empty, empty, empty
+
+    buckets = (times - origin) // interval
+    starts = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(times)]))
+
+    opentimes = origin + buckets[starts] * interval
+    # DESC, first trade in bucket is the lastest one
+    opens = prices[ends - 1]
+    closes = prices[starts]
+    highs = np.maximum.reduceat(prices, starts)
+    lows = np.minimum.reduceat(prices, starts)
+    volumes = np.add.reduceat(sizes, starts)
+    return opentimes, opens, closes, highs, lows, volumes
 
 def convert_dataclass_to_dataframe(data: List, index_field:Optional[str]=None) -> pd.DataFrame:
     if not data:
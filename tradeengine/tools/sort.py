@@ -0,0 +1,35 @@
+"""
+DESC ordering of epoch ns timestamp arrays (TradeBatch.times)
+"""
+from typing import List
+
+import numpy as np
+
+def is_sorted_desc(times:np.ndarray) -> bool:
+    """O(n)"""
+    return len(times) <= 1 or bool(np.all(times[:-1] >= times[1:]))
+
+def argsort_desc(times:np.ndarray) -> np.ndarray:
+    """stable (ties keep input order), O(n) if already sorted"""
+    if is_sorted_desc(times):
+        return np.arange(len(times))
+    return np.argsort(-times, kind='stable')
+
+def merge_desc(pages:List[np.ndarray]) -> np.ndarray:
+    """
+    k-way merge of pages which are sorted DESC each (e.g. db or api pages in any order)
+    return: indexes into np.concatenate(pages) in DESC order, ties keep their order within a page
+     - pages which do not overlap are only ordered by their newest time, O(n + k log k)
+     - else stable sort of the concatenation, which merges the sorted runs (timsort), O(n log k)
+    """
+    pages = [page for page in pages if len(page) > 0]
+    offsets = np.cumsum([0] + [len(page) for page in pages])
+    if not pages:
+        return np.empty(0, dtype=np.int64)
+
+    order = sorted(range(len(pages)), key=lambda i: -int(pages[i][0]))
+    if all(int(pages[order[j]][-1]) >= int(pages[order[j + 1]][0]) for j in range(len(order) - 1)):
+        if order == sorted(order):
+            return np.arange(offsets[-1])
+        return np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in order])
+    return np.argsort(-np.concatenate(pages), kind='stable')